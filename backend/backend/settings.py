@@ -21,6 +21,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "django.middleware.security.SecurityMiddleware",
+    "cart.instrumentation.PricingMetricsMiddleware",
+    "cart.db_router.ReplicaPinningMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
@@ -50,26 +52,129 @@ TEMPLATES = [
 WSGI_APPLICATION = "backend.wsgi.application"
 
 # Database
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.postgresql",
-        "NAME": os.environ.get("POSTGRES_DB"),
-        "USER": os.environ.get("POSTGRES_USER"),
-        "PASSWORD": os.environ.get("POSTGRES_PASSWORD"),
-        "HOST": os.environ.get("POSTGRES_HOST"),
-        "PORT": os.environ.get("POSTGRES_PORT"),
+# DB_ENGINE=sqlite runs on a local SQLite file with no outside services
+# (benchmarks, quick local runs); the default is PostgreSQL.
+DB_ENGINE = os.environ.get("DB_ENGINE", "postgresql")
+if DB_ENGINE == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("SQLITE_PATH", BASE_DIR / "db.sqlite3"),
+        }
+    }
+    # SQLite has no covering indexes, so the cart line constraint is created
+    # by migration 0006 as a plain unique index
+    SILENCED_SYSTEM_CHECKS = ["models.W039"]
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("POSTGRES_DB"),
+            "USER": os.environ.get("POSTGRES_USER"),
+            "PASSWORD": os.environ.get("POSTGRES_PASSWORD"),
+            "HOST": os.environ.get("POSTGRES_HOST"),
+            "PORT": os.environ.get("POSTGRES_PORT"),
+        }
     }
-}
 
-# Redis cache
-CACHES = {
-    "default": {
-        "BACKEND": "django_redis.cache.RedisCache",
-        "LOCATION": os.environ.get("REDIS_URL"),
-        "OPTIONS": {
-            "CLIENT_CLASS": "django_redis.client.DefaultClient",
+# Reuse database connections instead of opening one per request. With
+# DB_POOL_MAX_SIZE set, psycopg's connection pool bounds the connections
+# each worker process holds; otherwise connections persist for
+# CONN_MAX_AGE seconds.
+DB_POOL_MAX_SIZE = int(os.environ.get("DB_POOL_MAX_SIZE", 0))
+if DB_POOL_MAX_SIZE and DB_ENGINE != "sqlite":
+    DATABASES["default"]["OPTIONS"] = {
+        "pool": {
+            "min_size": int(os.environ.get("DB_POOL_MIN_SIZE", 2)),
+            "max_size": DB_POOL_MAX_SIZE,
+            "timeout": int(os.environ.get("DB_POOL_TIMEOUT", 10)),
         },
     }
+else:
+    DATABASES["default"]["CONN_MAX_AGE"] = int(os.environ.get("CONN_MAX_AGE", 60))
+    DATABASES["default"]["CONN_HEALTH_CHECKS"] = True
+
+# Read replicas for catalog and pricing-rule reads, with the primary's
+# credentials and options: DB_REPLICA_HOSTS=host1,host2 for PostgreSQL, or
+# SQLITE_REPLICA_PATHS=a.sqlite3,b.sqlite3 for local runs. Reads stay on
+# the primary for DATABASE_REPLICA_PIN_SECONDS after a write in the same
+# session, cart or catalog; keep it above the replicas' usual lag.
+if DB_ENGINE == "sqlite":
+    REPLICA_SETTINGS = [{"NAME": path} for path in os.environ.get("SQLITE_REPLICA_PATHS", "").split(",") if path]
+else:
+    REPLICA_SETTINGS = [{"HOST": host} for host in os.environ.get("DB_REPLICA_HOSTS", "").split(",") if host]
+DATABASE_REPLICAS = []
+for number, replica in enumerate(REPLICA_SETTINGS, start=1):
+    alias = f"replica_{number}"
+    DATABASES[alias] = {**DATABASES["default"], **replica, "TEST": {"MIRROR": "default"}}
+    DATABASE_REPLICAS.append(alias)
+DATABASE_ROUTERS = ["cart.db_router.ReplicaRouter"]
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get("DATABASE_REPLICA_PIN_SECONDS", 5))
+
+# Redis cache; without REDIS_URL an in-process cache is used instead
+if os.environ.get("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django_redis.cache.RedisCache",
+            "LOCATION": os.environ.get("REDIS_URL"),
+            "OPTIONS": {
+                "CLIENT_CLASS": "django_redis.client.DefaultClient",
+            },
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Sessions are read from the cache and written through to the database, so
+# a cache flush does not log anyone out or lose their cart. SESSION_ENGINE=
+# django.contrib.sessions.backends.cache skips the database entirely
+SESSION_ENGINE = os.environ.get("SESSION_ENGINE", "django.contrib.sessions.backends.cached_db")
+
+# Pricing
+PRICING_BATCH_MAX_CARTS = int(os.environ.get("PRICING_BATCH_MAX_CARTS", 1000))
+
+# Active min_total rules above this cart total are left out of the live rule
+# set as unreachable; unset keeps every threshold
+PRICING_MAX_CART_TOTAL = os.environ.get("PRICING_MAX_CART_TOTAL") or None
+
+# Memoized calculate-cart results for carts of up to MAX_LINES distinct
+# products: entries kept in each process's LRU, and seconds an entry lives
+# there and in the shared cache. A size of 0 turns memoization off
+PRICING_QUOTE_CACHE_SIZE = int(os.environ.get("PRICING_QUOTE_CACHE_SIZE", 10000))
+PRICING_QUOTE_CACHE_TTL = int(os.environ.get("PRICING_QUOTE_CACHE_TTL", 300))
+PRICING_QUOTE_CACHE_MAX_LINES = int(os.environ.get("PRICING_QUOTE_CACHE_MAX_LINES", 3))
+
+# Most product ids accepted by one /api/products/promotions/?ids= request
+PRICING_PROMOTIONS_MAX_IDS = int(os.environ.get("PRICING_PROMOTIONS_MAX_IDS", 500))
+# Per-product promotion entries kept in each process's LRU
+PRICING_PROMOTIONS_CACHE_SIZE = int(os.environ.get("PRICING_PROMOTIONS_CACHE_SIZE", 10000))
+
+# Most stored carts one /api/pricing-rules/simulate/ request replays
+PRICING_SIMULATION_MAX_CARTS = int(os.environ.get("PRICING_SIMULATION_MAX_CARTS", 1_000_000))
+
+# Warm the pricing path (compiled rules, quotes for the most-carted
+# products, URLs and serializers) in a background thread as each worker
+# starts; the API-only profile (backend.settings_api) turns it on
+PRICING_WARM_UP = bool(int(os.environ.get("PRICING_WARM_UP", 0)))
+PRICING_WARM_UP_PRODUCTS = int(os.environ.get("PRICING_WARM_UP_PRODUCTS", 200))
+
+# Share of requests that record query, rule, cache and serialization
+# metrics (Server-Timing header and /api/metrics/); 0 turns recording off
+PRICING_METRICS_SAMPLE_RATE = float(os.environ.get("PRICING_METRICS_SAMPLE_RATE", 1.0))
+
+# Route the calculate-cart, cart and cart-items endpoints to the async views
+# when the app is served by an ASGI server
+ASYNC_VIEWS = bool(int(os.environ.get("ASYNC_VIEWS", 0)))
+
+REST_FRAMEWORK = {
+    "DEFAULT_RENDERER_CLASSES": [
+        "cart.instrumentation.TimedJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ],
 }
 
 # Static files
@@ -0,0 +1,52 @@
+"""
+API-only settings for pricing workers.
+
+Serves the /api/ endpoints with the apps and middleware they need: no
+admin, messages or staticfiles, no browsable API, and the pricing path
+warmed as each worker starts (PRICING_WARM_UP). Everything else, including
+the database, cache and pricing settings, comes from backend.settings.
+
+    DJANGO_SETTINGS_MODULE=backend.settings_api uvicorn backend.asgi:application
+
+Migrations for the dropped apps are applied by the full settings.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+from .settings import INSTALLED_APPS, MIDDLEWARE, REST_FRAMEWORK, TEMPLATES
+
+UNUSED_APPS = {
+    "django.contrib.admin",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+}
+INSTALLED_APPS = [app for app in INSTALLED_APPS if app not in UNUSED_APPS]
+
+# Messages are gone with their app, and JSON responses are never framed
+UNUSED_MIDDLEWARE = {
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+}
+MIDDLEWARE = [middleware for middleware in MIDDLEWARE if middleware not in UNUSED_MIDDLEWARE]
+
+TEMPLATES = [
+    {
+        **TEMPLATES[0],
+        "OPTIONS": {
+            "context_processors": [
+                processor
+                for processor in TEMPLATES[0]["OPTIONS"]["context_processors"]
+                if processor != "django.contrib.messages.context_processors.messages"
+            ],
+        },
+    },
+]
+
+REST_FRAMEWORK = {
+    **REST_FRAMEWORK,
+    "DEFAULT_RENDERER_CLASSES": ["cart.instrumentation.TimedJSONRenderer"],
+}
+
+ROOT_URLCONF = "backend.urls_api"
+
+PRICING_WARM_UP = bool(int(os.environ.get("PRICING_WARM_UP", 1)))
@@ -0,0 +1,6 @@
+"""URLs for the API-only settings profile: the cart API without admin, login views or static files"""
+from django.urls import path, include
+
+urlpatterns = [
+    path('api/', include('cart.urls')),
+]
@@ -0,0 +1,99 @@
+"""
+CPU cost per request of POST /api/calculate-cart/ for 1, 20 and 200-line
+carts, comparing the serializer-validated request/response path with the
+lean parser and direct result writer.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_calculate_view [--iterations 500]
+"""
+import argparse
+import time
+from decimal import Decimal
+
+from .support import measure, setup_django, summarize, test_database
+
+CART_SIZES = (1, 20, 200)
+
+
+def build_views():
+    from rest_framework import status
+    from rest_framework.response import Response
+    from rest_framework.views import APIView
+
+    from cart.serializers import CartCalculationSerializer, CartItemInputSerializer
+    from cart.services import PricingService
+    from cart.views import CalculateCartView
+
+    class SerializerCalculateCartView(APIView):
+        """The previous request/response path, kept here as the baseline"""
+
+        def post(self, request):
+            input_serializer = CartItemInputSerializer(data=request.data, many=True)
+            if input_serializer.is_valid():
+                result = PricingService.calculate_cart_total(input_serializer.validated_data)
+                output_serializer = CartCalculationSerializer(data=result)
+                if output_serializer.is_valid():
+                    return Response(output_serializer.validated_data)
+                return Response(output_serializer.errors, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            return Response(input_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    return {
+        "serializers": SerializerCalculateCartView.as_view(),
+        "lean": CalculateCartView.as_view(),
+    }
+
+
+def seed():
+    from cart.models import PricingRule, Product
+
+    products = Product.objects.bulk_create(
+        Product(name=f"Product {i}", price=Decimal("1.25") * (i % 40 + 1)) for i in range(max(CART_SIZES))
+    )
+    PricingRule.objects.create(
+        name="5% over 50", rule_type="percentage_discount", condition_type="min_total",
+        condition_value={"min_amount": 50}, discount_value={"percentage": 5},
+    )
+    PricingRule.objects.create(
+        name="Buy 3 get 1", rule_type="buy_x_get_y", condition_type="product_based",
+        condition_value={"product_id": products[0].id, "buy_quantity": 3, "get_free_quantity": 1},
+        discount_value={}, priority=1,
+    )
+    return products
+
+
+def run(iterations):
+    from rest_framework.test import APIRequestFactory
+
+    products = seed()
+    views = build_views()
+    factory = APIRequestFactory()
+
+    print(f"{'lines':>6} {'path':>12} {'mean cpu us':>12} {'p50 us':>10} {'p99 us':>10}")
+    for size in CART_SIZES:
+        payload = [{"product_id": product.id, "quantity": 3} for product in products[:size]]
+        means = {}
+        for name, view in views.items():
+            def request():
+                response = view(factory.post("/api/calculate-cart/", payload, format="json"))
+                response.render()
+
+            measure(request, 20)
+            stats = summarize(measure(request, iterations, clock=time.process_time))
+            means[name] = stats["mean_us"]
+            print(f"{size:>6} {name:>12} {stats['mean_us']:>12.1f} {stats['p50_us']:>10.1f} {stats['p99_us']:>10.1f}")
+        print(f"{'':>6} {'cpu drop':>12} {100 * (1 - means['lean'] / means['serializers']):>11.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=500)
+    args = parser.parse_args()
+
+    setup_django()
+    with test_database():
+        run(args.iterations)
+
+
+if __name__ == "__main__":
+    main()
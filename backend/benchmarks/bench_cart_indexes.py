@@ -0,0 +1,116 @@
+"""
+Lookup latency for the hot cart and rule queries with and without the
+indexes added in cart.0002_hot_lookup_indexes.
+
+Seeds a test database with many carts (one line each) and a large rule
+table, times the lookups with the app migrated back to 0001, then
+migrates forward and times them again.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_cart_indexes [--carts 1000000] [--rules 20000] [--lookups 2000]
+"""
+import argparse
+import random
+from decimal import Decimal
+
+from .support import measure, setup_django, summarize, test_database
+
+BATCH_SIZE = 10_000
+
+
+def seed(carts, rules):
+    from cart.models import Cart, CartItem, PricingRule, Product
+
+    products = Product.objects.bulk_create(
+        Product(name=f"Product {i}", price=Decimal("9.99")) for i in range(100)
+    )
+    for start in range(0, carts, BATCH_SIZE):
+        count = min(BATCH_SIZE, carts - start)
+        batch = Cart.objects.bulk_create(
+            Cart(session_key=f"session-{start + i:09d}") for i in range(count)
+        )
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=products[cart.id % len(products)], quantity=1) for cart in batch
+        )
+        print(f"\rseeded {start + count:,}/{carts:,} carts", end="", flush=True)
+    print()
+
+    # Only a small share of rules is live at any time
+    PricingRule.objects.bulk_create(
+        [
+            PricingRule(
+                name=f"Rule {i}", rule_type="percentage_discount", condition_type="min_total",
+                condition_value={"min_amount": i}, discount_value={"percentage": 1},
+                is_active=i % 50 == 0, priority=i % 10,
+            )
+            for i in range(rules)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+    return list(Cart.objects.values_list("id", "session_key")[:: max(1, carts // 5000)]), products
+
+
+def analyze(connection):
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+
+
+def run_lookups(samples, products, lookups):
+    from cart.models import Cart, CartItem, PricingRule
+
+    rng = random.Random(1)
+
+    def session_lookup():
+        Cart.objects.get(session_key=rng.choice(samples)[1])
+
+    def active_rules():
+        list(PricingRule.objects.filter(is_active=True).order_by("-priority", "id").values_list("id", flat=True))
+
+    def cart_line():
+        cart_id, _ = rng.choice(samples)
+        list(CartItem.objects.filter(cart_id=cart_id, product=products[cart_id % len(products)])
+             .values_list("quantity", flat=True))
+
+    return {
+        name: summarize(measure(func, lookups))
+        for name, func in (
+            ("cart by session_key", session_lookup),
+            ("active rules ordered", active_rules),
+            ("cart line quantity", cart_line),
+        )
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--carts", type=int, default=1_000_000)
+    parser.add_argument("--rules", type=int, default=20_000)
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    setup_django()
+    from django.core.management import call_command
+
+    with test_database() as connection:
+        samples, products = seed(args.carts, args.rules)
+
+        call_command("migrate", "cart", "0001", verbosity=0)
+        analyze(connection)
+        before = run_lookups(samples, products, args.lookups)
+
+        call_command("migrate", "cart", verbosity=0)
+        analyze(connection)
+        after = run_lookups(samples, products, args.lookups)
+
+    print(f"{'lookup':<22} {'before p50 us':>14} {'after p50 us':>13} {'before p99 us':>14} {'after p99 us':>13}")
+    for name in before:
+        print(
+            f"{name:<22} {before[name]['p50_us']:>14.1f} {after[name]['p50_us']:>13.1f} "
+            f"{before[name]['p99_us']:>14.1f} {after[name]['p99_us']:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
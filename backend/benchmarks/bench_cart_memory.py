@@ -0,0 +1,105 @@
+"""
+Memory held by priced carts kept in process, before and after compact
+line records.
+
+Prices --carts synthetic carts in one batch, the way batch jobs and
+simulations hold them, and reports the memory still allocated once every
+result is built (tracemalloc), per cart and per line:
+
+- before: products loaded as full Product model instances, and every line
+  and applied rule as a dict with string keys, as the pricing service
+  used to do;
+- after: products loaded as ProductRecords from (id, name, price) only,
+  with interned names, and lines and applied rules as slotted LineItem
+  and AppliedRule records.
+
+Usage (from the backend directory):
+
+    DB_ENGINE=sqlite python -m benchmarks.bench_cart_memory [--carts 10000] [--lines 5] [--products 2000]
+"""
+import argparse
+import gc
+import random
+import tracemalloc
+
+from .support import setup_django, test_database
+
+
+def traced(build):
+    """Call build and return its result with the bytes it retains and its peak"""
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current - baseline, peak - baseline
+
+
+def price_before(carts, rule_set):
+    from cart.engine import CartLine, price_cart
+    from cart.models import Product
+
+    products = Product.objects.in_bulk({item["product_id"] for cart_data in carts for item in cart_data})
+    results = []
+    for cart_data in carts:
+        result = price_cart([CartLine(item["product_id"], item["quantity"]) for item in cart_data], products, rule_set)
+        result["items"] = [item.as_dict() for item in result["items"]]
+        result["applied_rules"] = [rule.as_dict() for rule in result["applied_rules"]]
+        results.append(result)
+    return products, results
+
+
+def price_after(carts, rule_set):
+    from cart.engine import CartLine, price_cart
+    from cart.services import PricingService
+
+    products = PricingService.load_product_records(item["product_id"] for cart_data in carts for item in cart_data)
+    results = [
+        price_cart([CartLine(item["product_id"], item["quantity"]) for item in cart_data], products, rule_set)
+        for cart_data in carts
+    ]
+    return products, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--carts", type=int, default=10_000)
+    parser.add_argument("--lines", type=int, default=5)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--rules", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    setup_django()
+    from cart.rule_cache import get_active_rule_set
+
+    from .generators import generate_carts, generate_products, generate_rules
+
+    rng = random.Random(args.seed)
+    with test_database():
+        products = generate_products(args.products, rng)
+        generate_rules(args.rules, products, rng)
+        carts = generate_carts(args.carts, args.lines, products, rng)
+        rule_set = get_active_rule_set()
+
+        rows = []
+        for name, price in (("before", price_before), ("after", price_after)):
+            _, retained, peak = traced(lambda: price(carts, rule_set))
+            rows.append((name, retained, peak))
+
+    lines = args.carts * args.lines
+    print(f"{args.carts:,} carts x {args.lines} lines, {args.products:,} products")
+    print(f"{'layout':<8} {'retained MiB':>13} {'peak MiB':>9} {'bytes/cart':>11} {'bytes/line':>11}")
+    for name, retained, peak in rows:
+        print(
+            f"{name:<8} {retained / 2**20:>13.1f} {peak / 2**20:>9.1f} "
+            f"{retained / args.carts:>11.0f} {retained / lines:>11.0f}"
+        )
+    before, after = rows[0][1], rows[1][1]
+    print(f"after holds {after / before:.0%} of the memory held before")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Worker startup time and first-request latency, for the full settings and
+the API-only profile, with and without the startup warm-up.
+
+Each run starts a fresh Python process that builds the WSGI application
+and sends requests straight to it, against a seeded SQLite database:
+
+- startup: importing Django, django.setup() and building the application;
+- warm-up: from then until the background warm-up finishes (PRICING_WARM_UP);
+- first cart: the first POST /api/calculate-cart/ of a 5-line cart of
+  popular products, too long to be memoized, so it pays every cold path;
+- first quote: the next request, one unit of the most-carted product,
+  which the warm-up has already priced;
+- steady cart: median of the next 5-line carts, for comparison.
+
+Every column is the median over --runs processes.
+
+Usage (from the backend directory):
+
+    python -m benchmarks.bench_startup [--runs 5] [--products 2000] [--carts 2000]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .support import setup_django
+
+PROFILES = (
+    ("full", "backend.settings", "0"),
+    ("full+warm", "backend.settings", "1"),
+    ("api", "backend.settings_api", "0"),
+    ("api+warm", "backend.settings_api", "1"),
+)
+COLUMNS = ("startup_ms", "warm_up_ms", "first_cart_ms", "first_quote_ms", "steady_cart_ms", "modules")
+CART_LINES = 5
+STEADY_REQUESTS = 20
+
+
+def seed(args):
+    """Migrate the database named by SQLITE_PATH, fill it and print the hot product ids"""
+    setup_django()
+    from django.core.management import call_command
+
+    from cart.warmup import hot_product_ids
+
+    from .generators import generate_products, generate_rules, generate_stored_carts
+
+    rng = random.Random(args.seed)
+    call_command("migrate", verbosity=0)
+    products = generate_products(args.products, rng)
+    generate_rules(args.rules, products, rng)
+    # Carts cover a small slice of the catalog, so there are clear hot products
+    generate_stored_carts(args.carts, 3, products[:100], rng)
+    print(json.dumps(hot_product_ids(CART_LINES * (STEADY_REQUESTS + 1))))
+
+
+def post(application, path, payload):
+    """Send one JSON POST through the WSGI application; only 200 responses are timed"""
+    from wsgiref.util import setup_testing_defaults
+
+    body = json.dumps(payload).encode()
+    environ = {
+        "REQUEST_METHOD": "POST",
+        "PATH_INFO": path,
+        "CONTENT_TYPE": "application/json",
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.input": io.BytesIO(body),
+    }
+    setup_testing_defaults(environ)
+    statuses = []
+    response = application(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    b"".join(response)
+    response.close()
+    if not statuses[0].startswith("200"):
+        raise RuntimeError(f"POST {path} returned {statuses[0]}")
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - started) * 1000
+
+
+def measure(hot):
+    """One fresh process: print its timings as JSON"""
+    started = time.perf_counter()
+    from django.core.wsgi import get_wsgi_application
+
+    application = get_wsgi_application()
+    startup_ms = (time.perf_counter() - started) * 1000
+
+    from django.conf import settings
+
+    warm_up_ms = 0.0
+    if settings.PRICING_WARM_UP:
+        from cart.warmup import finished
+
+        warm_up_ms = timed(finished.wait)
+
+    # The hot product ids come from the parent, so nothing touches the
+    # database before the first request
+    carts = [
+        [{"product_id": product_id, "quantity": 1} for product_id in hot[index:index + CART_LINES]]
+        for index in range(0, len(hot) - CART_LINES + 1, CART_LINES)
+    ]
+    path = "/api/calculate-cart/"
+    first_cart_ms = timed(post, application, path, carts[0])
+    first_quote_ms = timed(post, application, path, [{"product_id": hot[0], "quantity": 1}])
+    steady = [timed(post, application, path, cart) for cart in carts[1:]]
+
+    print(json.dumps({
+        "startup_ms": startup_ms,
+        "warm_up_ms": warm_up_ms,
+        "first_cart_ms": first_cart_ms,
+        "first_quote_ms": first_quote_ms,
+        "steady_cart_ms": statistics.median(steady),
+        "modules": len(sys.modules),
+    }))
+
+
+def run_child(mode, env, args, hot=()):
+    command = [sys.executable, "-m", "benchmarks.bench_startup", "--child", mode]
+    command += [f"--{name}={getattr(args, name)}" for name in ("products", "rules", "carts", "seed")]
+    command += [f"--hot={','.join(map(str, hot))}"]
+    completed = subprocess.run(
+        command, env=env, check=True, capture_output=True, text=True,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    return completed.stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--products", type=int, default=2000)
+    parser.add_argument("--rules", type=int, default=50)
+    parser.add_argument("--carts", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--child", choices=("seed", "measure"), help=argparse.SUPPRESS)
+    parser.add_argument("--hot", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == "seed":
+        return seed(args)
+    if args.child == "measure":
+        return measure([int(product_id) for product_id in args.hot.split(",")])
+
+    with tempfile.TemporaryDirectory() as directory:
+        env = {
+            **os.environ,
+            "DB_ENGINE": "sqlite",
+            "SQLITE_PATH": os.path.join(directory, "startup.sqlite3"),
+            "SECRET_KEY": os.environ.get("SECRET_KEY", "benchmark-only-secret-key"),
+        }
+        env.pop("REDIS_URL", None)
+        hot = json.loads(run_child("seed", {**env, "DJANGO_SETTINGS_MODULE": "backend.settings"}, args))
+
+        rows = []
+        for name, settings_module, warm_up in PROFILES:
+            profile_env = {**env, "DJANGO_SETTINGS_MODULE": settings_module, "PRICING_WARM_UP": warm_up}
+            runs = [json.loads(run_child("measure", profile_env, args, hot)) for _ in range(args.runs)]
+            rows.append((name, {column: statistics.median(run[column] for run in runs) for column in COLUMNS}))
+
+    print(f"{args.runs} runs per profile, {args.products:,} products, {args.rules} rules, {args.carts:,} carts")
+    print(f"{'profile':<10} " + " ".join(f"{column:>15}" for column in COLUMNS))
+    for name, values in rows:
+        print(f"{name:<10} " + " ".join(f"{values[column]:>15.1f}" for column in COLUMNS))
+
+
+if __name__ == "__main__":
+    main()
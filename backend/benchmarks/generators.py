@@ -0,0 +1,108 @@
+"""
+Deterministic synthetic catalogs, pricing rules and carts for benchmarks.
+
+Every generator takes a random.Random so that a seed reproduces the same
+data on SQLite and PostgreSQL.
+"""
+import itertools
+from decimal import Decimal
+
+BATCH_SIZE = 5000
+
+
+def generate_products(count, rng):
+    """Create count products with prices between 0.50 and 500.00"""
+    from cart.models import Product
+
+    return Product.objects.bulk_create(
+        (
+            Product(
+                sku=f"BENCH-{i:07d}",
+                name=f"Product {i}",
+                price=Decimal(rng.randint(50, 50_000)) / 100,
+            )
+            for i in range(count)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+
+
+def rule_combinations():
+    """Every (rule_type, condition_type) pair the models allow"""
+    from cart.models import PricingRule
+
+    return list(itertools.product(
+        [rule_type for rule_type, _ in PricingRule.RULE_TYPES],
+        [condition_type for condition_type, _ in PricingRule.CONDITION_TYPES],
+    ))
+
+
+def rule_values(rule_type, condition_type, products, rng):
+    """condition_value and discount_value for one rule of the given kind"""
+    condition_value = {}
+    if condition_type == "min_total":
+        condition_value["min_amount"] = rng.choice([0, 25, 100, 500, 2500])
+    elif condition_type == "min_quantity":
+        condition_value["min_quantity"] = rng.choice([1, 3, 10, 50])
+    else:
+        condition_value["product_id"] = rng.choice(products).id
+        condition_value["min_quantity"] = rng.randint(1, 3)
+
+    if rule_type == "percentage_discount":
+        discount_value = {"percentage": rng.choice([1, 5, 10, 15])}
+    elif rule_type == "fixed_discount":
+        discount_value = {"amount": rng.choice([1, 5, 20])}
+    elif rule_type == "buy_x_get_y":
+        condition_value.setdefault("product_id", rng.choice(products).id)
+        condition_value["buy_quantity"] = rng.randint(2, 4)
+        condition_value["get_free_quantity"] = 1
+        discount_value = {}
+    else:
+        condition_value["products"] = [product.id for product in rng.sample(products, rng.randint(2, 3))]
+        discount_value = rng.choice([{"type": "percentage", "value": 10}, {"type": "fixed", "value": 5}])
+    return condition_value, discount_value
+
+
+def generate_rules(count, products, rng):
+    """Create count active rules, cycling through every rule/condition type pair"""
+    from cart.models import PricingRule
+
+    rules = []
+    for i, (rule_type, condition_type) in zip(range(count), itertools.cycle(rule_combinations())):
+        condition_value, discount_value = rule_values(rule_type, condition_type, products, rng)
+        rules.append(PricingRule(
+            name=f"{rule_type} / {condition_type} #{i}",
+            rule_type=rule_type,
+            condition_type=condition_type,
+            condition_value=condition_value,
+            discount_value=discount_value,
+            priority=rng.randint(0, 10),
+        ))
+    return PricingRule.objects.bulk_create(rules, batch_size=BATCH_SIZE)
+
+
+def generate_carts(count, size, products, rng):
+    """count calculate-cart payloads of size distinct products each"""
+    return [
+        [
+            {"product_id": product.id, "quantity": rng.randint(1, 6)}
+            for product in rng.sample(products, size)
+        ]
+        for _ in range(count)
+    ]
+
+
+def generate_stored_carts(count, size, products, rng):
+    """Create count carts with size lines each and return their ids"""
+    from cart.models import Cart, CartItem
+
+    carts = Cart.objects.bulk_create(Cart() for _ in range(count))
+    CartItem.objects.bulk_create(
+        (
+            CartItem(cart=cart, product=product, quantity=rng.randint(1, 6))
+            for cart in carts
+            for product in rng.sample(products, size)
+        ),
+        batch_size=BATCH_SIZE,
+    )
+    return [cart.id for cart in carts]
@@ -0,0 +1,168 @@
+"""
+Latency of POST /api/calculate-cart/ under many concurrent keep-alive
+clients, comparing the sync (WSGI, ``web``) and async (ASGI, ``web-async``)
+deployments from docker-compose.
+
+Each client holds one HTTP/1.1 connection and sends requests back to back
+until the duration is over. Both deployments must share the same database
+so the carts price the same products.
+
+Usage (from the backend directory, with both services running):
+
+    python -m benchmarks.loadtest_asgi \\
+        --target sync=http://localhost:8000 --target async=http://localhost:8001 \\
+        [--clients 1000] [--duration 30] [--cart-size 5]
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import urlsplit
+
+from .support import percentile
+
+PATH = "/api/calculate-cart/"
+
+
+class Target:
+    def __init__(self, label, url):
+        parts = urlsplit(url)
+        self.label = label
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.timings = []
+        self.errors = 0
+
+
+async def read_response(reader):
+    """Read one response and return its status code and body"""
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError("connection closed by server")
+    status = int(status_line.split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    body = await reader.readexactly(length)
+    return status, body
+
+
+def build_request(host, body):
+    return (
+        f"POST {PATH} HTTP/1.1\r\n"
+        f"Host: {host}\r\n"
+        "Content-Type: application/json\r\n"
+        f"Content-Length: {len(body)}\r\n"
+        "Connection: keep-alive\r\n"
+        "\r\n"
+    ).encode() + body
+
+
+async def fetch_product_ids(target):
+    reader, writer = await asyncio.open_connection(target.host, target.port)
+    writer.write(
+        f"GET /api/products/ HTTP/1.1\r\nHost: {target.host}\r\nConnection: close\r\n\r\n".encode()
+    )
+    await writer.drain()
+    status, body = await read_response(reader)
+    writer.close()
+    if status != 200:
+        raise SystemExit(f"GET /api/products/ on {target.label} returned {status}")
+    products = json.loads(body)
+    if isinstance(products, dict):
+        products = products.get("results", [])
+    if not products:
+        raise SystemExit("No products to build carts from; load some products first")
+    return [product["id"] for product in products]
+
+
+async def client(target, requests, deadline, connect_limit):
+    async with connect_limit:
+        try:
+            reader, writer = await asyncio.open_connection(target.host, target.port)
+        except OSError:
+            target.errors += 1
+            return
+
+    index = 0
+    try:
+        while time.monotonic() < deadline:
+            request = requests[index % len(requests)]
+            index += 1
+            started = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status, _ = await read_response(reader)
+            if status != 200:
+                target.errors += 1
+                continue
+            target.timings.append(time.perf_counter() - started)
+    except (OSError, ConnectionError, asyncio.IncompleteReadError, ValueError):
+        target.errors += 1
+    finally:
+        writer.close()
+
+
+async def run_target(target, product_ids, args):
+    rng = random.Random(args.seed)
+    requests = []
+    for _ in range(256):
+        cart = [
+            {"product_id": product_id, "quantity": rng.randint(1, 5)}
+            for product_id in rng.sample(product_ids, min(args.cart_size, len(product_ids)))
+        ]
+        requests.append(build_request(target.host, json.dumps(cart).encode()))
+
+    # Opening 1000 sockets at once overflows the server's listen backlog
+    connect_limit = asyncio.Semaphore(args.connect_concurrency)
+    started = time.monotonic()
+    deadline = started + args.duration
+    await asyncio.gather(*(
+        client(target, requests[i % len(requests):] + requests[:i % len(requests)], deadline, connect_limit)
+        for i in range(args.clients)
+    ))
+    return time.monotonic() - started
+
+
+def report(target, elapsed):
+    timings = target.timings
+    if not timings:
+        print(f"{target.label:>8}: no successful requests, {target.errors} errors")
+        return
+    print(
+        f"{target.label:>8}: {len(timings):>8} ok {target.errors:>6} errors "
+        f"{len(timings) / elapsed:>9.0f} req/s "
+        f"p50 {percentile(timings, 50) * 1e3:>8.1f} ms "
+        f"p99 {percentile(timings, 99) * 1e3:>8.1f} ms"
+    )
+
+
+async def main_async(args):
+    targets = [Target(*spec.split("=", 1)) for spec in args.target]
+    product_ids = await fetch_product_ids(targets[0])
+    print(f"{args.clients} clients, {args.duration}s per target, {args.cart_size}-line carts")
+    for target in targets:
+        elapsed = await run_target(target, product_ids, args)
+        report(target, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", action="append", required=True, metavar="LABEL=URL")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--cart-size", type=int, default=5)
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Pricing benchmark suite: the pricing service and the HTTP endpoints on a
+synthetic catalog, rule set and carts.
+
+Each scenario reports ops/sec, latency percentiles, database queries per
+operation and the peak memory allocated by one operation. Results can be
+written as JSON and compared against a saved baseline; any regression
+beyond the tolerance exits non-zero.
+
+Runs with no outside services on SQLite and the in-process cache:
+
+    DB_ENGINE=sqlite python -m benchmarks.suite --output results.json
+
+or against a local PostgreSQL with the POSTGRES_* variables set. To gate
+a change, save a baseline first and compare later runs with it:
+
+    python -m benchmarks.suite --output baseline.json
+    python -m benchmarks.suite --baseline baseline.json [--tolerance 0.25]
+"""
+import argparse
+import fnmatch
+import itertools
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+
+from .support import measure, percentile, setup_django, test_database
+
+CART_SIZES = (1, 20, 200)
+BATCH_CARTS = 100
+
+
+class Scenario:
+    def __init__(self, name, func, iterations_scale=1.0):
+        self.name = name
+        self.func = func
+        self.iterations_scale = iterations_scale
+
+
+def build_scenarios(args, rng):
+    from django.core.cache import cache
+    from django.test import Client
+
+    from cart.services import PricingService
+
+    from .generators import generate_carts, generate_products, generate_rules, generate_stored_carts
+
+    products = generate_products(args.products, rng)
+    generate_rules(args.rules, products, rng)
+    cache.clear()
+
+    client = Client()
+    scenarios = []
+    # Inputs are drawn from shared cycling iterators, so warm-up, timing and
+    # profiling runs all see a mix of carts
+    for size in CART_SIZES:
+        payloads = generate_carts(64, size, products, rng)
+        bodies = [json.dumps(payload) for payload in payloads]
+        service_carts = itertools.cycle(payloads)
+        http_bodies = itertools.cycle(bodies)
+        # Large carts cost more per call; keep each scenario's runtime similar
+        scale = 1.0 if size < 200 else 0.25
+
+        scenarios.append(Scenario(
+            f"service.calculate_cart_total[{size}]",
+            lambda carts=service_carts: PricingService.calculate_cart_total(next(carts)),
+            scale,
+        ))
+        scenarios.append(Scenario(
+            f"http.calculate-cart[{size}]",
+            lambda bodies=http_bodies: client.post(
+                "/api/calculate-cart/", next(bodies), content_type="application/json"
+            ),
+            scale,
+        ))
+
+    batch = generate_carts(BATCH_CARTS, 20, products, rng)
+    scenarios.append(Scenario(
+        f"service.calculate_many[{BATCH_CARTS}x20]",
+        lambda: PricingService.calculate_many(batch),
+        0.05,
+    ))
+    try:
+        import numpy  # noqa: F401
+    except ImportError:
+        pass
+    else:
+        scenarios.append(Scenario(
+            f"service.calculate_many[{BATCH_CARTS}x20,numpy]",
+            lambda: PricingService.calculate_many(batch, backend="numpy"),
+            0.05,
+        ))
+
+    cart_ids = itertools.cycle(generate_stored_carts(64, 20, products, rng))
+    scenarios.append(Scenario(
+        "http.cart-detail[20]",
+        lambda: client.get(f"/api/cart/{next(cart_ids)}/"),
+    ))
+    scenarios.append(Scenario(
+        "http.product-list[fields]",
+        lambda: client.get("/api/products/", {"fields": "id,name,price"}),
+    ))
+    return scenarios
+
+
+def count_queries(func):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as ctx:
+        func()
+    return len(ctx.captured_queries)
+
+
+def peak_allocation(func, runs=5):
+    """Largest peak of memory allocated while one call runs, in bytes"""
+    tracemalloc.start()
+    try:
+        peaks = []
+        for _ in range(runs):
+            tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - baseline)
+    finally:
+        tracemalloc.stop()
+    return max(peaks)
+
+
+def run_scenario(scenario, iterations, warmup):
+    iterations = max(10, int(iterations * scenario.iterations_scale))
+    measure(scenario.func, max(1, int(warmup * scenario.iterations_scale)))
+    timings = measure(scenario.func, iterations)
+    return {
+        "iterations": iterations,
+        "ops_per_sec": iterations / sum(timings),
+        "p50_us": percentile(timings, 50) * 1e6,
+        "p95_us": percentile(timings, 95) * 1e6,
+        "p99_us": percentile(timings, 99) * 1e6,
+        "queries": count_queries(scenario.func),
+        "peak_alloc_kib": peak_allocation(scenario.func) / 1024,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """Regression messages for every scenario that got worse than the baseline"""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if current["ops_per_sec"] < previous["ops_per_sec"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: {current['ops_per_sec']:.0f} ops/s, baseline {previous['ops_per_sec']:.0f} ops/s"
+            )
+        if current["queries"] > previous["queries"]:
+            regressions.append(f"{name}: {current['queries']} queries per op, baseline {previous['queries']}")
+        if current["peak_alloc_kib"] > previous["peak_alloc_kib"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: {current['peak_alloc_kib']:.1f} KiB peak allocation, "
+                f"baseline {previous['peak_alloc_kib']:.1f} KiB"
+            )
+    return regressions
+
+
+def print_results(results, baseline):
+    print(f"{'scenario':<36} {'ops/s':>10} {'vs base':>8} {'p50 us':>10} {'p95 us':>10} {'p99 us':>10} "
+          f"{'queries':>8} {'alloc KiB':>10}")
+    for name, stats in results.items():
+        previous = baseline.get(name)
+        change = f"{100 * (stats['ops_per_sec'] / previous['ops_per_sec'] - 1):+.0f}%" if previous else "-"
+        print(
+            f"{name:<36} {stats['ops_per_sec']:>10.0f} {change:>8} {stats['p50_us']:>10.1f} "
+            f"{stats['p95_us']:>10.1f} {stats['p99_us']:>10.1f} {stats['queries']:>8} "
+            f"{stats['peak_alloc_kib']:>10.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=5000)
+    parser.add_argument("--rules", type=int, default=120)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", help="Run only scenarios matching this glob, e.g. 'service.*'")
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against results saved with --output")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed fractional drop in ops/s or growth in allocations")
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as stream:
+            baseline = json.load(stream)["scenarios"]
+
+    setup_django()
+    import django
+
+    results = {}
+    with test_database() as connection:
+        rng = random.Random(args.seed)
+        for scenario in build_scenarios(args, rng):
+            if args.only and not fnmatch.fnmatch(scenario.name, args.only):
+                continue
+            results[scenario.name] = run_scenario(scenario, args.iterations, args.warmup)
+            print(f"ran {scenario.name}", file=sys.stderr)
+        vendor = connection.vendor
+
+    print_results(results, baseline)
+
+    if args.output:
+        report = {
+            "meta": {
+                "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "python": platform.python_version(),
+                "django": django.get_version(),
+                "database": vendor,
+                "products": args.products,
+                "rules": args.rules,
+                "seed": args.seed,
+            },
+            "scenarios": results,
+        }
+        with open(args.output, "w", encoding="utf-8") as stream:
+            json.dump(report, stream, indent=2)
+
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nREGRESSIONS:", file=sys.stderr)
+        for message in regressions:
+            print(f"  {message}", file=sys.stderr)
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
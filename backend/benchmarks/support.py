@@ -0,0 +1,59 @@
+"""
+Shared setup for the benchmark scripts.
+
+Benchmarks run against a throwaway test database created from the
+configured settings, so they never touch real data.
+"""
+import os
+import statistics
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backend.settings")
+    # Sessions need a key; benchmarks never run with real secrets
+    os.environ.setdefault("SECRET_KEY", "benchmark-only-secret-key")
+    import django
+
+    django.setup()
+
+
+@contextmanager
+def test_database(verbosity=0):
+    """Create a migrated test database for the duration of the block"""
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict["NAME"]
+    connection.creation.create_test_db(verbosity=verbosity, autoclobber=True)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=verbosity)
+        teardown_test_environment()
+
+
+def measure(func, iterations, clock=time.perf_counter):
+    """Run func repeatedly and return the per-call timings in seconds"""
+    timings = []
+    for _ in range(iterations):
+        started = clock()
+        func()
+        timings.append(clock() - started)
+    return timings
+
+
+def percentile(timings, pct):
+    ordered = sorted(timings)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(timings):
+    return {
+        "mean_us": statistics.fmean(timings) * 1e6,
+        "p50_us": percentile(timings, 50) * 1e6,
+        "p99_us": percentile(timings, 99) * 1e6,
+    }
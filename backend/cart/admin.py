@@ -1,3 +1,11 @@
 from django.contrib import admin
 
-# Register your models here.
+from .models import PricingRule
+
+
+@admin.register(PricingRule)
+class PricingRuleAdmin(admin.ModelAdmin):
+    # Saving through the admin runs PricingRule.clean(), which checks the
+    # condition and discount JSON against the schema for the rule type
+    list_display = ['name', 'rule_type', 'condition_type', 'priority', 'is_active']
+    list_filter = ['rule_type', 'condition_type', 'is_active']
@@ -1,6 +1,15 @@
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class CartConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cart'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        if settings.PRICING_WARM_UP:
+            from .warmup import start_warm_up
+
+            start_warm_up()
@@ -0,0 +1,185 @@
+"""
+Async versions of the hot cart endpoints, served under ASGI.
+
+They accept and return the same payloads as their APIView counterparts in
+views.py: JSON, form and multipart bodies like DRF's default parsers, and a
+415 for any other content type. cart/urls.py routes to them when
+settings.ASYNC_VIEWS is on.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework.exceptions import UnsupportedMediaType, ValidationError
+from rest_framework.utils.encoders import JSONEncoder
+
+from .instrumentation import serialize_timer
+from .models import Cart, CartItem
+from .serializers import CartItemAddSerializer, CartItemSerializer, CartItemsSetSerializer, parse_cart_items
+from .services import AMOUNT_FORMATS, SESSION_CART_KEY, CartService, PricingService
+from .snapshots import aempty_cart_snapshot, aget_cart_snapshot
+
+
+def json_response(data, status=status.HTTP_200_OK):
+    """Render like DRF's JSONRenderer so both deployments return identical bodies"""
+    with serialize_timer():
+        return JsonResponse(
+            data, status=status, encoder=JSONEncoder, safe=False,
+            json_dumps_params={'ensure_ascii': False, 'separators': (',', ':')},
+        )
+
+
+def error_response(exc):
+    """Render a parse or validation error with the body DRF's exception handler gives it"""
+    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+    return json_response(detail, status=exc.status_code)
+
+
+FORM_MEDIA_TYPES = ('application/x-www-form-urlencoded', 'multipart/form-data')
+
+
+def parse_body(request):
+    """
+    Return the request data like DRF's default JSON, form and multipart parsers
+
+    Raises:
+        ValidationError: the JSON body does not parse
+        UnsupportedMediaType: a body of any other content type
+    """
+    if request.content_type in FORM_MEDIA_TYPES:
+        return request.POST
+    if not request.body:
+        return {}
+    if request.content_type != 'application/json':
+        raise UnsupportedMediaType(request.content_type)
+    try:
+        return json.loads(request.body)
+    except ValueError as exc:
+        raise ValidationError({"detail": f"JSON parse error - {exc}"})
+
+
+def merge_duplicates_requested(request):
+    return request.GET.get('merge', '').lower() in ('1', 'true', 'yes')
+
+
+# APIView exempts anonymous API clients from CSRF checks; do the same here
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncAPIView(View):
+    """Base view that turns Http404 into DRF's JSON 404 body"""
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except Http404:
+            return json_response({"detail": "Not found."}, status=status.HTTP_404_NOT_FOUND)
+
+
+class CalculateCartView(AsyncAPIView):
+    """Calculate cart total with pricing rules applied"""
+
+    async def post(self, request):
+        amount_format = request.GET.get('amounts', 'float')
+        if amount_format not in AMOUNT_FORMATS:
+            return json_response(
+                {"error": f"amounts must be one of: {', '.join(AMOUNT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            cart_data = parse_cart_items(parse_body(request), merge_duplicates_requested(request))
+        except (ValidationError, UnsupportedMediaType) as exc:
+            return error_response(exc)
+
+        result = await PricingService.acalculate_cart_total(cart_data, amount_format)
+        return json_response(result)
+
+
+class CartView(AsyncAPIView):
+    """Cart management - create and retrieve carts"""
+
+    async def get(self, request, cart_id=None):
+        """Get a cart, or the session's cart, served from its priced snapshot"""
+        if cart_id:
+            return json_response(await aget_cart_snapshot(cart_id))
+
+        cart_id = await CartService.asession_cart_id(request.session)
+        if cart_id is not None:
+            try:
+                return json_response(await aget_cart_snapshot(cart_id))
+            except Http404:
+                await request.session.apop(SESSION_CART_KEY, None)
+        return json_response(await aempty_cart_snapshot(request.session.session_key))
+
+    async def post(self, request):
+        """Create a new cart"""
+        cart = await Cart.objects.acreate()
+        return json_response(await aget_cart_snapshot(cart.id), status=status.HTTP_201_CREATED)
+
+
+class CartItemView(AsyncAPIView):
+    """Manage cart items"""
+
+    async def get(self, request):
+        """Get cart items for a specific cart"""
+        cart_id = request.GET.get('cart_id')
+        if not cart_id:
+            return json_response(
+                {"error": "cart_id parameter is required"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            cart_exists = await Cart.objects.filter(id=cart_id).aexists()
+        except (TypeError, ValueError):
+            cart_exists = False
+        if not cart_exists:
+            raise Http404
+
+        items = [item async for item in CartItem.objects.filter(cart_id=cart_id).select_related('product')]
+        return json_response(CartItemSerializer(items, many=True).data)
+
+    async def post(self, request):
+        """Add item to cart, or increase its quantity if already present"""
+        try:
+            data = parse_body(request)
+        except (ValidationError, UnsupportedMediaType) as exc:
+            return error_response(exc)
+        body, response_status = await sync_to_async(self.add_item)(data, request)
+        return json_response(body, status=response_status)
+
+    @staticmethod
+    def add_item(data, request):
+        # Validation looks up the cart and product, and the upsert is raw
+        # SQL, so this part runs on the sync connection
+        serializer = CartItemAddSerializer(data=data)
+        if not serializer.is_valid():
+            return serializer.errors, status.HTTP_400_BAD_REQUEST
+        cart = serializer.validated_data.get('cart')
+        item = CartService.add_item(
+            cart.id if cart else CartService.get_or_create_session_cart(request.session),
+            serializer.validated_data['product'].id,
+            serializer.validated_data['quantity']
+        )
+        return CartItemSerializer(item).data, status.HTTP_201_CREATED
+
+    async def put(self, request):
+        """Set the quantity of many cart lines at once"""
+        try:
+            data = parse_body(request)
+        except (ValidationError, UnsupportedMediaType) as exc:
+            return error_response(exc)
+        body, response_status = await sync_to_async(self.set_items)(data)
+        return json_response(body, status=response_status)
+
+    @staticmethod
+    def set_items(data):
+        # Same as add_item: validation queries and the upsert run on the sync connection
+        serializer = CartItemsSetSerializer(data=data)
+        if not serializer.is_valid():
+            return serializer.errors, status.HTTP_400_BAD_REQUEST
+        items = CartService.set_items(serializer.validated_data['cart'].id, serializer.validated_data['items'])
+        return CartItemSerializer(items, many=True).data, status.HTTP_200_OK
@@ -0,0 +1,232 @@
+"""
+ورود و خروج انبوه کاتالوگ محصولات به صورت NDJSON یا CSV
+
+ورودی به صورت جریانی خوانده و در دسته‌های ثابت با کلید طبیعی sku
+upsert می‌شود، و خروجی با cursor سمت سرور نوشته می‌شود؛ بنابراین مصرف
+حافظه به اندازه کاتالوگ بستگی ندارد. bulk_create سیگنال ارسال نمی‌کند،
+پس نسخه کاتالوگ و نسخه قوانین فقط یک بار در پایان ورود افزایش می‌یابند.
+"""
+import csv
+import json
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TextIO, Tuple
+
+from django.core.exceptions import ValidationError
+from django.db import router, transaction
+
+from .db_router import pin_catalog
+from .models import Product
+from .versions import bump_catalog_version, bump_product_versions, bump_rules_version
+
+FORMATS = ('ndjson', 'csv')
+FIELDS = ('sku', 'name', 'price', 'description')
+# updated_at در هر دستور با auto_now مقدار می‌گیرد و در به‌روزرسانی هم نوشته می‌شود
+UPDATE_FIELDS = ['name', 'price', 'description', 'updated_at']
+DEFAULT_BATCH_SIZE = 1000
+EXPORT_CHUNK_SIZE = 2000
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def format_from_path(path: str, default: str = 'ndjson') -> str:
+    """قالب فایل از روی پسوند آن"""
+    if path.endswith('.csv'):
+        return 'csv'
+    if path.endswith(('.ndjson', '.jsonl')):
+        return 'ndjson'
+    return default
+
+
+def read_records(stream: TextIO, file_format: str) -> Iterator[Tuple[int, Any]]:
+    """
+    خواندن جریانی رکوردها
+
+    Yields:
+        (شماره خط، رکورد)؛ برای خطوط NDJSON نامعتبر رکورد یک ValidationError است
+    """
+    if file_format == 'csv':
+        # خط ۱ سرستون است
+        for line_number, row in enumerate(csv.DictReader(stream), start=2):
+            yield line_number, row
+        return
+
+    for line_number, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield line_number, json.loads(line)
+        except ValueError as exc:
+            yield line_number, ValidationError(f"invalid JSON: {exc}")
+
+
+def clean_record(record: Any) -> Dict[str, Any]:
+    """
+    اعتبارسنجی یک رکورد با همان قواعد فیلدهای مدل Product
+
+    Raises:
+        ValidationError: در صورت نبود sku یا نامعتبر بودن مقادیر
+    """
+    if isinstance(record, ValidationError):
+        raise record
+    if not isinstance(record, dict):
+        raise ValidationError("expected an object")
+
+    cleaned = {}
+    errors = {}
+    for name in FIELDS:
+        field = Product._meta.get_field(name)
+        value = record.get(name)
+        if value is None and name == 'description':
+            value = ''
+        try:
+            if name == 'sku' and not value:
+                raise ValidationError("This field is required.")
+            cleaned[name] = field.clean(value, None)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+    if errors:
+        raise ValidationError(errors)
+    return cleaned
+
+
+class ImportStats:
+    """شمارنده‌های پیشرفت ورود"""
+    __slots__ = ('read', 'written', 'invalid', 'batches', 'started')
+
+    def __init__(self):
+        self.read = 0
+        self.written = 0
+        self.invalid = 0
+        self.batches = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self) -> float:
+        elapsed = self.elapsed
+        return self.written / elapsed if elapsed else 0.0
+
+
+def _write_batch(batch: Dict[str, Dict[str, Any]]) -> int:
+    # هر دسته در تراکنش خودش نوشته می‌شود تا خطا فقط همان دسته را برگرداند
+    products = [Product(**fields) for fields in batch.values()]
+    with transaction.atomic(using=router.db_for_write(Product)):
+        Product.objects.bulk_create(
+            products,
+            update_conflicts=True,
+            unique_fields=['sku'],
+            update_fields=UPDATE_FIELDS,
+        )
+        # کلید اصلی ردیف‌های به‌روزشده فقط در پایگاه‌هایی با RETURNING مقدار
+        # می‌گیرد؛ خواندن داخل تراکنش از پایگاه اصلی است نه replica
+        product_ids = [product.pk for product in products]
+        if None in product_ids:
+            product_ids = list(Product.objects.filter(sku__in=batch).values_list('id', flat=True))
+    # مانند signals ابتدا pin و سپس bump، تا نتایجی که با نسخه‌های تازه
+    # ساخته می‌شوند از replica عقب‌مانده نخوانند
+    pin_catalog()
+    bump_product_versions(product_ids)
+    return len(products)
+
+
+def import_products(
+    records: Iterable[Tuple[int, Any]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    on_batch: Optional[Callable[[ImportStats], None]] = None,
+    on_error: Optional[Callable[[int, ValidationError], None]] = None,
+) -> ImportStats:
+    """
+    upsert رکوردها بر اساس sku در دسته‌های batch_size تایی
+
+    رکوردهای نامعتبر رد و به on_error گزارش می‌شوند. اگر یک sku در یک
+    دسته تکرار شود آخرین رکورد معتبر است، چون ON CONFLICT نمی‌تواند یک
+    ردیف را در یک دستور دو بار تغییر دهد.
+
+    Args:
+        records: خروجی read_records
+        batch_size: تعداد ردیف‌های هر دستور upsert
+        on_batch: پس از نوشتن هر دسته با آمار فعلی فراخوانی می‌شود
+        on_error: با شماره خط و خطای هر رکورد نامعتبر فراخوانی می‌شود
+
+    Returns:
+        آمار نهایی ورود
+    """
+    stats = ImportStats()
+    batch = {}
+    try:
+        for line_number, record in records:
+            stats.read += 1
+            try:
+                fields = clean_record(record)
+            except ValidationError as exc:
+                stats.invalid += 1
+                if on_error:
+                    on_error(line_number, exc)
+                continue
+
+            batch.pop(fields['sku'], None)
+            batch[fields['sku']] = fields
+            if len(batch) >= batch_size:
+                stats.written += _write_batch(batch)
+                stats.batches += 1
+                batch = {}
+                if on_batch:
+                    on_batch(stats)
+
+        if batch:
+            stats.written += _write_batch(batch)
+            stats.batches += 1
+            if on_batch:
+                on_batch(stats)
+    finally:
+        # حتی اگر ورود نیمه‌کاره بماند، دسته‌های نوشته‌شده باید دیده شوند.
+        # محصولات جدید ممکن است قوانین غیرقابل دسترس را فعال کنند
+        if stats.batches:
+            pin_catalog()
+            bump_catalog_version()
+            bump_rules_version()
+    return stats
+
+
+def export_rows(queryset=None) -> Iterator[Tuple]:
+    """ردیف‌های محصول به ترتیب id با cursor سمت سرور"""
+    if queryset is None:
+        queryset = Product.objects.all()
+    return queryset.order_by('id').values_list(*FIELDS).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+class _Echo:
+    """فایل شبه‌نوشتنی که csv.writer خط ساخته‌شده را برگرداند"""
+    def write(self, value: str) -> str:
+        return value
+
+
+def export_lines(file_format: str, rows: Optional[Iterable[Tuple]] = None) -> Iterator[str]:
+    """
+    خطوط خروجی به قالب داده‌شده، مناسب برای StreamingHttpResponse
+
+    Args:
+        file_format: یکی از FORMATS
+        rows: ردیف‌ها به ترتیب FIELDS؛ پیش‌فرض همه محصولات
+    """
+    if rows is None:
+        rows = export_rows()
+
+    if file_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(FIELDS)
+        for row in rows:
+            yield writer.writerow(row)
+        return
+
+    for row in rows:
+        record = dict(zip(FIELDS, row))
+        # قیمت به صورت رشته نوشته می‌شود تا دقیق بماند
+        record['price'] = str(record['price'])
+        yield json.dumps(record, ensure_ascii=False) + '\n'
@@ -0,0 +1,135 @@
+"""
+Read-replica routing for catalog and pricing-rule reads.
+
+ReplicaRouter sends reads of Product and PricingRule to one of the
+aliases in settings.DATABASE_REPLICAS; every other model, every write and
+every read inside a transaction on the primary stay on `default`. Carts,
+their items (including the products joined to them) and sessions are
+never read from a replica, so a cart always reflects its latest write.
+With no replicas configured the router is a no-op.
+
+Replicas lag behind the primary, so reads are pinned to the primary for
+DATABASE_REPLICA_PIN_SECONDS after a write:
+
+- per session: once a request writes anything, its remaining reads go to
+  the primary, and ReplicaPinningMiddleware marks the client with a cookie
+  so its following requests do too;
+- per catalog: a change to a product or rule pins every request, so rule
+  sets, promotion entries and memoized quotes cached under the new
+  versions are never built from a replica that has not caught up.
+
+DATABASE_REPLICA_PIN_SECONDS should exceed the replicas' usual lag.
+"""
+import random
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPLICA_MODELS = frozenset({'cart.product', 'cart.pricingrule'})
+PIN_COOKIE = 'db_primary'
+CATALOG_PIN_KEY = 'db:primary:catalog'
+
+_current = ContextVar('replica_pinning', default=None)
+
+
+class RequestPinning:
+    """Whether the current request reads from the primary, and whether it has written"""
+    __slots__ = ('pinned', 'wrote')
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def replicas_enabled():
+    return bool(settings.DATABASE_REPLICAS)
+
+
+def pin_catalog():
+    """Read the catalog and rules from the primary until replicas have the change"""
+    if replicas_enabled():
+        cache.set(CATALOG_PIN_KEY, 1, settings.DATABASE_REPLICA_PIN_SECONDS)
+
+
+class ReplicaRouter:
+    """Send catalog and rule reads to a replica unless the request is pinned to the primary"""
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or model._meta.label_lower not in REPLICA_MODELS:
+            return None
+        pinning = _current.get()
+        if pinning is not None and pinning.pinned:
+            return DEFAULT_DB_ALIAS
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pinning = _current.get()
+        if pinning is not None:
+            pinning.pinned = pinning.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get their schema through replication
+        return False if db in settings.DATABASE_REPLICAS else None
+
+
+class ReplicaPinningMiddleware:
+    """Pin requests to the primary after a write in the same session or to the catalog"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not replicas_enabled():
+            return self.get_response(request)
+
+        pinning = RequestPinning(self.pinned_by_client(request) or cache.get(CATALOG_PIN_KEY) is not None)
+        token = _current.set(pinning)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(pinning, response)
+
+    async def __acall__(self, request):
+        if not replicas_enabled():
+            return await self.get_response(request)
+
+        pinning = RequestPinning(self.pinned_by_client(request) or await cache.aget(CATALOG_PIN_KEY) is not None)
+        token = _current.set(pinning)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(pinning, response)
+
+    def pinned_by_client(self, request):
+        # Not by method: read-only POSTs such as calculate-cart use replicas,
+        # and a request that writes is pinned from its first write on
+        return PIN_COOKIE in request.COOKIES
+
+    def finish(self, pinning, response):
+        if pinning.wrote:
+            response.set_cookie(
+                PIN_COOKIE, '1',
+                max_age=settings.DATABASE_REPLICA_PIN_SECONDS,
+                httponly=True,
+                samesite='Lax',
+            )
+        return response
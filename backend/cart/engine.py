@@ -0,0 +1,551 @@
+"""
+موتور کامپایل‌شده قوانین قیمت‌گذاری
+
+هر قانون فعال یک بار به ارزیاب‌های تایپ‌شده تبدیل می‌شود تا مقادیر JSON
+در هر محاسبه دوباره پردازش نشوند. این ماژول به Django وابسته نیست و
+روی رکوردهای ساده (RuleRecord، ProductRecord، CartLine) یا هر شیء با
+همان فیلدها، از جمله مدل‌های ORM، کار می‌کند؛ بنابراین در پروسس‌های
+جداگانه و برای قیمت‌گذاری آفلاین نیز قابل استفاده است.
+"""
+import logging
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from decimal import ROUND_HALF_EVEN, Context, Decimal, DivisionByZero, InvalidOperation, Overflow, localcontext
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal('0')
+
+# همه محاسبات مبالغ با یک context ثابت انجام می‌شوند تا نتیجه به تنظیمات
+# سراسری Decimal در پروسس وابسته نباشد
+PRICING_CONTEXT = Context(prec=28, rounding=ROUND_HALF_EVEN, traps=[DivisionByZero, InvalidOperation, Overflow])
+
+
+class ProductRecord:
+    """
+    داده‌های محصول مورد نیاز موتور قیمت‌گذاری، بدون وابستگی به ORM
+
+    نام محصول intern می‌شود تا رکوردهای جداگانه یک محصول (در سبدها،
+    snapshotها و بارگذاری‌های مختلف) یک رشته مشترک داشته باشند.
+    """
+    __slots__ = ('id', 'name', 'price')
+
+    def __init__(self, product_id: Any, name: str, price: Decimal):
+        self.id = product_id
+        self.name = sys.intern(name) if type(name) is str else name
+        self.price = price
+
+    def __reduce__(self):
+        return ProductRecord, (self.id, self.name, self.price)
+
+
+class RuleRecord:
+    """قانون قیمت‌گذاری بدون وابستگی به ORM، با همان فیلدهای PricingRule"""
+    __slots__ = ('id', 'name', 'rule_type', 'condition_type', 'condition_value', 'discount_value', 'priority')
+
+    def __init__(self, rule_id: Any, name: str, rule_type: str, condition_type: str,
+                 condition_value: Dict[str, Any], discount_value: Dict[str, Any], priority: int = 0):
+        self.id = rule_id
+        self.name = name
+        self.rule_type = rule_type
+        self.condition_type = condition_type
+        self.condition_value = condition_value
+        self.discount_value = discount_value
+        self.priority = priority
+
+
+class CartLine:
+    """یک ردیف ورودی سبد خرید"""
+    __slots__ = ('product_id', 'quantity')
+
+    def __init__(self, product_id: Any, quantity: int):
+        self.product_id = product_id
+        self.quantity = quantity
+
+
+class ResultRecord:
+    """
+    پایه رکوردهای ثابت نتیجه محاسبه با __slots__
+
+    به جای دیکشنری با کلیدهای رشته‌ای، رکوردهای slotted هستند تا نگهداری
+    تعداد زیادی سبد در حافظه (کارهای دسته‌ای، quote_cache) ارزان باشد.
+    پس از ساخت تغییر نمی‌کنند و بین نتایج کپی‌شده مشترک‌اند؛ در مرز پاسخ
+    با as_dict به دیکشنری تبدیل می‌شوند.
+    """
+    __slots__ = ()
+    # فیلدهای مبلغ که as_dict با convert تبدیل می‌کند
+    amount_fields = ()
+
+    def as_dict(self, convert: Callable[[Decimal], Any] = None) -> Dict[str, Any]:
+        """رکورد با کلیدهای خروجی API؛ convert برای تبدیل مبالغ"""
+        data = {name: getattr(self, name) for name in self.__slots__}
+        if convert is not None:
+            for name in self.amount_fields:
+                data[name] = convert(data[name])
+        return data
+
+    def _values(self) -> Tuple:
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return self._values() == other._values()
+
+    __hash__ = None
+
+    def __reduce__(self):
+        return type(self), self._values()
+
+    def __repr__(self):
+        return f"{type(self).__name__}{self._values()!r}"
+
+
+class LineItem(ResultRecord):
+    """یک ردیف قیمت‌گذاری‌شده در نتیجه محاسبه"""
+    __slots__ = ('product_id', 'product_name', 'quantity', 'unit_price', 'total_price')
+    amount_fields = ('unit_price', 'total_price')
+
+    def __init__(self, product_id: Any, product_name: str, quantity: int, unit_price: Decimal, total_price: Decimal):
+        self.product_id = product_id
+        self.product_name = product_name
+        self.quantity = quantity
+        self.unit_price = unit_price
+        self.total_price = total_price
+
+
+class AppliedRule(ResultRecord):
+    """تخفیف یک قانون اعمال‌شده در نتیجه محاسبه"""
+    __slots__ = ('rule_name', 'rule_type', 'discount_amount')
+    amount_fields = ('discount_amount',)
+
+    def __init__(self, rule_name: str, rule_type: str, discount_amount: Decimal):
+        self.rule_name = rule_name
+        self.rule_type = rule_type
+        self.discount_amount = discount_amount
+
+
+class CartIndex:
+    """
+    نمایه اقلام سبد خرید که یک بار در هر محاسبه ساخته می‌شود تا
+    ارزیاب‌ها به جای پیمایش خطی اقلام، با شناسه محصول جستجو کنند
+    """
+    __slots__ = ('items', 'lines', 'positive_lines', 'max_quantity', 'total_quantity')
+
+    def __init__(self, items_detail: List[LineItem]):
+        lines = {}
+        positive_lines = {}
+        max_quantity = {}
+        total_quantity = 0
+
+        for item in items_detail:
+            product_id = item.product_id
+            quantity = item.quantity
+            total_quantity += quantity
+            # اولین ردیف هر محصول معتبر است، مانند پیمایش خطی قبلی
+            lines.setdefault(product_id, item)
+            if quantity >= 1:
+                positive_lines.setdefault(product_id, item)
+            if product_id not in max_quantity or quantity > max_quantity[product_id]:
+                max_quantity[product_id] = quantity
+
+        self.items = items_detail
+        self.lines = lines
+        self.positive_lines = positive_lines
+        self.max_quantity = max_quantity
+        self.total_quantity = total_quantity
+
+
+class MinTotalCondition:
+    """شرط حداقل مبلغ سبد خرید"""
+    __slots__ = ('min_amount',)
+
+    def __init__(self, condition_value: Dict[str, Any]):
+        self.min_amount = Decimal(str(condition_value.get('min_amount', 0)))
+
+    def check(self, cart: CartIndex, current_total: Decimal) -> bool:
+        return current_total >= self.min_amount
+
+
+class MinQuantityCondition:
+    """شرط حداقل تعداد کل اقلام"""
+    __slots__ = ('min_quantity',)
+
+    def __init__(self, condition_value: Dict[str, Any]):
+        self.min_quantity = condition_value.get('min_quantity', 0)
+
+    def check(self, cart: CartIndex, current_total: Decimal) -> bool:
+        return cart.total_quantity >= self.min_quantity
+
+
+class ProductCondition:
+    """شرط وجود یک محصول با حداقل تعداد"""
+    __slots__ = ('product_id', 'min_quantity')
+
+    def __init__(self, condition_value: Dict[str, Any]):
+        self.product_id = condition_value.get('product_id')
+        self.min_quantity = condition_value.get('min_quantity', 1)
+
+    def check(self, cart: CartIndex, current_total: Decimal) -> bool:
+        quantity = cart.max_quantity.get(self.product_id)
+        return quantity is not None and quantity >= self.min_quantity
+
+
+class PercentageDiscount:
+    """تخفیف درصدی روی مبلغ فعلی"""
+    __slots__ = ('rate',)
+
+    def __init__(self, condition_value: Dict[str, Any], discount_value: Dict[str, Any]):
+        self.rate = Decimal(str(discount_value.get('percentage', 0))) / 100
+
+    def apply(self, cart: CartIndex, current_total: Decimal, products: Dict) -> Decimal:
+        return current_total * self.rate
+
+
+class FixedDiscount:
+    """تخفیف ثابت، حداکثر به اندازه مبلغ فعلی"""
+    __slots__ = ('amount',)
+
+    def __init__(self, condition_value: Dict[str, Any], discount_value: Dict[str, Any]):
+        self.amount = Decimal(str(discount_value.get('amount', 0)))
+
+    def apply(self, cart: CartIndex, current_total: Decimal, products: Dict) -> Decimal:
+        return min(self.amount, current_total)
+
+
+class BuyXGetYDiscount:
+    """خرید X بگیر Y رایگان"""
+    __slots__ = ('product_id', 'buy_quantity', 'get_free_quantity')
+
+    def __init__(self, condition_value: Dict[str, Any], discount_value: Dict[str, Any]):
+        self.product_id = condition_value.get('product_id')
+        self.buy_quantity = condition_value.get('buy_quantity', 1)
+        self.get_free_quantity = condition_value.get('get_free_quantity', 1)
+
+    def apply(self, cart: CartIndex, current_total: Decimal, products: Dict) -> Decimal:
+        item = cart.lines.get(self.product_id)
+        if item is None:
+            return ZERO
+        free_units = (item.quantity // self.buy_quantity) * self.get_free_quantity
+        return free_units * products[self.product_id].price
+
+
+class BundleDiscount:
+    """تخفیف باندل؛ همه محصولات باندل باید در سبد باشند"""
+    __slots__ = ('products', 'discount_type', 'value', 'rate')
+
+    def __init__(self, condition_value: Dict[str, Any], discount_value: Dict[str, Any]):
+        self.products = tuple(condition_value.get('products', []))
+        self.discount_type = discount_value.get('type', 'percentage')
+        self.value = Decimal(str(discount_value.get('value', 0)))
+        self.rate = self.value / 100
+
+    def apply(self, cart: CartIndex, current_total: Decimal, products: Dict) -> Decimal:
+        bundle_items = []
+        for product_id in self.products:
+            item = cart.positive_lines.get(product_id)
+            if item is None:
+                return ZERO
+            bundle_items.append(item)
+
+        if not bundle_items:
+            return ZERO
+
+        if self.discount_type == 'percentage':
+            bundle_total = sum(item.total_price for item in bundle_items)
+            return bundle_total * self.rate
+        elif self.discount_type == 'fixed':
+            return self.value
+
+        return ZERO
+
+
+CONDITIONS = {
+    'min_total': MinTotalCondition,
+    'min_quantity': MinQuantityCondition,
+    'product_based': ProductCondition,
+}
+
+DISCOUNTS = {
+    'percentage_discount': PercentageDiscount,
+    'fixed_discount': FixedDiscount,
+    'buy_x_get_y': BuyXGetYDiscount,
+    'bundle_discount': BundleDiscount,
+}
+
+
+class CompiledRule:
+    """
+    یک قانون آماده ارزیابی که شرط و تخفیف آن یک بار به متدهای
+    ارزیاب متصل شده‌اند
+    """
+    __slots__ = (
+        'id', 'name', 'rule_type', 'condition_type', 'condition', 'discount', 'check', 'apply', 'stops_at_zero',
+    )
+
+    def __init__(self, rule_id: Any, name: str, rule_type: str, condition_type: str, condition, discount):
+        self.id = rule_id
+        self.name = name
+        self.rule_type = rule_type
+        self.condition_type = condition_type
+        self.condition = condition
+        self.discount = discount
+        self.check = condition.check
+        self.apply = discount.apply
+        # توسط CompiledRuleSet مقدار می‌گیرد؛ True یعنی اگر پس از این قانون
+        # مبلغ به صفر یا کمتر برسد، هیچ قانون بعدی تخفیف مثبتی نمی‌دهد
+        self.stops_at_zero = False
+
+
+def compile_rule(rule) -> Optional[CompiledRule]:
+    """
+    کامپایل یک قانون قیمت‌گذاری
+
+    قوانینی که نوع شرط یا نوع تخفیف ناشناخته دارند هرگز تخفیفی
+    نمی‌دهند و None برمی‌گردانند. قوانین با پارامترهای نامعتبر نیز
+    کنار گذاشته می‌شوند تا بقیه قوانین قابل استفاده بمانند.
+    """
+    condition_class = CONDITIONS.get(rule.condition_type)
+    discount_class = DISCOUNTS.get(rule.rule_type)
+    if condition_class is None or discount_class is None:
+        return None
+
+    try:
+        with localcontext(PRICING_CONTEXT):
+            condition = condition_class(rule.condition_value)
+            discount = discount_class(rule.condition_value, rule.discount_value)
+    except (AttributeError, TypeError, ArithmeticError):
+        logger.warning("Skipping pricing rule %s with invalid parameters", rule.id, exc_info=True)
+        return None
+
+    return CompiledRule(rule.id, rule.name, rule.rule_type, rule.condition_type, condition, discount)
+
+
+def bounded_by_total(rule: CompiledRule) -> bool:
+    """
+    آیا تخفیف قانون روی مبلغ صفر یا منفی هرگز مثبت نیست
+
+    تخفیف ثابت حداکثر min(amount, total) و تخفیف درصدی با نرخ نامنفی
+    total * rate است. تخفیف buy_x_get_y و باندل به مبلغ فعلی وابسته نیستند.
+    """
+    discount = rule.discount
+    if isinstance(discount, FixedDiscount):
+        return True
+    return isinstance(discount, PercentageDiscount) and discount.rate >= 0
+
+
+def trigger_product_id(rule: CompiledRule) -> Tuple[bool, Any]:
+    """
+    محصولی که بدون حضور آن در سبد، قانون هرگز اعمال نمی‌شود
+
+    Returns:
+        (product_scoped, product_id)؛ برای قوانین سراسری (min_total و
+        min_quantity با تخفیف درصدی یا ثابت) مقدار اول False است.
+        قوانین محصولی که هیچ محصول معتبری ندارند product_id=None دارند.
+    """
+    if rule.condition_type == 'product_based':
+        product_id = rule.condition.product_id
+    elif rule.rule_type == 'buy_x_get_y':
+        product_id = rule.discount.product_id
+    elif rule.rule_type == 'bundle_discount':
+        # همه اعضای باندل لازم‌اند، پس نمایه کردن عضو اول کافی است
+        products = rule.discount.products
+        product_id = products[0] if products else None
+    else:
+        return False, None
+
+    if not isinstance(product_id, (int, str)):
+        product_id = None
+    return True, product_id
+
+
+class CompiledRuleSet:
+    """
+    مجموعه مرتب قوانین فعال که برای یک نسخه مشخص کامپایل شده است
+
+    علاوه بر فهرست مرتب قوانین، یک نمایه معکوس از شناسه محصول به قوانین
+    وابسته به آن نگهداری می‌شود تا فقط قوانین مربوط به محصولات سبد
+    بررسی شوند. قوانین سراسری همیشه بررسی می‌شوند.
+
+    برای هر قانون از پیش مشخص می‌شود که آیا همه قوانین بعد از آن به مبلغ
+    فعلی محدودند (bounded_by_total)؛ در این صورت وقتی مبلغ به صفر برسد
+    ارزیابی بقیه قوانین متوقف می‌شود.
+    """
+    __slots__ = ('version', 'rules', 'global_positions', 'positions_by_product')
+
+    def __init__(self, version: Any, rules: Tuple[CompiledRule, ...]):
+        self.version = version
+        self.rules = rules
+
+        bounded_tail = True
+        for rule in reversed(rules):
+            rule.stops_at_zero = bounded_tail
+            bounded_tail = bounded_tail and bounded_by_total(rule)
+
+        global_positions = []
+        positions_by_product = {}
+        for position, rule in enumerate(rules):
+            product_scoped, product_id = trigger_product_id(rule)
+            if not product_scoped:
+                global_positions.append(position)
+            elif product_id is not None:
+                positions_by_product.setdefault(product_id, []).append(position)
+
+        self.global_positions = tuple(global_positions)
+        self.positions_by_product = {
+            product_id: tuple(positions) for product_id, positions in positions_by_product.items()
+        }
+
+    @classmethod
+    def compile(cls, rules: Iterable, version: Any = None) -> 'CompiledRuleSet':
+        """rules باید به ترتیب ارزیابی (-priority, id) باشند"""
+        compiled = (compile_rule(rule) for rule in rules)
+        return cls(version, tuple(rule for rule in compiled if rule is not None))
+
+    def candidates(self, cart: CartIndex) -> List[CompiledRule]:
+        """قوانینی که ممکن است روی این سبد اعمال شوند، به ترتیب ارزیابی"""
+        rules = self.rules
+        positions_by_product = self.positions_by_product
+        touched = [
+            positions_by_product[product_id]
+            for product_id in cart.lines
+            if product_id in positions_by_product
+        ]
+        if not touched:
+            return [rules[position] for position in self.global_positions]
+
+        positions = set(self.global_positions)
+        for product_positions in touched:
+            positions.update(product_positions)
+        return [rules[position] for position in sorted(positions)]
+
+    def __len__(self):
+        return len(self.rules)
+
+
+def apply_rule(rule: CompiledRule, cart: CartIndex, current_total: Decimal, products: Dict) -> Decimal:
+    """تخفیف یک قانون کامپایل‌شده روی سبد؛ صفر اگر شرط برقرار نباشد"""
+    if not rule.check(cart, current_total):
+        return ZERO
+    return rule.apply(cart, current_total, products)
+
+
+RuleApplier = Callable[[CompiledRule, CartIndex, Decimal, Dict], Decimal]
+
+
+def price_cart(lines: Iterable[CartLine], products: Dict, rule_set: CompiledRuleSet,
+               apply: RuleApplier = apply_rule) -> Dict[str, Any]:
+    """
+    محاسبه قیمت یک سبد روی محصولات و قوانین از پیش بارگذاری‌شده
+
+    Args:
+        lines: ردیف‌های سبد؛ محصولاتی که در products نیستند نادیده گرفته می‌شوند
+        products: نگاشت شناسه محصول به رکوردی با id، name و price
+        rule_set: مجموعه قوانین کامپایل‌شده
+        apply: ارزیاب هر قانون؛ برای افزودن اندازه‌گیری قابل جایگزینی است
+
+    Returns:
+        دیکشنری حاوی جزئیات محاسبه قیمت با مبالغ Decimal؛ items فهرستی از LineItem
+        و applied_rules فهرستی از AppliedRule است
+    """
+    with localcontext(PRICING_CONTEXT):
+        # محاسبه قیمت پایه
+        base_total = ZERO
+        items_detail = []
+
+        for line in lines:
+            product = products.get(line.product_id)
+            if product is None:
+                continue
+
+            quantity = line.quantity
+            item_total = product.price * quantity
+
+            base_total += item_total
+            items_detail.append(LineItem(product.id, product.name, quantity, product.price, item_total))
+
+        # اعمال قوانین قیمت‌گذاری؛ فقط قوانین سراسری و قوانین مربوط به
+        # محصولات این سبد بررسی می‌شوند
+        cart = CartIndex(items_detail)
+        applied_rules = []
+        final_total = base_total
+
+        for rule in rule_set.candidates(cart):
+            discount_amount = apply(rule, cart, final_total, products)
+
+            if discount_amount > 0:
+                final_total -= discount_amount
+                applied_rules.append(AppliedRule(rule.name, rule.rule_type, discount_amount))
+                if final_total <= 0 and rule.stops_at_zero:
+                    break
+
+        return {
+            'base_total': base_total,
+            'final_total': final_total,
+            'total_discount': base_total - final_total,
+            'items': items_detail,
+            'applied_rules': applied_rules
+        }
+
+
+# backendهای قابل انتخاب برای price_carts؛ numpy وابستگی اختیاری است
+PRICING_BACKENDS = ('scalar', 'numpy')
+
+
+def price_carts(carts: Sequence[Sequence[CartLine]], products: Dict, rule_set: CompiledRuleSet,
+                backend: str = 'scalar') -> List[Dict[str, Any]]:
+    """
+    محاسبه قیمت چند سبد با backend انتخاب‌شده
+
+    هر دو backend خروجی یکسان با price_cart دارند. backend='numpy' برای
+    دسته‌های بزرگ سبد (شبیه‌سازی‌ها) است و به NumPy نیاز دارد.
+
+    Raises:
+        ValueError: backend ناشناخته
+        ImportError: backend='numpy' بدون نصب بودن NumPy
+    """
+    if backend == 'numpy':
+        from .vectorized import price_carts_vectorized
+        return price_carts_vectorized(carts, products, rule_set)
+    if backend != 'scalar':
+        raise ValueError(f"Unknown pricing backend {backend!r}; expected one of {PRICING_BACKENDS}")
+    return [price_cart(lines, products, rule_set) for lines in carts]
+
+
+# وضعیت هر پروسس کارگر price_carts_parallel؛ یک بار در initializer تنظیم می‌شود
+_worker_products = None
+_worker_rule_set = None
+
+
+def _init_worker(products: Dict, rule_set: CompiledRuleSet) -> None:
+    global _worker_products, _worker_rule_set
+    _worker_products = products
+    _worker_rule_set = rule_set
+
+
+def _price_in_worker(lines: Sequence[CartLine]) -> Dict[str, Any]:
+    return price_cart(lines, _worker_products, _worker_rule_set)
+
+
+def price_carts_parallel(carts: Iterable[Sequence[CartLine]], products: Dict, rule_set: CompiledRuleSet,
+                         max_workers: Optional[int] = None, chunksize: int = 256) -> List[Dict[str, Any]]:
+    """
+    قیمت‌گذاری تعداد زیادی سبد در چند پروسس، مثلاً برای شبیه‌سازی
+
+    محصولات و قوانین فقط یک بار برای هر پروسس کارگر ارسال می‌شوند و
+    سبدها در دسته‌های chunksize تایی بین کارگرها تقسیم می‌شوند. نتیجه
+    هر سبد دقیقاً برابر با price_cart است و ترتیب ورودی حفظ می‌شود.
+
+    Args:
+        carts: سبدها؛ هر سبد دنباله‌ای از CartLine
+        products: نگاشت شناسه محصول به ProductRecord (یا هر شیء قابل pickle)
+        rule_set: مجموعه قوانین کامپایل‌شده، مثلاً یک مجموعه پیشنهادی
+        max_workers: تعداد پروسس‌ها؛ پیش‌فرض تعداد CPUها
+        chunksize: تعداد سبدهای ارسالی به کارگر در هر نوبت
+
+    Returns:
+        نتایج با مبالغ Decimal به همان ترتیب ورودی
+    """
+    with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(products, rule_set)) as pool:
+        return list(pool.map(_price_in_worker, carts, chunksize=chunksize))
@@ -0,0 +1,274 @@
+"""
+Per-request pricing instrumentation.
+
+PricingMetricsMiddleware gives each sampled request a RequestMetrics
+recorder, held in a context variable so the pricing service, rule cache
+and snapshots can report into it without passing it around. The recorder
+collects SQL query count and time, time per pricing rule, cache hits and
+misses, and serialization time. It is returned to the client as a
+Server-Timing header and aggregated into process-wide Prometheus counters
+and histograms served at /api/metrics/.
+
+Unsampled requests pay for one random() call; the hooks, including the
+query wrapper on every connection, see no recorder and return at once.
+"""
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework.renderers import JSONRenderer
+
+_current = ContextVar('pricing_metrics', default=None)
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class RequestMetrics:
+    """Measurements for one request"""
+    __slots__ = ('started', 'query_count', 'query_time', 'rules', 'cache', 'serialize_time')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.query_count = 0
+        self.query_time = 0.0
+        # (rule_id, rule_type) -> [evaluations, seconds]
+        self.rules = {}
+        # (cache name, result) -> count
+        self.cache = {}
+        self.serialize_time = 0.0
+
+    @property
+    def rule_time(self):
+        return sum(seconds for _, seconds in self.rules.values())
+
+    def server_timing(self, total):
+        hits = sum(count for (_, result), count in self.cache.items() if result != 'miss')
+        misses = sum(count for (_, result), count in self.cache.items() if result == 'miss')
+        return ', '.join([
+            f'db;dur={self.query_time * 1000:.2f};desc="{self.query_count} queries"',
+            f'rules;dur={self.rule_time * 1000:.2f};desc="{sum(n for n, _ in self.rules.values())} evaluations"',
+            f'cache;desc="{hits} hits, {misses} misses"',
+            f'serialize;dur={self.serialize_time * 1000:.2f}',
+            f'total;dur={total * 1000:.2f}',
+        ])
+
+
+def current_metrics():
+    """The recorder for the current request, or None when it is not sampled"""
+    return _current.get()
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Execute wrapper installed on every database connection.
+
+    Connections are per thread, while the recorder follows the request's
+    context into sync_to_async threads, so the wrapper stays installed and
+    looks the recorder up on each query.
+    """
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.query_count += 1
+        metrics.query_time += time.perf_counter() - started
+
+
+def install_query_recorder(connection, **kwargs):
+    """connection_created receiver"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def record_rule(rule, seconds):
+    metrics = _current.get()
+    if metrics is not None:
+        entry = metrics.rules.get((rule.id, rule.rule_type))
+        if entry is None:
+            metrics.rules[(rule.id, rule.rule_type)] = [1, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+
+
+def record_cache(name, result):
+    """Count a lookup in one of the pricing caches; result is 'hit', 'local' or 'miss'"""
+    metrics = _current.get()
+    if metrics is not None:
+        key = (name, result)
+        metrics.cache[key] = metrics.cache.get(key, 0) + 1
+
+
+@contextmanager
+def serialize_timer():
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialize_time += time.perf_counter() - started
+
+
+class TimedJSONRenderer(JSONRenderer):
+    """JSONRenderer that counts rendering towards serialization time"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with serialize_timer():
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Process-wide aggregates of the per-request measurements"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.requests = 0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.rule_evaluations = {}
+        self.rule_seconds = {}
+        self.cache = {}
+        self.request_seconds = Histogram(DURATION_BUCKETS)
+        self.query_seconds_per_request = Histogram(DURATION_BUCKETS)
+        self.queries_per_request = Histogram(QUERY_COUNT_BUCKETS)
+        self.serialize_seconds = Histogram(DURATION_BUCKETS)
+
+    def observe(self, metrics, total):
+        with self._lock:
+            self.requests += 1
+            self.queries += metrics.query_count
+            self.query_seconds += metrics.query_time
+            for key, (evaluations, seconds) in metrics.rules.items():
+                self.rule_evaluations[key] = self.rule_evaluations.get(key, 0) + evaluations
+                self.rule_seconds[key] = self.rule_seconds.get(key, 0.0) + seconds
+            for key, count in metrics.cache.items():
+                self.cache[key] = self.cache.get(key, 0) + count
+            self.request_seconds.observe(total)
+            self.query_seconds_per_request.observe(metrics.query_time)
+            self.queries_per_request.observe(metrics.query_count)
+            self.serialize_seconds.observe(metrics.serialize_time)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+
+        def counter(name, help_text, samples):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for labels, value in samples:
+                lines.append(f'{name}{labels} {value}')
+
+        def histogram(name, help_text, hist):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            cumulative = 0
+            for bound, count in zip(hist.buckets, hist.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{le="+Inf"}} {hist.count}')
+            lines.append(f'{name}_sum {hist.sum}')
+            lines.append(f'{name}_count {hist.count}')
+
+        with self._lock:
+            counter('pricing_requests_total', 'Sampled requests.', [('', self.requests)])
+            counter('pricing_db_queries_total', 'SQL queries run by sampled requests.', [('', self.queries)])
+            counter('pricing_db_query_seconds_total', 'Time spent in SQL queries.', [('', self.query_seconds)])
+            counter('pricing_rule_evaluations_total', 'Pricing rule evaluations.', [
+                (f'{{rule_id="{rule_id}",rule_type="{rule_type}"}}', count)
+                for (rule_id, rule_type), count in sorted(self.rule_evaluations.items(), key=str)
+            ])
+            counter('pricing_rule_seconds_total', 'Time spent evaluating each pricing rule.', [
+                (f'{{rule_id="{rule_id}",rule_type="{rule_type}"}}', seconds)
+                for (rule_id, rule_type), seconds in sorted(self.rule_seconds.items(), key=str)
+            ])
+            counter('pricing_cache_requests_total', 'Pricing cache lookups by result.', [
+                (f'{{cache="{name}",result="{result}"}}', count)
+                for (name, result), count in sorted(self.cache.items())
+            ])
+            histogram('pricing_request_seconds', 'Sampled request duration.', self.request_seconds)
+            histogram('pricing_request_db_seconds', 'SQL time per sampled request.',
+                      self.query_seconds_per_request)
+            histogram('pricing_request_db_queries', 'SQL queries per sampled request.', self.queries_per_request)
+            histogram('pricing_request_serialize_seconds', 'Serialization time per sampled request.',
+                      self.serialize_seconds)
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class PricingMetricsMiddleware:
+    """Record and report pricing metrics for a sample of requests"""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = settings.PRICING_METRICS_SAMPLE_RATE
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not self.sampled():
+            return self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(metrics, response)
+
+    async def __acall__(self, request):
+        if not self.sampled():
+            return await self.get_response(request)
+
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(metrics, response)
+
+    def sampled(self):
+        return self.sample_rate >= 1 or (self.sample_rate > 0 and random.random() < self.sample_rate)
+
+    def finish(self, metrics, response):
+        total = time.perf_counter() - metrics.started
+        registry.observe(metrics, total)
+        response['Server-Timing'] = metrics.server_timing(total)
+        return response
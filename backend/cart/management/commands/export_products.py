@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cart.catalog_io import FORMATS, export_lines, format_from_path
+
+
+class Command(BaseCommand):
+    help = "Stream every product as NDJSON or CSV to a file (or - for stdout), reading them with a server-side cursor."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", nargs="?", default="-", help="File to write, or - for stdout")
+        parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension, else ndjson")
+
+    def handle(self, *args, path, format, **options):
+        file_format = format or format_from_path(path)
+
+        if path == "-":
+            for line in export_lines(file_format):
+                self.stdout.write(line, ending="")
+            return
+
+        try:
+            stream = open(path, "w", newline="", encoding="utf-8")
+        except OSError as exc:
+            raise CommandError(exc)
+        with stream:
+            stream.writelines(export_lines(file_format))
+        self.stderr.write(f"Exported products to {path}")
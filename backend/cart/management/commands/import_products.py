@@ -0,0 +1,55 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cart.catalog_io import DEFAULT_BATCH_SIZE, FORMATS, format_from_path, import_products, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Upsert products by SKU from an NDJSON or CSV file (or - for stdin). "
+        "Records need sku, name and price; description is optional. "
+        "The file is streamed and written in batches, so memory use does not grow with its size."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="File to read, or - for stdin")
+        parser.add_argument("--format", choices=FORMATS, help="Defaults to the file extension, else ndjson")
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+        parser.add_argument(
+            "--max-errors", type=int, default=100,
+            help="Number of invalid records to print before only counting them",
+        )
+
+    def handle(self, *args, path, format, batch_size, max_errors, **options):
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+        file_format = format or format_from_path(path)
+        printed_errors = 0
+
+        def on_batch(stats):
+            self.stdout.write(
+                f"{stats.written} products written in {stats.batches} batches, "
+                f"{stats.invalid} invalid ({stats.rate:.0f} rows/s)"
+            )
+
+        def on_error(line_number, error):
+            nonlocal printed_errors
+            if printed_errors < max_errors:
+                self.stderr.write(f"line {line_number}: {'; '.join(error.messages)}")
+            printed_errors += 1
+
+        if path == "-":
+            stats = import_products(read_records(sys.stdin, file_format), batch_size, on_batch, on_error)
+        else:
+            try:
+                stream = open(path, newline="", encoding="utf-8")
+            except OSError as exc:
+                raise CommandError(exc)
+            with stream:
+                stats = import_products(read_records(stream, file_format), batch_size, on_batch, on_error)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {stats.written} of {stats.read} records in {stats.elapsed:.1f}s "
+            f"({stats.rate:.0f} rows/s), {stats.invalid} invalid"
+        ))
@@ -0,0 +1,38 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from cart.models import Cart
+from cart.services import CartService
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete carts that have no items and have not changed for longer than the session lifetime "
+        "(or --older-than). Carts are deleted in batches, each in its own transaction."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than", type=float, default=settings.SESSION_COOKIE_AGE / 3600,
+            help="Age in hours after which an empty cart is expired; defaults to SESSION_COOKIE_AGE",
+        )
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--dry-run", action="store_true", help="Only count the carts that would be deleted")
+
+    def handle(self, *args, older_than, batch_size, dry_run, **options):
+        if batch_size < 1:
+            raise CommandError("--batch-size must be at least 1")
+        cutoff = timezone.now() - timedelta(hours=older_than)
+
+        if dry_run:
+            count = Cart.objects.filter(items__isnull=True, updated_at__lt=cutoff).count()
+            self.stdout.write(f"{count} empty carts last changed before {cutoff:%Y-%m-%d %H:%M} would be deleted")
+            return
+
+        deleted = CartService.purge_empty_carts(
+            cutoff, batch_size, on_batch=lambda total: self.stdout.write(f"{total} empty carts deleted")
+        )
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} empty carts last changed before {cutoff:%Y-%m-%d %H:%M}"))
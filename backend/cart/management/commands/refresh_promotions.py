@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from cart.promotions import EXPORT_CHUNK_SIZE, refresh_promotions
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the promotion entry of every product for the current rule and product versions, reading the "
+        "catalog from the primary in chunks. Run it after changing rules that apply to every cart, or before "
+        "a deploy, so /api/products/promotions/ requests find their entries in the shared cache."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+
+    def handle(self, *args, chunk_size, **options):
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        refreshed = refresh_promotions(chunk_size)
+        self.stdout.write(self.style.SUCCESS(f"Refreshed promotions for {refreshed} products"))
@@ -0,0 +1,76 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cart.serializers import RuleSimulationSerializer
+from cart.simulation import DEFAULT_CHUNK_SIZE, RuleSimulator, build_candidate_rule_set, stored_cart_chunks
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay stored carts through a candidate rule set (the active rules, plus --rule ids even if inactive, "
+        "plus unsaved --drafts) and report each rule's hit rate, total discount and evaluation time. "
+        "Carts are read and priced in chunks, so memory use does not grow with the number of carts."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rule", dest="rules", type=int, action="append", default=[],
+            help="Saved rule id to include whether or not it is active; repeatable",
+        )
+        parser.add_argument(
+            "--drafts", help="JSON file with a list of unsaved rules (name, rule_type, condition_type, ...)",
+        )
+        parser.add_argument("--no-active", action="store_true", help="Leave the currently active rules out")
+        parser.add_argument("--limit", type=int, help="Replay at most this many carts")
+        parser.add_argument("--sample-rate", type=float, default=1.0, help="Share of carts to replay, 0 to 1")
+        parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+        parser.add_argument("--seed", type=int, default=0, help="Seed for --sample-rate")
+        parser.add_argument("--json", dest="as_json", action="store_true", help="Print the report as JSON")
+
+    def handle(self, *args, rules, drafts, no_active, limit, sample_rate, chunk_size, seed, as_json, **options):
+        if chunk_size < 1:
+            raise CommandError("--chunk-size must be at least 1")
+        if not 0 <= sample_rate <= 1:
+            raise CommandError("--sample-rate must be between 0 and 1")
+
+        draft_rules = self.load_drafts(drafts) if drafts else []
+        # Same validation as the simulate endpoint, without its per-request cart limit
+        serializer = RuleSimulationSerializer(data={'rules': rules, 'drafts': draft_rules})
+        if not serializer.is_valid():
+            raise CommandError(serializer.errors)
+
+        rule_set, skipped = build_candidate_rule_set(
+            serializer.validated_data['rules'], serializer.validated_data['drafts'], not no_active
+        )
+        simulator = RuleSimulator(rule_set, skipped)
+        for progress in simulator.run(stored_cart_chunks(chunk_size, limit, sample_rate, seed)):
+            self.stderr.write(f"{progress['carts']} carts replayed")
+
+        report = simulator.report()
+        if as_json:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        self.write_table(report)
+
+    def load_drafts(self, path):
+        try:
+            with open(path, encoding="utf-8") as stream:
+                return json.load(stream)
+        except (OSError, ValueError) as exc:
+            raise CommandError(f"Could not read drafts from {path}: {exc}")
+
+    def write_table(self, report):
+        self.stdout.write(
+            f"{report['carts']} carts, {report['lines']} lines priced in {report['pricing_seconds']:.2f}s; "
+            f"discount {report['total_discount']} of {report['base_total']}"
+        )
+        for name in report['skipped_rules']:
+            self.stdout.write(self.style.WARNING(f"Skipped rule that does not compile: {name}"))
+        self.stdout.write(f"{'rule':<32} {'evaluations':>11} {'hits':>8} {'hit rate':>9} {'discount':>14} {'avg us':>8}")
+        for rule in report['rules']:
+            name = f"{rule['name']} (draft)" if rule['draft'] else rule['name']
+            self.stdout.write(
+                f"{name[:32]:<32} {rule['evaluations']:>11} {rule['hits']:>8} {rule['hit_rate']:>9.1%} "
+                f"{rule['total_discount']:>14} {rule['avg_evaluation_us']:>8.1f}"
+            )
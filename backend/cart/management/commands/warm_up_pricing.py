@@ -0,0 +1,29 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from cart.warmup import warm_up
+
+
+class Command(BaseCommand):
+    help = (
+        "Warm the pricing path before traffic: compile the active rule set and price one unit of the "
+        "most-carted products into the quote cache, the same steps workers run at startup with PRICING_WARM_UP. "
+        "Run it before a deploy or scale-out to fill the shared cache every new worker reads from."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--products", type=int, default=settings.PRICING_WARM_UP_PRODUCTS,
+            help="Number of most-carted products to price; defaults to PRICING_WARM_UP_PRODUCTS",
+        )
+
+    def handle(self, *args, products, **options):
+        if products < 0:
+            raise CommandError("--products must not be negative")
+
+        report = warm_up(products)
+        for step, seconds in report['seconds'].items():
+            self.stdout.write(f"{step:<12} {seconds * 1000:>9.1f} ms")
+        self.stdout.write(self.style.SUCCESS(
+            f"Warmed {report['rules']} rules and {report['quotes']} quotes for {report['products']} products"
+        ))
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:13
+
+from django.db import migrations, models
+
+
+def detach_duplicate_session_carts(apps, schema_editor):
+    """Keep the oldest cart per session; later duplicates lose their session_key"""
+    Cart = apps.get_model('cart', 'Cart')
+    duplicates = (
+        Cart.objects.exclude(session_key='')
+        .values('session_key')
+        .annotate(first_id=models.Min('id'), carts=models.Count('id'))
+        .filter(carts__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        Cart.objects.filter(session_key=duplicate['session_key']).exclude(
+            id=duplicate['first_id']
+        ).update(session_key='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='cart',
+            name='session_key',
+            field=models.CharField(blank=True, db_index=True, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='cartitem',
+            index=models.Index(fields=['cart', 'product'], include=('quantity',), name='cartitem_cart_product_cov_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='pricingrule',
+            index=models.Index(condition=models.Q(('is_active', True)), fields=['-priority', 'id'], name='pricingrule_active_order_idx'),
+        ),
+        migrations.RunPython(detach_duplicate_session_carts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('session_key', ''), _negated=True), fields=('session_key',), name='cart_unique_session_key'),
+        ),
+    ]
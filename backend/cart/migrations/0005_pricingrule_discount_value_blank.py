@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0004_product_sku'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='pricingrule',
+            name='discount_value',
+            field=models.JSONField(blank=True, help_text='Discount parameters in JSON format'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:04
+
+from django.db import migrations, models
+
+UNIQUE_NAME = 'cartitem_unique_cart_product'
+
+
+def create_plain_unique_index(apps, schema_editor):
+    """
+    Django skips unique constraints with INCLUDE on backends without covering
+    indexes (SQLite); cart lines still need a unique (cart, product) index
+    for the ON CONFLICT upsert
+    """
+    if schema_editor.connection.features.supports_covering_indexes:
+        return
+    table = apps.get_model('cart', 'CartItem')._meta.db_table
+    quote = schema_editor.quote_name
+    schema_editor.execute(
+        f"CREATE UNIQUE INDEX {quote(UNIQUE_NAME)} ON {quote(table)} ({quote('cart_id')}, {quote('product_id')})"
+    )
+
+
+def drop_plain_unique_index(apps, schema_editor):
+    if not schema_editor.connection.features.supports_covering_indexes:
+        schema_editor.execute(f"DROP INDEX IF EXISTS {schema_editor.quote_name(UNIQUE_NAME)}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cart', '0005_pricingrule_discount_value_blank'),
+    ]
+
+    # The new constraint is created before the old unique index is dropped,
+    # so cart lines stay unique throughout
+    operations = [
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), include=('quantity',), name=UNIQUE_NAME),
+        ),
+        migrations.AlterUniqueTogether(
+            name='cartitem',
+            unique_together=set(),
+        ),
+        migrations.RemoveIndex(
+            model_name='cartitem',
+            name='cartitem_cart_product_cov_idx',
+        ),
+        migrations.RunPython(create_plain_unique_index, drop_plain_unique_index),
+    ]
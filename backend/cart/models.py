@@ -3,6 +3,8 @@ from django.core.validators import MinValueValidator
 from decimal import Decimal
 
 class Product(models.Model):
+    # Natural key used by the ERP catalog import; products created by hand may leave it empty
+    sku = models.CharField(max_length=64, unique=True, null=True, blank=True)
     name = models.CharField(max_length=200)
     price = models.DecimalField(
         max_digits=10, 
@@ -11,7 +13,8 @@ class Product(models.Model):
     )
     description = models.TextField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
-    updated_at = models.DateTimeField(auto_now=True)
+    # Indexed for the catalog's Last-Modified lookup and ?ordering=updated_at pages
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     def __str__(self):
         return self.name
@@ -34,7 +37,8 @@ class PricingRule(models.Model):
     rule_type = models.CharField(max_length=50, choices=RULE_TYPES)
     condition_type = models.CharField(max_length=50, choices=CONDITION_TYPES)
     condition_value = models.JSONField(help_text="Condition parameters in JSON format")
-    discount_value = models.JSONField(help_text="Discount parameters in JSON format")
+    # buy_x_get_y keeps all of its parameters in condition_value
+    discount_value = models.JSONField(blank=True, help_text="Discount parameters in JSON format")
     is_active = models.BooleanField(default=True)
     priority = models.IntegerField(default=0, help_text="Higher priority rules apply first")
     created_at = models.DateTimeField(auto_now_add=True)
@@ -42,15 +46,50 @@ class PricingRule(models.Model):
 
     class Meta:
         ordering = ['-priority', 'id']
+        indexes = [
+            # Matches the rule engine's filter(is_active=True).order_by('-priority', 'id')
+            models.Index(
+                fields=['-priority', 'id'],
+                condition=models.Q(is_active=True),
+                name='pricingrule_active_order_idx',
+            ),
+        ]
+
+    def clean(self):
+        # Imported here: rule_analysis depends on these models
+        from .rule_analysis import validate_rule
+        validate_rule(self)
 
     def __str__(self):
         return f"{self.name} ({self.rule_type})"
 
+class CartQuerySet(models.QuerySet):
+    def with_items(self):
+        """Prefetch items with their products joined, in one extra query"""
+        # Product descriptions are never shown or priced with cart items
+        return self.prefetch_related(
+            models.Prefetch('items', queryset=CartItem.objects.select_related('product').defer('product__description'))
+        )
+
 class Cart(models.Model):
-    session_key = models.CharField(max_length=100, blank=True)
+    session_key = models.CharField(max_length=100, blank=True, db_index=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Stops racing get_or_create calls from creating two carts for one
+            # session; carts without a session are exempt. Lookups use the plain
+            # index, since planners cannot match a bound parameter to this predicate
+            models.UniqueConstraint(
+                fields=['session_key'],
+                condition=~models.Q(session_key=''),
+                name='cart_unique_session_key',
+            ),
+        ]
+
     def __str__(self):
         return f"Cart {self.id}"
 
@@ -61,7 +100,17 @@ class CartItem(models.Model):
     added_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ['cart', 'product']
+        constraints = [
+            # One index both enforces one line per product (the target of the
+            # ON CONFLICT upsert) and answers cart line reads from the index
+            # alone on PostgreSQL. Backends without covering indexes get a
+            # plain unique index from migration 0006 instead
+            models.UniqueConstraint(
+                fields=['cart', 'product'],
+                include=['quantity'],
+                name='cartitem_unique_cart_product',
+            ),
+        ]
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name}"
\ No newline at end of file
@@ -0,0 +1,15 @@
+from rest_framework.pagination import CursorPagination
+
+
+class ProductCursorPagination(CursorPagination):
+    """
+    Keyset pagination for the product catalog.
+
+    Each page is a range scan from the previous page's last key, so deep
+    pages cost the same as the first one. Pages are ordered by id unless
+    the client asks for ?ordering=updated_at to follow catalog changes.
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
@@ -0,0 +1,246 @@
+"""
+تبلیغات هر محصول برای صفحات کاتالوگ
+
+برای هر محصول، قوانین محصولی (product_based، buy_x_get_y و باندل‌هایی که
+محصول عضو آن‌هاست) و قیمت مؤثر یک واحد (final_total سبدی با یک عدد از
+همان محصول) محاسبه و به صورت یک ردیف جدا برای هر محصول در حافظه پروسس و
+کش مشترک نگهداری می‌شود.
+
+کلید هر ردیف از نسخه قوانین و نسخه همان محصول ساخته می‌شود، پس تغییر یک
+محصول فقط ردیف خودش را باطل می‌کند و ردیف کهنه هرگز با نسخه‌های جدید
+پیدا نمی‌شود. پاسخ به درخواست فقط ردیف‌های محصولات درخواستی را می‌خواند
+و ردیف‌های موجود نبودن را برای همان محصولات (حداکثر
+PRICING_PROMOTIONS_MAX_IDS) با یک کوئری می‌سازد؛ هیچ درخواستی کل کاتالوگ
+را پیمایش نمی‌کند. فرمان refresh_promotions پس از تغییر قوانین سراسری یا
+استقرار، ردیف همه محصولات را خارج از مسیر درخواست از پیش می‌سازد.
+"""
+import threading
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import router
+
+from .engine import (
+    BundleDiscount, BuyXGetYDiscount, CartLine, CompiledRule, CompiledRuleSet, FixedDiscount, PercentageDiscount,
+    ProductCondition, ProductRecord, apply_rule, price_cart, trigger_product_id,
+)
+from .models import Product
+from .quote_cache import LocalLRU
+from .rule_cache import get_active_rule_set
+from .services import PricingService
+from .versions import CATALOG_VERSION_KEY, RULES_VERSION_KEY, get_versions, product_version_key
+
+PROMOTION_KEY = 'pricing:promotion:{product_id}:{rules_version}:{product_version}'
+PROMOTIONS_TIMEOUT = 24 * 60 * 60
+EXPORT_CHUNK_SIZE = 2000
+# ردیف محصولی که وجود ندارد؛ ایجاد محصول نسخه آن را تغییر می‌دهد
+MISSING = False
+
+_local_entries = LocalLRU(settings.PRICING_PROMOTIONS_CACHE_SIZE, PROMOTIONS_TIMEOUT)
+_scopes_lock = threading.Lock()
+_scopes = None
+
+
+def _promotion_products(rule: CompiledRule) -> Tuple:
+    """همه محصولاتی که این قانون تبلیغی برای آن‌هاست"""
+    if isinstance(rule.discount, BundleDiscount):
+        return rule.discount.products
+    product_scoped, product_id = trigger_product_id(rule)
+    return (product_id,) if product_scoped and product_id is not None else ()
+
+
+def _details(rule: CompiledRule) -> Dict[str, Any]:
+    condition, discount = rule.condition, rule.discount
+    details = {}
+    if isinstance(condition, ProductCondition):
+        details['min_quantity'] = condition.min_quantity
+    if isinstance(discount, PercentageDiscount):
+        details['percentage'] = discount.rate * 100
+    elif isinstance(discount, FixedDiscount):
+        details['amount'] = discount.amount
+    elif isinstance(discount, BuyXGetYDiscount):
+        details['buy_quantity'] = discount.buy_quantity
+        details['get_free_quantity'] = discount.get_free_quantity
+    elif isinstance(discount, BundleDiscount):
+        details['bundle_products'] = list(discount.products)
+        details['discount_type'] = discount.discount_type
+        details['value'] = discount.value
+    return details
+
+
+class RuleScopes:
+    """قوانین تبلیغی هر محصول برای یک مجموعه قوانین"""
+    __slots__ = ('rule_set', 'by_product')
+
+    def __init__(self, rule_set: CompiledRuleSet):
+        self.rule_set = rule_set
+        by_product = {}
+        for position, rule in enumerate(rule_set.rules):
+            for product_id in _promotion_products(rule):
+                by_product.setdefault(product_id, []).append(position)
+        self.by_product = by_product
+
+
+def _rule_scopes(rules_version: int) -> RuleScopes:
+    """RuleScopes مجموعه قوانین فعال، یک بار برای هر نسخه قوانین در هر پروسس"""
+    global _scopes
+    scopes = _scopes
+    if scopes is None or scopes.rule_set.version != rules_version:
+        with _scopes_lock:
+            scopes = _scopes
+            if scopes is None or scopes.rule_set.version != rules_version:
+                scopes = _scopes = RuleScopes(get_active_rule_set(rules_version))
+    return scopes
+
+
+def _build_entry(product: ProductRecord, scopes: RuleScopes) -> Dict[str, Any]:
+    """ردیف تبلیغات یک محصول با مبالغ Decimal"""
+    rule_set = scopes.rule_set
+    # قوانین اعمال‌شده با شناسه ثبت می‌شوند؛ نام قوانین یکتا نیست
+    applied = set()
+
+    def record(rule, cart, current_total, products):
+        discount_amount = apply_rule(rule, cart, current_total, products)
+        if discount_amount > 0:
+            applied.add(rule.id)
+        return discount_amount
+
+    single_unit = price_cart([CartLine(product.id, 1)], {product.id: product}, rule_set, record)
+    return {
+        'product_id': product.id,
+        'price': product.price,
+        'unit_price': single_unit['final_total'],
+        'promotions': [
+            {
+                'rule_id': rule.id,
+                'rule_name': rule.name,
+                'rule_type': rule.rule_type,
+                'condition_type': rule.condition_type,
+                'applies_to_single_unit': rule.id in applied,
+                **_details(rule),
+            }
+            for rule in (rule_set.rules[position] for position in scopes.by_product.get(product.id, ()))
+        ],
+    }
+
+
+def _entry_key(product_id: int, versions: Dict[str, int]) -> str:
+    return PROMOTION_KEY.format(
+        product_id=product_id,
+        rules_version=versions[RULES_VERSION_KEY],
+        product_version=versions[product_version_key(product_id)],
+    )
+
+
+def _store(entries: Dict[str, Any]) -> None:
+    for key, entry in entries.items():
+        _local_entries.set(key, entry)
+    cache.set_many(entries, PROMOTIONS_TIMEOUT)
+
+
+def _build_entries(products: Dict[int, ProductRecord], product_ids: Iterable[int],
+                   versions: Dict[str, int]) -> Dict[str, Any]:
+    """ردیف هر محصول زیر کلید نسخه‌هایش؛ MISSING برای محصولاتی که در products نیستند"""
+    scopes = _rule_scopes(versions[RULES_VERSION_KEY])
+    return {
+        _entry_key(product_id, versions): (
+            _build_entry(products[product_id], scopes) if product_id in products else MISSING
+        )
+        for product_id in product_ids
+    }
+
+
+def get_promotions(product_ids: List[int]) -> Tuple[Dict[str, int], List[Dict[str, Any]]]:
+    """
+    ردیف‌های محصولات موجود به ترتیب درخواست
+
+    ترتیب جستجو: حافظه پروسس، کش مشترک، و در نهایت ساخت ردیف فقط برای
+    محصولات باقی‌مانده. نسخه‌ها مانند quote_cache پیش از خواندن محصولات
+    گرفته می‌شوند.
+
+    Returns:
+        (نسخه‌های قوانین و کاتالوگ، ردیف‌ها با مبالغ Decimal)
+    """
+    unique_ids = list(dict.fromkeys(product_ids))
+    versions = get_versions(
+        RULES_VERSION_KEY, CATALOG_VERSION_KEY, *(product_version_key(product_id) for product_id in unique_ids)
+    )
+    keys = {product_id: _entry_key(product_id, versions) for product_id in unique_ids}
+
+    found = {}
+    remote = []
+    for product_id, key in keys.items():
+        entry = _local_entries.get(key)
+        if entry is None:
+            remote.append(key)
+        else:
+            found[key] = entry
+    if remote:
+        shared = cache.get_many(remote)
+        for key, entry in shared.items():
+            _local_entries.set(key, entry)
+        found.update(shared)
+
+    pending = [product_id for product_id, key in keys.items() if key not in found]
+    if pending:
+        built = _build_entries(PricingService.load_product_records(pending), pending, versions)
+        _store(built)
+        found.update(built)
+
+    entries = [found[keys[product_id]] for product_id in product_ids]
+    return versions, [entry for entry in entries if entry is not MISSING]
+
+
+def refresh_promotions(chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    """
+    ساخت ردیف همه محصولات برای نسخه‌های فعلی، خارج از مسیر درخواست
+
+    محصولات در دسته‌های chunk_size تایی از پایگاه اصلی خوانده می‌شوند،
+    هر دسته پس از گرفتن نسخه‌هایش، تا ردیفی که زیر نسخه‌های تازه ذخیره
+    می‌شود از داده قدیمی‌تر (یا replica عقب‌مانده) ساخته نشود.
+
+    Returns:
+        تعداد محصولاتی که ردیفشان ساخته شد
+    """
+    products = Product.objects.using(router.db_for_write(Product))
+    product_ids = products.order_by('id').values_list('id', flat=True).iterator(chunk_size=chunk_size)
+    refreshed = 0
+    chunk = []
+    for product_id in product_ids:
+        chunk.append(product_id)
+        if len(chunk) == chunk_size:
+            refreshed += _refresh_chunk(products, chunk)
+            chunk = []
+    if chunk:
+        refreshed += _refresh_chunk(products, chunk)
+    return refreshed
+
+
+def _refresh_chunk(products, product_ids: List[int]) -> int:
+    versions = get_versions(RULES_VERSION_KEY, *(product_version_key(product_id) for product_id in product_ids))
+    records = {
+        product_id: ProductRecord(product_id, name, price)
+        for product_id, name, price in products.filter(id__in=product_ids).values_list('id', 'name', 'price')
+    }
+    _store(_build_entries(records, product_ids, versions))
+    return len(records)
+
+
+def clear_local_promotions() -> None:
+    """پاک کردن حافظه این پروسس؛ کش مشترک با نسخه‌ها باطل می‌شود"""
+    _local_entries.clear()
+
+
+def format_entry(entry: Dict[str, Any], amount_format: str = 'float') -> Dict[str, Any]:
+    """کپی ردیف با مبالغ به قالب خروجی، مانند format_amounts"""
+    convert = str if amount_format == 'string' else float
+    formatted = dict(entry)
+    formatted['price'] = convert(entry['price'])
+    formatted['unit_price'] = convert(entry['unit_price'])
+    formatted['promotions'] = [
+        {key: convert(value) if isinstance(value, Decimal) else value for key, value in promotion.items()}
+        for promotion in entry['promotions']
+    ]
+    return formatted
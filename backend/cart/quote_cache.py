@@ -0,0 +1,207 @@
+"""
+حافظه نتیجه محاسبه قیمت سبدهای کوچک و پرتکرار
+
+کلید هر نتیجه از ردیف‌های مرتب‌شده (product_id, quantity)، نسخه قوانین
+و نسخه هر محصول سبد ساخته می‌شود، پس تغییر یک قانون یا یک محصول فقط
+نتایجی را باطل می‌کند که به آن وابسته‌اند و نتیجه کهنه هرگز با نسخه‌های
+جدید پیدا نمی‌شود. نتایج ابتدا در یک LRU درون پروسس با محدودیت اندازه و
+TTL و سپس در کش مشترک (Redis) جستجو می‌شوند.
+
+نسخه‌ها پیش از بارگذاری محصولات خوانده می‌شوند؛ بنابراین نتیجه ذخیره‌شده
+زیر یک کلید، دست‌کم به تازگی نسخه‌های همان کلید است.
+
+فقط سبدهایی با حداکثر PRICING_QUOTE_CACHE_MAX_LINES ردیف و بدون محصول
+تکراری نگهداری می‌شوند؛ برای آن‌ها نتیجه به ترتیب ردیف‌ها وابسته نیست
+و فقط ترتیب items هنگام بازگرداندن با ورودی هماهنگ می‌شود.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .instrumentation import record_cache
+from .versions import RULES_VERSION_KEY, aget_versions, get_versions, product_version_key
+
+QUOTE_KEY = 'pricing:quote:{digest}'
+
+Lines = Tuple[Tuple[int, int], ...]
+
+
+class LocalLRU:
+    """LRU درون پروسس و امن برای چند thread با انقضای زمانی"""
+    __slots__ = ('max_size', 'ttl', '_entries', '_lock')
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _copy_result(result: Dict[str, Any]) -> Dict[str, Any]:
+    # format_amounts نتیجه را در همان شیء تغییر می‌دهد؛ رکوردهای ردیف و
+    # قانون ثابت‌اند و بین کپی‌ها مشترک می‌مانند
+    copied = dict(result)
+    copied['items'] = list(result['items'])
+    copied['applied_rules'] = list(result['applied_rules'])
+    return copied
+
+
+class QuoteCache:
+    """
+    نتایج محاسبه با مبالغ Decimal، پیش از تبدیل به قالب خروجی
+
+    شمارنده‌ها برای کل پروسس هستند: local (یافته در LRU)، shared (یافته در
+    کش مشترک)، miss و skipped (سبدهایی که نگهداری نمی‌شوند).
+    """
+
+    def __init__(self, max_size: int, ttl: float, max_lines: int):
+        self.max_lines = max_lines
+        self.ttl = ttl
+        self.local = LocalLRU(max_size, ttl)
+        self._lock = threading.Lock()
+        self.reset_stats()
+
+    @classmethod
+    def from_settings(cls) -> 'QuoteCache':
+        return cls(
+            settings.PRICING_QUOTE_CACHE_SIZE,
+            settings.PRICING_QUOTE_CACHE_TTL,
+            settings.PRICING_QUOTE_CACHE_MAX_LINES,
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return self.local.max_size > 0 and self.max_lines > 0
+
+    def lines_for(self, cart_data: List[Dict[str, Any]]) -> Optional[Lines]:
+        """ردیف‌های مرتب‌شده سبد، یا None اگر این سبد نگهداری نمی‌شود"""
+        if not self.enabled or not cart_data or len(cart_data) > self.max_lines:
+            self._count('skipped')
+            return None
+        lines = tuple(sorted((item['product_id'], item['quantity']) for item in cart_data))
+        if len({product_id for product_id, _ in lines}) != len(lines):
+            self._count('skipped')
+            return None
+        return lines
+
+    @staticmethod
+    def version_keys(lines: Lines) -> List[str]:
+        return [RULES_VERSION_KEY] + [product_version_key(product_id) for product_id, _ in lines]
+
+    @staticmethod
+    def key_for(lines: Lines, versions: Dict[str, int]) -> str:
+        keys = QuoteCache.version_keys(lines)
+        raw = repr((lines, [versions[key] for key in keys]))
+        return QUOTE_KEY.format(digest=hashlib.sha1(raw.encode()).hexdigest())
+
+    def versions(self, lines: Lines) -> Dict[str, int]:
+        return get_versions(*self.version_keys(lines))
+
+    async def aversions(self, lines: Lines) -> Dict[str, int]:
+        return await aget_versions(*self.version_keys(lines))
+
+    def get(self, key: str, cart_data: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """نتیجه ذخیره‌شده با items به ترتیب cart_data، یا None"""
+        result = self.local.get(key)
+        if result is not None:
+            self._hit('local')
+        else:
+            result = cache.get(key)
+            if result is None:
+                self._hit('miss')
+                return None
+            self._hit('shared')
+            self.local.set(key, result)
+        return self._for_cart(result, cart_data)
+
+    async def aget(self, key: str, cart_data: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """نسخه async از get"""
+        result = self.local.get(key)
+        if result is not None:
+            self._hit('local')
+        else:
+            result = await cache.aget(key)
+            if result is None:
+                self._hit('miss')
+                return None
+            self._hit('shared')
+            self.local.set(key, result)
+        return self._for_cart(result, cart_data)
+
+    def set(self, key: str, result: Dict[str, Any]) -> None:
+        result = _copy_result(result)
+        self.local.set(key, result)
+        cache.set(key, result, self.ttl)
+
+    async def aset(self, key: str, result: Dict[str, Any]) -> None:
+        result = _copy_result(result)
+        self.local.set(key, result)
+        await cache.aset(key, result, self.ttl)
+
+    @staticmethod
+    def _for_cart(result: Dict[str, Any], cart_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+        result = _copy_result(result)
+        items = {item.product_id: item for item in result['items']}
+        result['items'] = [items[item['product_id']] for item in cart_data if item['product_id'] in items]
+        return result
+
+    def _hit(self, result: str) -> None:
+        self._count(result)
+        record_cache('quote', 'hit' if result == 'shared' else result)
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self.counts[name] += 1
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.counts = {'local': 0, 'shared': 0, 'miss': 0, 'skipped': 0}
+
+    def stats(self) -> Dict[str, Any]:
+        """شمارنده‌ها و نرخ موفقیت در میان سبدهای قابل نگهداری"""
+        with self._lock:
+            counts = dict(self.counts)
+        lookups = counts['local'] + counts['shared'] + counts['miss']
+        return {
+            **counts,
+            'size': len(self.local),
+            'hit_rate': (counts['local'] + counts['shared']) / lookups if lookups else 0.0,
+        }
+
+    def clear(self) -> None:
+        """پاک کردن LRU این پروسس؛ کش مشترک با نسخه‌ها باطل می‌شود"""
+        self.local.clear()
+
+
+quote_cache = QuoteCache.from_settings()
@@ -0,0 +1,283 @@
+"""
+تحلیل قوانین قیمت‌گذاری هنگام ساخت مجموعه قوانین فعال
+
+هر قانون با یک schema مخصوص نوع شرط و نوع تخفیف بررسی می‌شود. قوانینی
+که با schema نمی‌خوانند (مثلاً buy_quantity صفر که بدون full_clean از
+ORM یا import ذخیره شده) و قوانینی که هرگز نمی‌توانند تخفیفی بدهند
+(محصول ناموجود، تخفیف صفر، آستانه min_total بالاتر از
+PRICING_MAX_CART_TOTAL) از مجموعه ارزیابی کنار گذاشته می‌شوند. مجموعه قوانین با هر تغییر PricingRule و با ایجاد
+یا حذف محصول دوباره ساخته می‌شود، پس تحلیل همیشه با کاتالوگ فعلی است.
+
+حذف قوانین نتیجه محاسبه را تغییر نمی‌دهد، به جز آستانه
+PRICING_MAX_CART_TOTAL که فرضی درباره بزرگ‌ترین سبد واقعی است و
+به صورت پیش‌فرض خاموش است.
+"""
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+from .engine import (
+    BundleDiscount, BuyXGetYDiscount, CompiledRule, FixedDiscount, MinTotalCondition, PercentageDiscount,
+    ProductCondition, compile_rule,
+)
+from .models import PricingRule, Product
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_integer(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _number(minimum=None, maximum=None):
+    def check(value):
+        if not _is_number(value):
+            return "must be a number"
+        if minimum is not None and value < minimum:
+            return f"must be at least {minimum}"
+        if maximum is not None and value > maximum:
+            return f"must be at most {maximum}"
+        return None
+    return check
+
+
+def _integer(minimum=None):
+    def check(value):
+        if not _is_integer(value):
+            return "must be an integer"
+        if minimum is not None and value < minimum:
+            return f"must be at least {minimum}"
+        return None
+    return check
+
+
+def _product_ids(value):
+    if not isinstance(value, list) or not value:
+        return "must be a non-empty list of product ids"
+    if not all(_is_integer(product_id) and product_id > 0 for product_id in value):
+        return "must contain positive integer product ids"
+    return None
+
+
+def _choice(*choices):
+    def check(value):
+        if value not in choices:
+            return f"must be one of: {', '.join(choices)}"
+        return None
+    return check
+
+
+# کلید -> (بررسی‌کننده، الزامی بودن)؛ کلیدهای اضافه مجازند
+CONDITION_SCHEMAS = {
+    'min_total': {'min_amount': (_number(minimum=0), False)},
+    'min_quantity': {'min_quantity': (_integer(minimum=0), False)},
+    'product_based': {'product_id': (_integer(minimum=1), True), 'min_quantity': (_integer(minimum=1), False)},
+}
+
+# نوع قانون -> (schema مقدار شرط، schema مقدار تخفیف)؛ پارامترهای
+# buy_x_get_y و اعضای باندل در condition_value نگهداری می‌شوند
+RULE_SCHEMAS = {
+    'percentage_discount': ({}, {'percentage': (_number(minimum=0, maximum=100), True)}),
+    'fixed_discount': ({}, {'amount': (_number(minimum=0), True)}),
+    'buy_x_get_y': (
+        {
+            'product_id': (_integer(minimum=1), True),
+            'buy_quantity': (_integer(minimum=1), False),
+            'get_free_quantity': (_integer(minimum=1), False),
+        },
+        {},
+    ),
+    'bundle_discount': (
+        {'products': (_product_ids, True)},
+        {'type': (_choice('percentage', 'fixed'), False), 'value': (_number(minimum=0), True)},
+    ),
+}
+
+
+def _check_schema(value: Any, schema: Dict[str, Tuple], errors: List[str]) -> None:
+    for key, (check, required) in schema.items():
+        if key not in value:
+            if required:
+                errors.append(f"'{key}' is required")
+            continue
+        message = check(value[key])
+        if message:
+            errors.append(f"'{key}' {message}")
+
+
+def schema_errors(rule) -> Dict[str, List[str]]:
+    """
+    خطاهای schema یک قانون به تفکیک فیلد
+
+    Returns:
+        دیکشنری خالی اگر قانون معتبر باشد
+    """
+    errors = {}
+    condition_schema = CONDITION_SCHEMAS.get(rule.condition_type)
+    if condition_schema is None:
+        errors['condition_type'] = [f"unknown condition type {rule.condition_type!r}"]
+    rule_schemas = RULE_SCHEMAS.get(rule.rule_type)
+    if rule_schemas is None:
+        errors['rule_type'] = [f"unknown rule type {rule.rule_type!r}"]
+
+    for field, value, schemas in (
+        ('condition_value', rule.condition_value,
+         [condition_schema or {}, rule_schemas[0] if rule_schemas else {}]),
+        ('discount_value', rule.discount_value, [rule_schemas[1] if rule_schemas else {}]),
+    ):
+        if not isinstance(value, dict):
+            errors[field] = ["must be a JSON object"]
+            continue
+        messages = []
+        for schema in schemas:
+            _check_schema(value, schema, messages)
+        if messages:
+            errors[field] = messages
+    return errors
+
+
+def validate_rule(rule) -> None:
+    """
+    Raises:
+        ValidationError: اگر condition_value یا discount_value با schema نوع قانون نخواند
+    """
+    errors = schema_errors(rule)
+    if errors:
+        raise ValidationError(errors)
+
+
+def referenced_product_ids(rules: Iterable) -> Set[int]:
+    """شناسه همه محصولاتی که قوانین به آن‌ها ارجاع می‌دهند"""
+    product_ids = set()
+    for rule in rules:
+        condition_value = rule.condition_value
+        if not isinstance(condition_value, dict):
+            continue
+        product_id = condition_value.get('product_id')
+        if _is_integer(product_id):
+            product_ids.add(product_id)
+        products = condition_value.get('products')
+        if isinstance(products, list):
+            product_ids.update(product_id for product_id in products if _is_integer(product_id))
+    return product_ids
+
+
+def unreachable_reasons(rule: CompiledRule, product_ids: Set, max_total: Optional[Decimal] = None) -> List[str]:
+    """
+    دلایلی که یک قانون کامپایل‌شده هرگز تخفیف مثبت نمی‌دهد
+
+    Args:
+        rule: قانون کامپایل‌شده
+        product_ids: شناسه محصولات موجود از میان محصولات ارجاع‌شده
+        max_total: بزرگ‌ترین مبلغ سبد واقعی؛ None یعنی بدون محدودیت
+    """
+    condition, discount = rule.condition, rule.discount
+    reasons = []
+
+    if isinstance(condition, ProductCondition) and condition.product_id not in product_ids:
+        reasons.append(f"condition product {condition.product_id} does not exist")
+    if isinstance(condition, MinTotalCondition) and max_total is not None and condition.min_amount > max_total:
+        reasons.append(f"min_amount {condition.min_amount} is above the largest cart total {max_total}")
+
+    if isinstance(discount, PercentageDiscount) and discount.rate == 0:
+        reasons.append("percentage is zero")
+    elif isinstance(discount, FixedDiscount) and discount.amount <= 0:
+        reasons.append("amount is not positive")
+    elif isinstance(discount, BuyXGetYDiscount):
+        if discount.product_id not in product_ids:
+            reasons.append(f"product {discount.product_id} does not exist")
+        free = discount.get_free_quantity
+        if _is_integer(free) and (free == 0 or (free < 0 and _is_number(discount.buy_quantity)
+                                                  and discount.buy_quantity > 0)):
+            reasons.append("get_free_quantity gives no free units")
+    elif isinstance(discount, BundleDiscount):
+        if not discount.products:
+            reasons.append("bundle has no products")
+        missing = [product_id for product_id in discount.products if product_id not in product_ids]
+        if missing:
+            reasons.append(f"bundle products {missing} do not exist")
+        if discount.discount_type not in ('percentage', 'fixed'):
+            reasons.append(f"unknown bundle discount type {discount.discount_type!r}")
+        elif discount.value <= 0:
+            reasons.append("bundle value is not positive")
+    return reasons
+
+
+class RuleReport:
+    """نتیجه تحلیل یک قانون فعال"""
+    __slots__ = ('rule', 'compiled', 'errors', 'unreachable')
+
+    def __init__(self, rule, compiled: Optional[CompiledRule], errors: Dict[str, List[str]], unreachable: List[str]):
+        self.rule = rule
+        self.compiled = compiled
+        self.errors = errors
+        self.unreachable = unreachable
+
+    @property
+    def live(self) -> bool:
+        # schema فقط در PricingRule.clean بررسی می‌شود؛ قانون نامعتبری که بدون
+        # آن ذخیره شده ممکن است هنگام محاسبه خطا بدهد
+        return self.compiled is not None and not self.errors and not self.unreachable
+
+
+class RuleSetAnalysis:
+    """تحلیل همه قوانین فعال به ترتیب ارزیابی"""
+    __slots__ = ('reports',)
+
+    def __init__(self, reports: List[RuleReport]):
+        self.reports = reports
+
+    @property
+    def live_rules(self) -> Tuple[CompiledRule, ...]:
+        """قوانینی که در مجموعه ارزیابی می‌مانند، به ترتیب ارزیابی"""
+        return tuple(report.compiled for report in self.reports if report.live)
+
+
+def max_cart_total() -> Optional[Decimal]:
+    value = settings.PRICING_MAX_CART_TOTAL
+    return None if value is None else Decimal(str(value))
+
+
+def analyze_rules(rules: Iterable, product_ids: Set, max_total: Optional[Decimal] = None) -> RuleSetAnalysis:
+    """
+    تحلیل قوانین مرتب‌شده به ترتیب ارزیابی
+
+    Args:
+        rules: قوانین فعال به ترتیب (-priority, id)
+        product_ids: شناسه محصولات موجود، دست‌کم برای referenced_product_ids(rules)
+        max_total: بزرگ‌ترین مبلغ سبد واقعی؛ None یعنی بدون محدودیت
+    """
+    reports = []
+    for rule in rules:
+        compiled = compile_rule(rule)
+        unreachable = unreachable_reasons(compiled, product_ids, max_total) if compiled is not None else []
+        reports.append(RuleReport(rule, compiled, schema_errors(rule), unreachable))
+    return RuleSetAnalysis(reports)
+
+
+def _active_rules():
+    return PricingRule.objects.filter(is_active=True).order_by('-priority', 'id')
+
+
+def _existing_products(product_ids: Set[int]):
+    return Product.objects.filter(id__in=product_ids).values_list('id', flat=True)
+
+
+def analyze_active_rules() -> RuleSetAnalysis:
+    """تحلیل قوانین فعال با کاتالوگ فعلی؛ حداکثر دو کوئری"""
+    rules = list(_active_rules())
+    referenced = referenced_product_ids(rules)
+    product_ids = set(_existing_products(referenced)) if referenced else set()
+    return analyze_rules(rules, product_ids, max_cart_total())
+
+
+async def aanalyze_active_rules() -> RuleSetAnalysis:
+    """نسخه async از analyze_active_rules"""
+    rules = [rule async for rule in _active_rules()]
+    referenced = referenced_product_ids(rules)
+    product_ids = {product_id async for product_id in _existing_products(referenced)} if referenced else set()
+    return analyze_rules(rules, product_ids, max_cart_total())
@@ -0,0 +1,98 @@
+"""
+نگهداری مجموعه قوانین کامپایل‌شده در حافظه پروسس و کش Redis
+
+نسخه قوانین در کلید RULES_VERSION_KEY نگهداری می‌شود و با هر تغییر
+PricingRule افزایش می‌یابد. هر worker فقط زمانی که این نسخه تغییر کند
+مجموعه قوانین را دوباره می‌سازد. قوانینی که rule_analysis غیرقابل
+دسترس تشخیص دهد در مجموعه قرار نمی‌گیرند.
+"""
+import threading
+
+from django.core.cache import cache
+
+from .engine import CompiledRuleSet
+from .instrumentation import record_cache
+from .rule_analysis import aanalyze_active_rules, analyze_active_rules
+from .versions import RULES_VERSION_KEY, aget_version, get_rules_version
+
+# پسوند v2: CompiledRule از این نسخه stops_at_zero دارد و نمونه‌های
+# pickleشده قدیمی نباید خوانده شوند
+RULE_SET_KEY = 'pricing:rules:compiled:v2:{version}'
+RULE_SET_TIMEOUT = 24 * 60 * 60
+
+_lock = threading.Lock()
+_local_rule_set = None
+
+
+def build_rule_set(version=None) -> CompiledRuleSet:
+    """کامپایل قوانین فعال و قابل دسترس از پایگاه داده"""
+    return CompiledRuleSet(version, analyze_active_rules().live_rules)
+
+
+def get_active_rule_set(version=None) -> CompiledRuleSet:
+    """
+    مجموعه قوانین فعال برای نسخه فعلی
+
+    ترتیب جستجو: حافظه پروسس، سپس کش Redis و در نهایت پایگاه داده.
+    اگر فراخواننده نسخه را از قبل خوانده باشد می‌تواند آن را پاس دهد.
+    """
+    global _local_rule_set
+
+    if version is None:
+        version = get_rules_version()
+    rule_set = _local_rule_set
+    if rule_set is not None and rule_set.version == version:
+        record_cache('rule_set', 'local')
+        return rule_set
+
+    with _lock:
+        rule_set = _local_rule_set
+        if rule_set is not None and rule_set.version == version:
+            record_cache('rule_set', 'local')
+            return rule_set
+
+        key = RULE_SET_KEY.format(version=version)
+        rule_set = cache.get(key)
+        if rule_set is None:
+            record_cache('rule_set', 'miss')
+            rule_set = build_rule_set(version)
+            cache.set(key, rule_set, RULE_SET_TIMEOUT)
+        else:
+            record_cache('rule_set', 'hit')
+
+        _local_rule_set = rule_set
+        return rule_set
+
+
+async def abuild_rule_set(version=None) -> CompiledRuleSet:
+    """نسخه async از build_rule_set با پیمایش async قوانین"""
+    return CompiledRuleSet(version, (await aanalyze_active_rules()).live_rules)
+
+
+async def aget_active_rule_set(version=None) -> CompiledRuleSet:
+    """
+    نسخه async از get_active_rule_set
+
+    قفل پروسس در اینجا استفاده نمی‌شود؛ در بدترین حالت دو coroutine
+    همزمان یک نسخه را می‌سازند که نتیجه یکسانی دارد.
+    """
+    global _local_rule_set
+
+    if version is None:
+        version = await aget_version(RULES_VERSION_KEY)
+    rule_set = _local_rule_set
+    if rule_set is not None and rule_set.version == version:
+        record_cache('rule_set', 'local')
+        return rule_set
+
+    key = RULE_SET_KEY.format(version=version)
+    rule_set = await cache.aget(key)
+    if rule_set is None:
+        record_cache('rule_set', 'miss')
+        rule_set = await abuild_rule_set(version)
+        await cache.aset(key, rule_set, RULE_SET_TIMEOUT)
+    else:
+        record_cache('rule_set', 'hit')
+
+    _local_rule_set = rule_set
+    return rule_set
@@ -1,12 +1,24 @@
+import re
+
+from django.conf import settings
 from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail
 from .models import Product, PricingRule, Cart, CartItem
+from .rule_analysis import schema_errors
 
 class ProductSerializer(serializers.ModelSerializer):
     class Meta:
         model = Product
-        fields = ['id', 'name', 'price', 'description', 'created_at', 'updated_at']
+        fields = ['id', 'sku', 'name', 'price', 'description', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+    def __init__(self, *args, fields=None, **kwargs):
+        """Optionally serialize only the given subset of Meta.fields"""
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
 class PricingRuleSerializer(serializers.ModelSerializer):
     class Meta:
         model = PricingRule
@@ -17,10 +29,128 @@ class PricingRuleSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at']
 
+class PricingRuleDraftSerializer(serializers.ModelSerializer):
+    """An unsaved pricing rule, checked against the same schema as saved rules"""
+    class Meta:
+        model = PricingRule
+        fields = ['name', 'rule_type', 'condition_type', 'condition_value', 'discount_value', 'priority']
+    
+    def validate(self, attrs):
+        errors = schema_errors(PricingRule(**attrs))
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
+
+class RuleSimulationSerializer(serializers.Serializer):
+    # Saved rules added to the candidate set whether or not they are active
+    rules = serializers.ListField(child=serializers.IntegerField(min_value=1), default=list)
+    drafts = PricingRuleDraftSerializer(many=True, default=list)
+    include_active = serializers.BooleanField(default=True)
+    limit = serializers.IntegerField(min_value=1, required=False)
+    sample_rate = serializers.FloatField(min_value=0, max_value=1, default=1.0)
+    chunk_size = serializers.IntegerField(min_value=1, max_value=10000, default=1000)
+    seed = serializers.IntegerField(default=0)
+
+    def validate_rules(self, rule_ids):
+        missing = set(rule_ids) - set(PricingRule.objects.filter(id__in=rule_ids).values_list('id', flat=True))
+        if missing:
+            raise serializers.ValidationError(
+                f"Invalid rule ids: {', '.join(str(rule_id) for rule_id in sorted(missing))}."
+            )
+        return rule_ids
+
+    def validate_limit(self, limit):
+        if limit > settings.PRICING_SIMULATION_MAX_CARTS:
+            raise serializers.ValidationError(
+                f"At most {settings.PRICING_SIMULATION_MAX_CARTS} carts can be replayed per request."
+            )
+        return limit
+
 class CartItemInputSerializer(serializers.Serializer):
     product_id = serializers.IntegerField(min_value=1)
     quantity = serializers.IntegerField(min_value=1)
 
+CART_ITEM_FIELDS = ('product_id', 'quantity')
+_integer_re = re.compile(r'^\s*[-+]?\d+(\.0*)?\s*$')
+
+
+def _parse_positive_integer(value):
+    """Mirror IntegerField(min_value=1) without building a field instance"""
+    if value is None:
+        raise serializers.ValidationError('This field may not be null.', code='null')
+    if isinstance(value, bool):
+        raise serializers.ValidationError('A valid integer is required.', code='invalid')
+    if isinstance(value, int):
+        number = value
+    elif isinstance(value, float) and value.is_integer():
+        number = int(value)
+    elif isinstance(value, str) and len(value) <= 1000 and _integer_re.match(value):
+        number = int(value.strip().split('.')[0])
+    else:
+        raise serializers.ValidationError('A valid integer is required.', code='invalid')
+
+    if number < 1:
+        raise serializers.ValidationError('Ensure this value is greater than or equal to 1.', code='min_value')
+    return number
+
+
+def parse_cart_items(data, merge_duplicates=False):
+    """
+    Validate a calculate-cart payload in a single pass.
+
+    Accepts the same input as CartItemInputSerializer(many=True) and
+    reports errors in the same shape. Repeated product_ids are rejected
+    unless merge_duplicates is set, in which case their quantities are
+    summed into the first line for that product.
+    """
+    if not isinstance(data, list):
+        raise serializers.ValidationError({
+            'non_field_errors': [f'Expected a list of items but got type "{type(data).__name__}".']
+        }, code='not_a_list')
+
+    items = []
+    lines = {}
+    errors = {}
+    for index, entry in enumerate(data):
+        if not isinstance(entry, dict):
+            errors[index] = {
+                'non_field_errors': [ErrorDetail(
+                    f'Invalid data. Expected a dictionary, but got {type(entry).__name__}.', code='invalid'
+                )]
+            }
+            continue
+
+        item = {}
+        item_errors = {}
+        for field in CART_ITEM_FIELDS:
+            if field not in entry:
+                item_errors[field] = [ErrorDetail('This field is required.', code='required')]
+                continue
+            try:
+                item[field] = _parse_positive_integer(entry[field])
+            except serializers.ValidationError as exc:
+                item_errors[field] = exc.detail
+        if item_errors:
+            errors[index] = item_errors
+            continue
+
+        product_id = item['product_id']
+        if product_id in lines:
+            if merge_duplicates:
+                lines[product_id]['quantity'] += item['quantity']
+                continue
+            errors[index] = {'product_id': [ErrorDetail(
+                f'Duplicate product_id {product_id}; pass merge=true to combine lines.', code='unique'
+            )]}
+            continue
+        lines[product_id] = item
+        items.append(item)
+
+    if errors:
+        raise serializers.ValidationError(errors)
+    return items
+
+
 class CartCalculationSerializer(serializers.Serializer):
     base_total = serializers.FloatField()
     final_total = serializers.FloatField()
@@ -37,6 +167,37 @@ class CartItemSerializer(serializers.ModelSerializer):
         fields = ['id', 'cart', 'product', 'product_name', 'product_price', 'quantity', 'added_at']
         read_only_fields = ['id', 'added_at']
 
+class CartItemAddSerializer(serializers.Serializer):
+    # Omitted: the item goes to the session's cart
+    cart = serializers.PrimaryKeyRelatedField(queryset=Cart.objects.all(), required=False)
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all())
+    quantity = serializers.IntegerField(min_value=1, default=1)
+
+class CartLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=1)
+
+class CartItemsSetSerializer(serializers.Serializer):
+    cart = serializers.PrimaryKeyRelatedField(queryset=Cart.objects.all())
+    items = CartLineSerializer(many=True, allow_empty=False)
+    
+    def validate_items(self, items):
+        quantities = {}
+        for item in items:
+            if item['product'] in quantities:
+                raise serializers.ValidationError(f"Duplicate product {item['product']}.")
+            quantities[item['product']] = item['quantity']
+        
+        # One query for every product instead of one per line
+        missing = set(quantities) - set(
+            Product.objects.filter(id__in=quantities).values_list('id', flat=True)
+        )
+        if missing:
+            raise serializers.ValidationError(
+                f"Invalid product ids: {', '.join(str(product_id) for product_id in sorted(missing))}."
+            )
+        return quantities
+
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
     items_count = serializers.SerializerMethodField()
@@ -47,8 +208,10 @@ class CartSerializer(serializers.ModelSerializer):
         fields = ['id', 'session_key', 'items', 'items_count', 'total_price', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
     
+    # Both read the items already loaded for the nested serializer; use
+    # Cart.objects.with_items() so that is a single prefetch query
     def get_items_count(self, obj):
-        return obj.items.count()
+        return len(obj.items.all())
     
     def get_total_price(self, obj):
         return sum(item.product.price * item.quantity for item in obj.items.all())
\ No newline at end of file
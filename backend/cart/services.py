@@ -1,7 +1,40 @@
+import time
 from decimal import Decimal
-from typing import List, Dict, Any
-from django.db import transaction
-from .models import Product, PricingRule
+from typing import List, Dict, Any, Iterable, Optional
+from django.db import connections, router, transaction
+from django.utils import timezone
+from .engine import (
+    CartIndex, CartLine, CompiledRule, CompiledRuleSet, ProductRecord, apply_rule, price_cart,
+    price_carts, price_carts_parallel,
+)
+from .instrumentation import current_metrics, record_rule
+from .models import Cart, CartItem, Product
+from .quote_cache import quote_cache
+from .rule_cache import aget_active_rule_set, get_active_rule_set
+from .versions import RULES_VERSION_KEY
+
+# کلید شناسه سبد در جلسه کاربر
+SESSION_CART_KEY = 'cart_id'
+
+# قالب‌های خروجی مبالغ: float برای سازگاری با API فعلی، string برای مقدار دقیق
+AMOUNT_FORMATS = ('float', 'string')
+
+
+def format_amounts(result: Dict[str, Any], amount_format: str = 'float') -> Dict[str, Any]:
+    """
+    تبدیل مبالغ Decimal نتیجه محاسبه به قالب خروجی، یک بار در مرز پاسخ
+    
+    نتیجه در همان شیء تغییر داده می‌شود و بازگردانده می‌شود.
+    """
+    convert = str if amount_format == 'string' else float
+    
+    for key in ('base_total', 'final_total', 'total_discount'):
+        result[key] = convert(result[key])
+    result['items'] = [item.as_dict(convert) for item in result['items']]
+    result['applied_rules'] = [applied_rule.as_dict(convert) for applied_rule in result['applied_rules']]
+    
+    return result
+
 
 class PricingService:
     """
@@ -10,175 +43,393 @@ class PricingService:
     """
     
     @staticmethod
-    def calculate_cart_total(cart_data: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def calculate_cart_total(cart_data: List[Dict[str, Any]], amount_format: str = 'float') -> Dict[str, Any]:
         """
         محاسبه قیمت نهایی سبد خرید با اعمال قوانین
         
+        نتیجه سبدهای کوچک در quote_cache نگهداری و با تغییر قوانین یا
+        محصولات سبد باطل می‌شود.
+        
         Args:
             cart_data: لیستی از دیکشنری‌های حاوی product_id و quantity
+            amount_format: قالب مبالغ خروجی؛ یکی از AMOUNT_FORMATS
             
         Returns:
             دیکشنری حاوی جزئیات محاسبه قیمت
         """
-        # محاسبه قیمت پایه
-        base_total = Decimal('0')
-        items_detail = []
-        
-        for item in cart_data:
-            try:
-                product = Product.objects.get(id=item['product_id'])
-                quantity = item['quantity']
-                item_total = product.price * quantity
-                
-                base_total += item_total
-                items_detail.append({
-                    'product_id': product.id,
-                    'product_name': product.name,
-                    'quantity': quantity,
-                    'unit_price': float(product.price),
-                    'total_price': float(item_total)
-                })
-            except Product.DoesNotExist:
-                continue
-        
-        # اعمال قوانین قیمت‌گذاری
-        rules = PricingRule.objects.filter(is_active=True).order_by('-priority', 'id')
-        applied_rules = []
-        final_total = base_total
-        
-        for rule in rules:
-            discount_amount = PricingService._apply_rule(rule, items_detail, final_total)
-            
-            if discount_amount > 0:
-                final_total -= discount_amount
-                applied_rules.append({
-                    'rule_name': rule.name,
-                    'rule_type': rule.rule_type,
-                    'discount_amount': float(discount_amount)
-                })
+        lines = quote_cache.lines_for(cart_data)
+        if lines is None:
+            products = PricingService._load_products(cart_data)
+            result = PricingService._price_cart(cart_data, products, get_active_rule_set())
+            return format_amounts(result, amount_format)
         
-        return {
-            'base_total': float(base_total),
-            'final_total': float(final_total),
-            'total_discount': float(base_total - final_total),
-            'items': items_detail,
-            'applied_rules': applied_rules
-        }
+        versions = quote_cache.versions(lines)
+        key = quote_cache.key_for(lines, versions)
+        result = quote_cache.get(key, cart_data)
+        if result is None:
+            products = PricingService._load_products(cart_data)
+            result = PricingService._price_cart(
+                cart_data, products, get_active_rule_set(versions[RULES_VERSION_KEY])
+            )
+            quote_cache.set(key, result)
+        return format_amounts(result, amount_format)
     
     @staticmethod
-    def _apply_rule(rule: PricingRule, items_detail: List[Dict], current_total: Decimal) -> Decimal:
+    async def acalculate_cart_total(cart_data: List[Dict[str, Any]], amount_format: str = 'float') -> Dict[str, Any]:
         """
-        اعمال یک قانون قیمت‌گذاری خاص
+        نسخه async از calculate_cart_total با ORM و کش async
         
         Args:
-            rule: قانون قیمت‌گذاری
-            items_detail: جزئیات آیتم‌های سبد خرید
-            current_total: قیمت فعلی سبد خرید
+            cart_data: لیستی از دیکشنری‌های حاوی product_id و quantity
+            amount_format: قالب مبالغ خروجی؛ یکی از AMOUNT_FORMATS
             
         Returns:
-            مقدار تخفیف اعمال شده
+            دیکشنری حاوی جزئیات محاسبه قیمت
         """
-        # بررسی شرط قانون
-        if not PricingService._check_condition(rule, items_detail, current_total):
-            return Decimal('0')
+        lines = quote_cache.lines_for(cart_data)
+        if lines is None:
+            products = await PricingService.aload_product_records(item['product_id'] for item in cart_data)
+            result = PricingService._price_cart(cart_data, products, await aget_active_rule_set())
+            return format_amounts(result, amount_format)
         
-        # اعمال تخفیف بر اساس نوع قانون
-        rule_methods = {
-            'percentage_discount': PricingService._apply_percentage_discount,
-            'fixed_discount': PricingService._apply_fixed_discount,
-            'buy_x_get_y': PricingService._apply_buy_x_get_y,
-            'bundle_discount': PricingService._apply_bundle_discount,
-        }
+        versions = await quote_cache.aversions(lines)
+        key = quote_cache.key_for(lines, versions)
+        result = await quote_cache.aget(key, cart_data)
+        if result is None:
+            products = await PricingService.aload_product_records(item['product_id'] for item in cart_data)
+            result = PricingService._price_cart(
+                cart_data, products, await aget_active_rule_set(versions[RULES_VERSION_KEY])
+            )
+            await quote_cache.aset(key, result)
+        return format_amounts(result, amount_format)
+    
+    @staticmethod
+    def calculate_many(carts: List[List[Dict[str, Any]]], amount_format: str = 'float',
+                       backend: str = 'scalar') -> List[Dict[str, Any]]:
+        """
+        محاسبه قیمت چند سبد خرید با یک کوئری محصولات و یک نسخه از قوانین
         
-        method = rule_methods.get(rule.rule_type)
-        if method:
-            return method(rule, items_detail, current_total)
+        خروجی هر سبد دقیقاً برابر با calculate_cart_total است.
         
-        return Decimal('0')
+        Args:
+            carts: لیستی از سبدها؛ هر سبد لیستی از product_id و quantity
+            amount_format: قالب مبالغ خروجی؛ یکی از AMOUNT_FORMATS
+            backend: یکی از engine.PRICING_BACKENDS؛ numpy برای دسته‌های بزرگ
+            
+        Returns:
+            نتایج محاسبه به همان ترتیب ورودی
+        """
+        products = PricingService._load_products(item for cart_data in carts for item in cart_data)
+        rule_set = get_active_rule_set()
+        if backend != 'scalar':
+            lines = [[CartLine(item['product_id'], item['quantity']) for item in cart_data] for cart_data in carts]
+            return [
+                format_amounts(result, amount_format)
+                for result in price_carts(lines, products, rule_set, backend)
+            ]
+        return [
+            format_amounts(PricingService._price_cart(cart_data, products, rule_set), amount_format)
+            for cart_data in carts
+        ]
     
     @staticmethod
-    def _check_condition(rule: PricingRule, items_detail: List[Dict], current_total: Decimal) -> bool:
-        """بررسی شرط قانون"""
-        condition_type = rule.condition_type
-        condition_value = rule.condition_value
+    def calculate_many_parallel(carts: List[List[Dict[str, Any]]], rule_set: Optional[CompiledRuleSet] = None,
+                                amount_format: str = 'float', max_workers: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        محاسبه قیمت تعداد زیادی سبد در چند پروسس با engine.price_carts_parallel
+        
+        برای کارهای شبیه‌سازی مناسب است، مانند اجرای دوباره سبدهای گذشته
+        روی یک مجموعه قوانین پیشنهادی. پروسس‌های کارگر به Django و پایگاه
+        داده دسترسی ندارند؛ محصولات یک بار به صورت ProductRecord بارگذاری
+        و برای هر کارگر ارسال می‌شوند.
         
-        if condition_type == 'min_total':
-            min_amount = Decimal(str(condition_value.get('min_amount', 0)))
-            return current_total >= min_amount
+        Args:
+            carts: لیستی از سبدها؛ هر سبد لیستی از product_id و quantity
+            rule_set: مجموعه قوانین؛ پیش‌فرض قوانین فعال فعلی
+            amount_format: قالب مبالغ خروجی؛ یکی از AMOUNT_FORMATS
+            max_workers: تعداد پروسس‌ها؛ پیش‌فرض تعداد CPUها
+            
+        Returns:
+            نتایج محاسبه به همان ترتیب ورودی
+        """
+        products = PricingService.load_product_records(
+            item['product_id'] for cart_data in carts for item in cart_data
+        )
+        if rule_set is None:
+            rule_set = get_active_rule_set()
+        lines = [[CartLine(item['product_id'], item['quantity']) for item in cart_data] for cart_data in carts]
+        return [
+            format_amounts(result, amount_format)
+            for result in price_carts_parallel(lines, products, rule_set, max_workers)
+        ]
+    
+    @staticmethod
+    def load_product_records(product_ids: Iterable[int]) -> Dict[int, ProductRecord]:
+        """
+        محصولات به صورت ProductRecord، بدون ساخت نمونه مدل
         
-        elif condition_type == 'min_quantity':
-            min_qty = condition_value.get('min_quantity', 0)
-            total_quantity = sum(item['quantity'] for item in items_detail)
-            return total_quantity >= min_qty
+        Args:
+            product_ids: شناسه محصولات؛ تکرار مجاز است
+            
+        Returns:
+            نگاشت شناسه محصول به رکورد؛ محصولات ناموجود در آن نیستند
+        """
+        rows = PricingService._product_rows(product_ids)
+        return {product_id: ProductRecord(product_id, name, price) for product_id, name, price in rows}
+    
+    @staticmethod
+    async def aload_product_records(product_ids: Iterable[int]) -> Dict[int, ProductRecord]:
+        """نسخه async از load_product_records"""
+        rows = PricingService._product_rows(product_ids)
+        return {product_id: ProductRecord(product_id, name, price) async for product_id, name, price in rows}
+    
+    @staticmethod
+    def _product_rows(product_ids: Iterable[int]):
+        # فقط ستون‌های لازم برای قیمت‌گذاری؛ description و زمان‌ها خوانده نمی‌شوند
+        return Product.objects.filter(id__in=set(product_ids)).values_list('id', 'name', 'price')
+    
+    @staticmethod
+    def calculate_cart(cart_items: Iterable, rule_set: Optional[CompiledRuleSet] = None) -> Dict[str, Any]:
+        """
+        محاسبه قیمت اقلام یک سبد ذخیره‌شده بدون کوئری اضافه
         
-        elif condition_type == 'product_based':
-            product_id = condition_value.get('product_id')
-            min_qty = condition_value.get('min_quantity', 1)
+        Args:
+            cart_items: اشیائی با product (دارای id، name و price) و quantity،
+                مانند CartItemهای بارگذاری‌شده با Cart.objects.with_items()
+            rule_set: مجموعه قوانین در صورتی که از قبل بارگذاری شده باشد
             
-            for item in items_detail:
-                if item['product_id'] == product_id and item['quantity'] >= min_qty:
-                    return True
-            return False
+        Returns:
+            دیکشنری حاوی جزئیات محاسبه قیمت
+        """
+        cart_data = []
+        products = {}
+        for cart_item in cart_items:
+            product = cart_item.product
+            products[product.id] = product
+            cart_data.append({'product_id': product.id, 'quantity': cart_item.quantity})
+        
+        if rule_set is None:
+            rule_set = get_active_rule_set()
+        result = PricingService._price_cart(cart_data, products, rule_set)
+        return format_amounts(result)
+    
+    @staticmethod
+    def _price_cart(cart_data: List[Dict[str, Any]], products: Dict[int, Product],
+                    rule_set: CompiledRuleSet) -> Dict[str, Any]:
+        """
+        محاسبه قیمت یک سبد روی محصولات و قوانین از پیش بارگذاری‌شده
         
-        return False
+        محاسبه در engine.price_cart انجام می‌شود؛ این متد فقط ورودی API را
+        به CartLine تبدیل می‌کند و ارزیاب اندازه‌گیری‌شده را به آن می‌دهد.
+        
+        Args:
+            cart_data: لیستی از دیکشنری‌های حاوی product_id و quantity
+            products: نگاشت شناسه محصول به محصول
+            rule_set: مجموعه قوانین کامپایل‌شده
+            
+        Returns:
+            دیکشنری حاوی جزئیات محاسبه قیمت با مبالغ Decimal
+        """
+        lines = [CartLine(item['product_id'], item['quantity']) for item in cart_data]
+        return price_cart(lines, products, rule_set, PricingService._apply_rule)
     
     @staticmethod
-    def _apply_percentage_discount(rule: PricingRule, items_detail: List[Dict], current_total: Decimal) -> Decimal:
-        """اعمال تخفیف درصدی"""
-        discount_percentage = Decimal(str(rule.discount_value.get('percentage', 0)))
-        return current_total * (discount_percentage / 100)
+    def _load_products(cart_data: Iterable[Dict[str, Any]]) -> Dict[int, ProductRecord]:
+        """
+        بارگذاری تمام محصولات سبد خرید با یک کوئری
+        
+        Args:
+            cart_data: دیکشنری‌های حاوی product_id و quantity
+            
+        Returns:
+            نگاشت شناسه محصول به ProductRecord؛ محصولات ناموجود در آن نیستند
+        """
+        return PricingService.load_product_records(item['product_id'] for item in cart_data)
     
     @staticmethod
-    def _apply_fixed_discount(rule: PricingRule, items_detail: List[Dict], current_total: Decimal) -> Decimal:
-        """اعمال تخفیف ثابت"""
-        discount_amount = Decimal(str(rule.discount_value.get('amount', 0)))
-        return min(discount_amount, current_total)
+    def _apply_rule(rule: CompiledRule, cart: CartIndex, current_total: Decimal,
+                    products: Dict[int, Product]) -> Decimal:
+        """
+        اعمال یک قانون قیمت‌گذاری کامپایل‌شده
+        
+        Args:
+            rule: قانون کامپایل‌شده
+            cart: نمایه اقلام سبد خرید
+            current_total: قیمت فعلی سبد خرید
+            products: نگاشت محصولات بارگذاری‌شده در همین درخواست
+            
+        Returns:
+            مقدار تخفیف اعمال شده
+        """
+        if current_metrics() is None:
+            return apply_rule(rule, cart, current_total, products)
+        
+        # درخواست نمونه‌برداری‌شده: زمان ارزیابی هر قانون ثبت می‌شود
+        started = time.perf_counter()
+        discount_amount = apply_rule(rule, cart, current_total, products)
+        record_rule(rule, time.perf_counter() - started)
+        return discount_amount
+
+
+class CartService:
+    """
+    سرویس تغییر اقلام سبد خرید با عملیات اتمیک در پایگاه داده
+    
+    افزودن و تنظیم اقلام با INSERT ... ON CONFLICT انجام می‌شود تا
+    درخواست‌های همزمان برای یک محصول به جای IntegrityError، تعداد را
+    به درستی جمع کنند.
+    """
     
     @staticmethod
-    def _apply_buy_x_get_y(rule: PricingRule, items_detail: List[Dict], current_total: Decimal) -> Decimal:
-        """اعمال قانون خرید X بگیر Y رایگان"""
-        product_id = rule.condition_value.get('product_id')
-        buy_x = rule.condition_value.get('buy_quantity', 1)
-        get_y = rule.condition_value.get('get_free_quantity', 1)
+    def session_cart_id(session) -> Optional[int]:
+        """
+        شناسه سبد جلسه، بدون ساختن جلسه یا سبد
         
-        for item in items_detail:
-            if item['product_id'] == product_id:
-                product = Product.objects.get(id=product_id)
-                free_units = (item['quantity'] // buy_x) * get_y
-                return free_units * product.price
+        برای جلسه‌هایی که پیش از نگهداری شناسه سبد در جلسه ساخته شده‌اند،
+        سبد یک بار با session_key پیدا و شناسه آن در جلسه ذخیره می‌شود.
+        """
+        cart_id = session.get(SESSION_CART_KEY)
+        if cart_id is None and session.session_key:
+            cart_id = Cart.objects.filter(session_key=session.session_key).values_list('id', flat=True).first()
+            if cart_id is not None:
+                session[SESSION_CART_KEY] = cart_id
+        return cart_id
+    
+    @staticmethod
+    async def asession_cart_id(session) -> Optional[int]:
+        """نسخه async از session_cart_id"""
+        cart_id = await session.aget(SESSION_CART_KEY)
+        if cart_id is None and session.session_key:
+            cart_id = await Cart.objects.filter(session_key=session.session_key).values_list('id', flat=True).afirst()
+            if cart_id is not None:
+                await session.aset(SESSION_CART_KEY, cart_id)
+        return cart_id
+    
+    @staticmethod
+    def get_or_create_session_cart(session) -> int:
+        """
+        شناسه سبد جلسه؛ جلسه و ردیف سبد در صورت نبود ساخته می‌شوند
         
-        return Decimal('0')
+        فقط هنگام افزودن اولین کالا فراخوانی می‌شود تا بازدیدکنندگانی که
+        چیزی به سبد اضافه نمی‌کنند (از جمله خزنده‌ها) ردیفی نسازند.
+        """
+        if session.session_key is None:
+            session.create()
+        cart, _ = Cart.objects.get_or_create(session_key=session.session_key)
+        session[SESSION_CART_KEY] = cart.id
+        return cart.id
+    
+    @staticmethod
+    def forget_session_cart(session) -> None:
+        """حذف شناسه سبدی که دیگر وجود ندارد از جلسه"""
+        session.pop(SESSION_CART_KEY, None)
     
     @staticmethod
-    def _apply_bundle_discount(rule: PricingRule, items_detail: List[Dict], current_total: Decimal) -> Decimal:
-        """اعمال تخفیف باندل"""
-        bundle_products = rule.condition_value.get('products', [])
-        discount_type = rule.discount_value.get('type', 'percentage')
-        discount_value = Decimal(str(rule.discount_value.get('value', 0)))
+    def purge_empty_carts(older_than, batch_size: int = 1000, on_batch=None) -> int:
+        """
+        حذف دسته‌ای سبدهای بدون کالا که از older_than به بعد تغییر نکرده‌اند
         
-        # بررسی وجود تمام محصولات باندل در سبد خرید
-        bundle_in_cart = True
-        bundle_items = []
+        هر دسته در تراکنش خودش حذف می‌شود تا قفل‌ها کوتاه بمانند.
+        
+        Args:
+            older_than: زمان مرز؛ سبدهای با updated_at قبل از آن حذف می‌شوند
+            batch_size: تعداد سبدهای هر دستور حذف
+            on_batch: پس از هر دسته با تعداد کل حذف‌شده تا آن لحظه فراخوانی می‌شود
+            
+        Returns:
+            تعداد سبدهای حذف‌شده
+        """
+        expired = Cart.objects.filter(items__isnull=True, updated_at__lt=older_than).order_by('id')
+        deleted = 0
+        last_id = 0
+        while True:
+            ids = list(expired.filter(id__gt=last_id).values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            last_id = ids[-1]
+            with transaction.atomic(using=router.db_for_write(Cart)):
+                # کالایی که در این فاصله اضافه شده باشد سبد را از حذف خارج می‌کند
+                deleted += Cart.objects.filter(id__in=ids, items__isnull=True).delete()[1].get(Cart._meta.label, 0)
+            if on_batch:
+                on_batch(deleted)
+    
+    @staticmethod
+    def add_item(cart_id: int, product_id: int, quantity: int = 1) -> CartItem:
+        """
+        افزودن محصول به سبد یا افزایش تعداد آن با یک دستور
         
-        for product_id in bundle_products:
-            found = False
-            for item in items_detail:
-                if item['product_id'] == product_id and item['quantity'] >= 1:
-                    bundle_items.append(item)
-                    found = True
-                    break
-            if not found:
-                bundle_in_cart = False
-                break
+        Args:
+            cart_id: شناسه سبد خرید
+            product_id: شناسه محصول
+            quantity: تعدادی که به ردیف موجود اضافه می‌شود
+            
+        Returns:
+            ردیف نهایی سبد به همراه محصول
+        """
+        db = router.db_for_write(CartItem)
+        connection = connections[db]
+        qn = connection.ops.quote_name
+        table = qn(CartItem._meta.db_table)
+        added_at = CartItem._meta.get_field('added_at').get_db_prep_value(timezone.now(), connection)
         
-        if not bundle_in_cart or not bundle_items:
-            return Decimal('0')
+        sql = (
+            f"INSERT INTO {table} ({qn('cart_id')}, {qn('product_id')}, {qn('quantity')}, {qn('added_at')}) "
+            f"VALUES (%s, %s, %s, %s) "
+            f"ON CONFLICT ({qn('cart_id')}, {qn('product_id')}) "
+            f"DO UPDATE SET {qn('quantity')} = {table}.{qn('quantity')} + EXCLUDED.{qn('quantity')} "
+            f"RETURNING {qn('id')}"
+        )
+        with transaction.atomic(using=db):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [cart_id, product_id, quantity, added_at])
+                item_id = cursor.fetchone()[0]
+            item = CartItem.objects.using(db).select_related('product').get(pk=item_id)
+            CartService._changed(item.cart_id, [item])
+        return item
+    
+    @staticmethod
+    def set_items(cart_id: int, quantities: Dict[int, int]) -> List[CartItem]:
+        """
+        تنظیم تعداد چند محصول در سبد با یک دستور upsert
         
-        # محاسبه تخفیف
-        if discount_type == 'percentage':
-            bundle_total = sum(Decimal(str(item['total_price'])) for item in bundle_items)
-            return bundle_total * (discount_value / 100)
-        elif discount_type == 'fixed':
-            return discount_value
+        Args:
+            cart_id: شناسه سبد خرید
+            quantities: نگاشت شناسه محصول به تعداد جدید
+            
+        Returns:
+            ردیف‌های تنظیم‌شده به همراه محصول
+        """
+        with transaction.atomic(using=router.db_for_write(CartItem)):
+            CartItem.objects.bulk_create(
+                [
+                    CartItem(cart_id=cart_id, product_id=product_id, quantity=quantity)
+                    for product_id, quantity in quantities.items()
+                ],
+                update_conflicts=True,
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity'],
+            )
+            items = list(
+                CartItem.objects.filter(cart_id=cart_id, product_id__in=quantities)
+                .select_related('product')
+                .order_by('id')
+            )
+            CartService._changed(cart_id, items)
+        return items
+    
+    @staticmethod
+    def _changed(cart_id: int, items: List[CartItem]) -> None:
+        """
+        به‌روزرسانی تصویر سبد پس از commit
+
+        این عملیات سیگنال post_save ارسال نمی‌کنند؛ یک ردیف در تصویر
+        وصله می‌شود و برای چند ردیف، تصویر دوباره ساخته می‌شود.
+        """
+        # snapshots خودش به PricingService وابسته است
+        from .snapshots import invalidate_cart_snapshot, refresh_snapshot_line
         
-        return Decimal('0')
\ No newline at end of file
+        if len(items) == 1:
+            item_id = items[0].id
+            transaction.on_commit(lambda: refresh_snapshot_line(cart_id, item_id))
+        else:
+            transaction.on_commit(lambda: invalidate_cart_snapshot(cart_id))
@@ -0,0 +1,56 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .db_router import pin_catalog
+from .instrumentation import install_query_recorder
+from .models import Cart, CartItem, PricingRule, Product
+from .snapshots import invalidate_cart_snapshot, refresh_snapshot_line
+from .versions import bump_catalog_version, bump_product_versions, bump_rules_version
+
+
+# Counts SQL queries for sampled requests
+connection_created.connect(install_query_recorder)
+
+
+@receiver([post_save, post_delete], sender=PricingRule)
+def invalidate_pricing_rules(sender, **kwargs):
+    """Bump the rule-set version once the change is visible to other workers"""
+    # Pinned first, so nothing built for the new version reads a lagging replica
+    transaction.on_commit(pin_catalog)
+    transaction.on_commit(bump_rules_version)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_catalog(sender, **kwargs):
+    """Product prices and names are baked into priced cart snapshots"""
+    transaction.on_commit(pin_catalog)
+    transaction.on_commit(bump_catalog_version)
+
+
+@receiver([post_save, post_delete], sender=Product)
+def invalidate_product_quotes(sender, instance, **kwargs):
+    """Memoized quotes are keyed by the version of each product in the cart"""
+    product_id = instance.pk
+    transaction.on_commit(lambda: bump_product_versions([product_id]))
+
+
+@receiver([post_save, post_delete], sender=Product)
+def reanalyze_pricing_rules(sender, signal, created=False, **kwargs):
+    """Rules naming a product become reachable or unreachable when it is created or deleted"""
+    if created or signal is post_delete:
+        transaction.on_commit(bump_rules_version)
+
+
+@receiver([post_save, post_delete], sender=CartItem)
+def patch_cart_snapshot(sender, instance, **kwargs):
+    """Bring the changed line of the cart's priced snapshot up to date with the database"""
+    cart_id, item_id = instance.cart_id, instance.pk
+    transaction.on_commit(lambda: refresh_snapshot_line(cart_id, item_id))
+
+
+@receiver(post_delete, sender=Cart)
+def drop_cart_snapshot(sender, instance, **kwargs):
+    cart_id = instance.pk
+    transaction.on_commit(lambda: invalidate_cart_snapshot(cart_id))
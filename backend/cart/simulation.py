@@ -0,0 +1,220 @@
+"""
+شبیه‌سازی یک مجموعه قوانین پیشنهادی روی سبدهای ذخیره‌شده
+
+مجموعه قوانین از قوانین فعال، قوانین انتخاب‌شده (حتی غیرفعال) و قوانین
+پیش‌نویسی که هنوز ذخیره نشده‌اند ساخته می‌شود و سبدهای ذخیره‌شده
+(Cart/CartItem) دسته به دسته با موتور قیمت‌گذاری دوباره محاسبه می‌شوند.
+برای هر قانون تعداد ارزیابی، تعداد اعمال (تخفیف مثبت)، مجموع تخفیف و
+زمان ارزیابی اندازه‌گیری می‌شود.
+
+سبدها با صفحه‌بندی keyset روی شناسه و محصولات هر دسته جداگانه خوانده
+می‌شوند و از نتیجه هر سبد فقط جمع‌ها نگه داشته می‌شود؛ بنابراین حافظه
+مصرفی به تعداد سبدها بستگی ندارد.
+"""
+import json
+import random
+import time
+from decimal import Decimal, localcontext
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from django.db.models import Q
+
+from .engine import (
+    PRICING_CONTEXT, ZERO, CartLine, CompiledRule, CompiledRuleSet, RuleRecord, apply_rule, compile_rule, price_cart,
+)
+from .models import Cart, CartItem, PricingRule
+from .services import PricingService
+
+SIMULATION_VERSION = 'simulation'
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def draft_record(draft: Dict[str, Any]) -> RuleRecord:
+    """قانون پیش‌نویس (با فیلدهای PricingRule) بدون شناسه"""
+    return RuleRecord(
+        None, draft['name'], draft['rule_type'], draft['condition_type'],
+        draft.get('condition_value', {}), draft.get('discount_value', {}), draft.get('priority', 0),
+    )
+
+
+def build_candidate_rule_set(rule_ids: Iterable[int] = (), drafts: Iterable[Dict[str, Any]] = (),
+                             include_active: bool = True) -> Tuple[CompiledRuleSet, List[str]]:
+    """
+    مجموعه قوانین پیشنهادی برای شبیه‌سازی
+
+    Args:
+        rule_ids: قوانین ذخیره‌شده‌ای که صرف نظر از is_active افزوده می‌شوند
+        drafts: قوانین پیش‌نویس با فیلدهای PricingRule
+        include_active: افزودن همه قوانین فعال فعلی
+
+    Returns:
+        (مجموعه قوانین به ترتیب ارزیابی، نام قوانینی که کامپایل نشدند)؛
+        پیش‌نویس‌ها در اولویت برابر پس از قوانین ذخیره‌شده ارزیابی می‌شوند
+    """
+    selected = Q(id__in=list(rule_ids))
+    if include_active:
+        selected |= Q(is_active=True)
+    records = list(PricingRule.objects.filter(selected)) + [draft_record(draft) for draft in drafts]
+    records.sort(key=lambda rule: (-rule.priority, rule.id is None, rule.id or 0))
+
+    compiled, skipped = [], []
+    for record in records:
+        rule = compile_rule(record)
+        if rule is None:
+            skipped.append(record.name)
+        else:
+            compiled.append(rule)
+    return CompiledRuleSet(SIMULATION_VERSION, tuple(compiled)), skipped
+
+
+def stored_cart_chunks(chunk_size: int = DEFAULT_CHUNK_SIZE, limit: Optional[int] = None,
+                       sample_rate: float = 1.0, seed: int = 0) -> Iterator[Tuple[List[List[CartLine]], Dict]]:
+    """
+    سبدهای ذخیره‌شده دسته به دسته، هر دسته با محصولات خودش
+
+    Args:
+        chunk_size: حداکثر تعداد سبد در هر دسته
+        limit: حداکثر تعداد کل سبدها؛ None یعنی همه
+        sample_rate: سهم سبدهایی که انتخاب می‌شوند، بین ۰ و ۱
+        seed: بذر نمونه‌گیری؛ با seed برابر همان سبدها انتخاب می‌شوند
+
+    Yields:
+        (ردیف‌های هر سبد، نگاشت شناسه محصول به ProductRecord)؛ سبدهای
+        خالی کنار گذاشته می‌شوند
+    """
+    rng = random.Random(seed)
+    remaining = limit
+    last_id = 0
+    while remaining is None or remaining > 0:
+        # شناسه‌ها سبک‌اند؛ نمونه‌گیری پیش از خواندن اقلام انجام می‌شود
+        ids = list(
+            Cart.objects.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:chunk_size]
+        )
+        if not ids:
+            return
+        last_id = ids[-1]
+        if sample_rate < 1:
+            ids = [cart_id for cart_id in ids if rng.random() < sample_rate]
+        if remaining is not None:
+            ids = ids[:remaining]
+        if not ids:
+            continue
+
+        carts = {}
+        rows = (
+            CartItem.objects.filter(cart_id__in=ids)
+            .order_by('cart_id', 'id')
+            .values_list('cart_id', 'product_id', 'quantity')
+        )
+        for cart_id, product_id, quantity in rows:
+            carts.setdefault(cart_id, []).append(CartLine(product_id, quantity))
+        if remaining is not None:
+            remaining -= len(ids)
+        if not carts:
+            continue
+
+        lines = list(carts.values())
+        products = PricingService.load_product_records(
+            line.product_id for cart_lines in lines for line in cart_lines
+        )
+        yield lines, products
+
+
+class RuleTrace:
+    """آمار ارزیابی یک قانون در طول شبیه‌سازی"""
+    __slots__ = ('rule', 'evaluations', 'hits', 'discount', 'seconds')
+
+    def __init__(self, rule: CompiledRule):
+        self.rule = rule
+        self.evaluations = 0
+        self.hits = 0
+        self.discount = ZERO
+        self.seconds = 0.0
+
+    def as_dict(self, carts: int) -> Dict[str, Any]:
+        rule = self.rule
+        return {
+            'id': rule.id,
+            'name': rule.name,
+            'rule_type': rule.rule_type,
+            'condition_type': rule.condition_type,
+            'draft': rule.id is None,
+            'evaluations': self.evaluations,
+            'hits': self.hits,
+            'hit_rate': self.hits / carts if carts else 0.0,
+            'total_discount': str(self.discount),
+            'avg_evaluation_us': self.seconds / self.evaluations * 1e6 if self.evaluations else 0.0,
+        }
+
+
+class RuleSimulator:
+    """
+    اجرای سبدها روی یک مجموعه قوانین با اندازه‌گیری هر قانون
+
+    فقط قوانینی که برای یک سبد نامزد هستند (rule_set.candidates) ارزیابی
+    می‌شوند، پس evaluations هر قانون هزینه واقعی آن را در سرویس نشان می‌دهد.
+    """
+
+    def __init__(self, rule_set: CompiledRuleSet, skipped: Sequence[str] = ()):
+        self.rule_set = rule_set
+        self.skipped = list(skipped)
+        self.traces = {rule: RuleTrace(rule) for rule in rule_set.rules}
+        self.carts = 0
+        self.lines = 0
+        self.base_total = ZERO
+        self.final_total = ZERO
+        self.seconds = 0.0
+
+    def _apply(self, rule: CompiledRule, cart, current_total: Decimal, products: Dict) -> Decimal:
+        started = time.perf_counter()
+        discount_amount = apply_rule(rule, cart, current_total, products)
+        trace = self.traces[rule]
+        trace.seconds += time.perf_counter() - started
+        trace.evaluations += 1
+        if discount_amount > 0:
+            trace.hits += 1
+            trace.discount += discount_amount
+        return discount_amount
+
+    def price(self, carts: Iterable[Sequence[CartLine]], products: Dict) -> None:
+        """قیمت‌گذاری یک دسته سبد و افزودن نتیجه به آمار"""
+        started = time.perf_counter()
+        with localcontext(PRICING_CONTEXT):
+            for lines in carts:
+                result = price_cart(lines, products, self.rule_set, self._apply)
+                self.carts += 1
+                self.lines += len(result['items'])
+                self.base_total += result['base_total']
+                self.final_total += result['final_total']
+        self.seconds += time.perf_counter() - started
+
+    def run(self, chunks: Iterable[Tuple[List[List[CartLine]], Dict]]) -> Iterator[Dict[str, Any]]:
+        """قیمت‌گذاری دسته‌ها و بازگرداندن پیشرفت پس از هر دسته"""
+        for carts, products in chunks:
+            self.price(carts, products)
+            yield self.progress()
+
+    def progress(self) -> Dict[str, Any]:
+        # زمان قیمت‌گذاری، بدون خواندن سبدها و محصولات از پایگاه داده
+        return {'carts': self.carts, 'lines': self.lines, 'pricing_seconds': self.seconds}
+
+    def report(self) -> Dict[str, Any]:
+        """گزارش نهایی با مبالغ رشته‌ای دقیق، قوانین به ترتیب ارزیابی"""
+        return {
+            **self.progress(),
+            'base_total': str(self.base_total),
+            'final_total': str(self.final_total),
+            'total_discount': str(self.base_total - self.final_total),
+            'skipped_rules': self.skipped,
+            'rules': [self.traces[rule].as_dict(self.carts) for rule in self.rule_set.rules],
+        }
+
+
+def stream_simulation(simulator: RuleSimulator, chunks: Iterable) -> Iterator[str]:
+    """
+    اجرای شبیه‌سازی به صورت NDJSON: یک سطر progress پس از هر دسته و
+    سطر report در پایان
+    """
+    for progress in simulator.run(chunks):
+        yield json.dumps({'progress': progress}) + '\n'
+    yield json.dumps({'report': simulator.report()}) + '\n'
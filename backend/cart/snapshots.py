@@ -0,0 +1,229 @@
+"""
+تصویر قیمت‌گذاری‌شده سبد خرید در کش
+
+هر Cart یک تصویر شامل اقلام، جمع پایه، قوانین اعمال‌شده و قیمت نهایی
+در کش دارد تا خواندن سبد فقط یک دسترسی به کش باشد. تغییر قوانین یا
+محصولات، از طریق نسخه‌های ذخیره‌شده در تصویر، آن را باطل می‌کند.
+
+هر تغییر اقلام پس از commit نسل سبد (SNAPSHOT_GENERATION_KEY) را یک واحد
+افزایش می‌دهد و تصویر فقط با نسل فعلی تازه است:
+
+- تصویری که از پایگاه داده ساخته می‌شود با نسلی ذخیره می‌شود که پیش از
+  خواندن اقلام گرفته شده؛ تغییری که در این فاصله commit شود آن را کهنه می‌کند؛
+- وصله افزایشی فقط روی تصویر نسل قبلی اعمال می‌شود و ردیف تغییرکرده را
+  درون قفل دوباره از پایگاه داده می‌خواند، پس ترتیب اجرای callbackها با
+  ترتیب commit تراکنش‌ها اهمیتی ندارد.
+"""
+from collections import namedtuple
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from django.core.cache import cache
+from django.http import Http404
+from django.shortcuts import get_object_or_404
+
+from .engine import CompiledRuleSet, ProductRecord
+from .instrumentation import record_cache, serialize_timer
+from .models import Cart, CartItem
+from .rule_cache import aget_active_rule_set, get_active_rule_set
+from .serializers import CartItemSerializer, CartSerializer
+from .services import PricingService
+from .versions import CATALOG_VERSION_KEY, RULES_VERSION_KEY, aget_versions, get_version, get_versions
+
+SNAPSHOT_KEY = 'cart:snapshot:{cart_id}'
+SNAPSHOT_LOCK_KEY = 'cart:snapshot:{cart_id}:lock'
+# تغییر اقلام هر سبد
+SNAPSHOT_GENERATION_KEY = 'cart:snapshot:{cart_id}:generation'
+SNAPSHOT_TIMEOUT = 24 * 60 * 60
+SNAPSHOT_LOCK_TIMEOUT = 5
+
+_SnapshotLine = namedtuple('_SnapshotLine', ['product', 'quantity'])
+
+
+def _version_keys(cart_id: int) -> List[str]:
+    return [RULES_VERSION_KEY, CATALOG_VERSION_KEY, SNAPSHOT_GENERATION_KEY.format(cart_id=cart_id)]
+
+
+def _current_versions(cart_id: int) -> Dict[str, int]:
+    return get_versions(*_version_keys(cart_id))
+
+
+def bump_cart_generation(cart_id: int) -> int:
+    """کهنه کردن تصویر فعلی سبد پس از تغییر اقلام؛ نسل تازه را بازمی‌گرداند"""
+    key = SNAPSHOT_GENERATION_KEY.format(cart_id=cart_id)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        get_version(key)
+        return cache.incr(key)
+
+
+def _is_fresh(snapshot: Optional[Dict[str, Any]], versions: Dict[str, int]) -> bool:
+    return snapshot is not None and snapshot['versions'] == versions
+
+
+def _price(data: Dict[str, Any], rule_set: CompiledRuleSet) -> Dict[str, Any]:
+    """محاسبه جمع و قیمت نهایی از روی اقلام سریال‌شده تصویر"""
+    lines = [
+        _SnapshotLine(
+            ProductRecord(item['product'], item['product_name'], Decimal(item['product_price'])),
+            item['quantity'],
+        )
+        for item in data['items']
+    ]
+    result = PricingService.calculate_cart(lines, rule_set)
+
+    data['items_count'] = len(lines)
+    data['total_price'] = sum(line.product.price * line.quantity for line in lines)
+    data['pricing'] = {
+        'base_total': result['base_total'],
+        'final_total': result['final_total'],
+        'total_discount': result['total_discount'],
+        'applied_rules': result['applied_rules'],
+    }
+    return data
+
+
+def _store(cart_id: int, data: Dict[str, Any], versions: Dict[str, int]) -> None:
+    cache.set(
+        SNAPSHOT_KEY.format(cart_id=cart_id),
+        {'versions': versions, 'data': data},
+        SNAPSHOT_TIMEOUT,
+    )
+
+
+def _snapshot_data(cart: Cart, rule_set: CompiledRuleSet) -> Dict[str, Any]:
+    """داده تصویر از روی cart با اقلام از پیش بارگذاری‌شده"""
+    with serialize_timer():
+        data = dict(CartSerializer(cart).data)
+        data['items'] = [dict(item) for item in data['items']]
+    return _price(data, rule_set)
+
+
+def _empty_data(session_key: Optional[str]) -> Dict[str, Any]:
+    return {
+        'id': None,
+        'session_key': session_key or '',
+        'items': [],
+        'created_at': None,
+        'updated_at': None,
+    }
+
+
+def empty_cart_snapshot(session_key: Optional[str] = None) -> Dict[str, Any]:
+    """
+    تصویر سبدی که هنوز ساخته نشده است، بدون کوئری و بدون ذخیره در کش
+
+    ردیف سبد فقط با افزودن اولین کالا ساخته می‌شود.
+    """
+    return _price(_empty_data(session_key), get_active_rule_set())
+
+
+async def aempty_cart_snapshot(session_key: Optional[str] = None) -> Dict[str, Any]:
+    """نسخه async از empty_cart_snapshot"""
+    return _price(_empty_data(session_key), await aget_active_rule_set())
+
+
+def build_cart_snapshot(cart: Cart, versions: Optional[Dict[str, int]] = None) -> Dict[str, Any]:
+    """
+    ساخت و ذخیره تصویر یک سبد
+
+    نسخه‌ها باید پیش از بارگذاری cart خوانده شوند تا تغییری که در این
+    فاصله رخ می‌دهد تصویر را باطل کند.
+    """
+    if versions is None:
+        versions = _current_versions(cart.id)
+    data = _snapshot_data(cart, get_active_rule_set(versions[RULES_VERSION_KEY]))
+    _store(cart.id, data, versions)
+    return data
+
+
+def get_cart_snapshot(cart_id: int) -> Dict[str, Any]:
+    """تصویر سبد؛ در صورت نبود یا کهنه بودن از پایگاه داده ساخته می‌شود"""
+    key = SNAPSHOT_KEY.format(cart_id=cart_id)
+    version_keys = _version_keys(cart_id)
+    cached = cache.get_many([key, *version_keys])
+    snapshot = cached.pop(key, None)
+    versions = cached if len(cached) == len(version_keys) else _current_versions(cart_id)
+
+    if _is_fresh(snapshot, versions):
+        record_cache('cart_snapshot', 'hit')
+        return snapshot['data']
+
+    record_cache('cart_snapshot', 'miss')
+    cart = get_object_or_404(Cart.objects.with_items(), id=cart_id)
+    return build_cart_snapshot(cart, versions)
+
+
+async def aget_cart_snapshot(cart_id: int) -> Dict[str, Any]:
+    """نسخه async از get_cart_snapshot"""
+    key = SNAPSHOT_KEY.format(cart_id=cart_id)
+    version_keys = _version_keys(cart_id)
+    cached = await cache.aget_many([key, *version_keys])
+    snapshot = cached.pop(key, None)
+    versions = cached if len(cached) == len(version_keys) else await aget_versions(*version_keys)
+
+    if _is_fresh(snapshot, versions):
+        record_cache('cart_snapshot', 'hit')
+        return snapshot['data']
+
+    record_cache('cart_snapshot', 'miss')
+
+    try:
+        cart = await Cart.objects.with_items().aget(id=cart_id)
+    except Cart.DoesNotExist:
+        raise Http404("No Cart matches the given query.")
+    data = _snapshot_data(cart, await aget_active_rule_set(versions[RULES_VERSION_KEY]))
+    await cache.aset(key, {'versions': versions, 'data': data}, SNAPSHOT_TIMEOUT)
+    return data
+
+
+def refresh_snapshot_line(cart_id: int, item_id: int) -> None:
+    """
+    هماهنگ کردن یک ردیف تصویر با پایگاه داده پس از commit تغییر آن
+
+    نسل سبد افزایش می‌یابد؛ تصویر فقط اگر نسل قبلی را داشته باشد وصله و با
+    نسل تازه ذخیره می‌شود. اگر قفل در دسترس نباشد یا تصویر کهنه باشد، تصویر
+    حذف می‌شود تا در خواندن بعدی از پایگاه داده ساخته شود.
+    """
+    generation = bump_cart_generation(cart_id)
+    key = SNAPSHOT_KEY.format(cart_id=cart_id)
+    lock_key = SNAPSHOT_LOCK_KEY.format(cart_id=cart_id)
+    if not cache.add(lock_key, 1, SNAPSHOT_LOCK_TIMEOUT):
+        cache.delete(key)
+        return
+
+    try:
+        snapshot = cache.get(key)
+        if snapshot is None:
+            return
+        generation_key = SNAPSHOT_GENERATION_KEY.format(cart_id=cart_id)
+        versions = {**_current_versions(cart_id), generation_key: generation}
+        expected = {**versions, generation_key: generation - 1}
+        if snapshot['versions'] != expected:
+            cache.delete(key)
+            return
+
+        # ردیف پس از گرفتن قفل خوانده می‌شود: آخرین وضعیت commitشده، هر
+        # ترتیبی که callbackها اجرا شوند
+        item = CartItem.objects.select_related('product').filter(id=item_id, cart_id=cart_id).first()
+        data = snapshot['data']
+        items = data['items']
+        index = next((index for index, line in enumerate(items) if line['id'] == item_id), None)
+        if item is None:
+            if index is not None:
+                del items[index]
+        elif index is None:
+            items.append(dict(CartItemSerializer(item).data))
+        else:
+            items[index] = dict(CartItemSerializer(item).data)
+        _price(data, get_active_rule_set(versions[RULES_VERSION_KEY]))
+        _store(cart_id, data, versions)
+    finally:
+        cache.delete(lock_key)
+
+
+def invalidate_cart_snapshot(cart_id: int) -> None:
+    """کهنه کردن و حذف تصویر، برای تغییر چند ردیف یا حذف سبد"""
+    bump_cart_generation(cart_id)
+    cache.delete(SNAPSHOT_KEY.format(cart_id=cart_id))
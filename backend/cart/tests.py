@@ -1,3 +1,1756 @@
-from django.test import TestCase
+import json
+import os
+import pickle
+import random
+import subprocess
+import sys
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, connections, router, transaction
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase
+
+from . import async_views, snapshots, warmup
+from .catalog_io import import_products
+from .db_router import CATALOG_PIN_KEY, PIN_COOKIE
+from .engine import (
+    AppliedRule, CartIndex, CartLine, CompiledRuleSet, LineItem, ProductRecord, RuleRecord, price_cart, price_carts,
+    price_carts_parallel,
+)
+from .instrumentation import registry
+from .models import Cart, CartItem, Product, PricingRule
+from .promotions import clear_local_promotions
+from .quote_cache import LocalLRU, quote_cache
+from .rule_cache import get_active_rule_set
+from .serializers import CartItemInputSerializer, parse_cart_items
+from .services import CartService, PricingService, format_amounts
+from .versions import CATALOG_VERSION_KEY, RULES_VERSION_KEY, get_catalog_version, get_versions
+from .warmup import hot_product_ids, warm_up
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class PricingServiceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            Product.objects.create(name=f"Product {i}", price=Decimal('10.00') + i)
+            for i in range(60)
+        ]
+        PricingRule.objects.create(
+            name="10% over 100",
+            rule_type='percentage_discount',
+            condition_type='min_total',
+            condition_value={'min_amount': 100},
+            discount_value={'percentage': 10},
+            priority=1,
+        )
+        PricingRule.objects.create(
+            name="Buy 2 get 1",
+            rule_type='buy_x_get_y',
+            condition_type='product_based',
+            condition_value={'product_id': cls.products[0].id, 'buy_quantity': 2, 'get_free_quantity': 1},
+            discount_value={},
+            priority=2,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_calculate_cart_total(self):
+        result = PricingService.calculate_cart_total([
+            {'product_id': self.products[0].id, 'quantity': 4},
+            {'product_id': self.products[1].id, 'quantity': 10},
+        ])
+
+        self.assertEqual(result['base_total'], 150.0)
+        self.assertEqual(result['final_total'], 117.0)
+        self.assertEqual(result['total_discount'], 33.0)
+        self.assertEqual(
+            [rule['rule_name'] for rule in result['applied_rules']],
+            ["Buy 2 get 1", "10% over 100"],
+        )
+
+    def test_unknown_products_are_skipped(self):
+        result = PricingService.calculate_cart_total([
+            {'product_id': self.products[0].id, 'quantity': 1},
+            {'product_id': 999999, 'quantity': 3},
+        ])
+
+        self.assertEqual([item['product_id'] for item in result['items']], [self.products[0].id])
+        self.assertEqual(result['base_total'], 10.0)
+
+    def test_query_count_does_not_grow_with_cart_size(self):
+        get_active_rule_set()
+        for size in (1, 10, 60):
+            cart_data = [{'product_id': product.id, 'quantity': 3} for product in self.products[:size]]
+            with self.assertNumQueries(1):
+                result = PricingService.calculate_cart_total(cart_data)
+            self.assertEqual(len(result['items']), size)
+
+    def test_products_are_loaded_without_unused_columns(self):
+        get_active_rule_set()
+        cart_data = [{'product_id': product.id, 'quantity': 1} for product in self.products[:3]]
+        with CaptureQueriesContext(connection) as queries:
+            PricingService.calculate_cart_total(cart_data)
+
+        product_sql = [query['sql'] for query in queries if 'cart_product' in query['sql']]
+        self.assertEqual(len(product_sql), 1)
+        self.assertNotIn('description', product_sql[0])
+        self.assertNotIn('updated_at', product_sql[0])
+
+
+class RuleCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name="Widget", price=Decimal('50.00'))
+        self.rule = PricingRule.objects.create(
+            name="5 off",
+            rule_type='fixed_discount',
+            condition_type='min_total',
+            condition_value={'min_amount': 10},
+            discount_value={'amount': 5},
+        )
+
+    def test_rule_set_is_reused_until_version_changes(self):
+        rule_set = get_active_rule_set()
+        with self.assertNumQueries(0):
+            self.assertIs(get_active_rule_set(), rule_set)
+
+    def test_saving_a_rule_rebuilds_the_rule_set(self):
+        cart = [{'product_id': self.product.id, 'quantity': 1}]
+        self.assertEqual(PricingService.calculate_cart_total(cart)['final_total'], 45.0)
+
+        version = cache.get(RULES_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rule.discount_value = {'amount': 7}
+            self.rule.save()
+        self.assertEqual(cache.get(RULES_VERSION_KEY), version + 1)
+        self.assertEqual(PricingService.calculate_cart_total(cart)['final_total'], 43.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rule.delete()
+        self.assertEqual(PricingService.calculate_cart_total(cart)['final_total'], 50.0)
+
+    def test_compiled_rule_set_survives_pickling(self):
+        rule_set = pickle.loads(pickle.dumps(get_active_rule_set()))
+        rule = rule_set.rules[0]
+
+        self.assertEqual(rule.id, self.rule.id)
+        self.assertEqual(rule.apply(CartIndex([]), Decimal('3'), {}), Decimal('3'))
+
+
+class RuleAnalysisTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.products = [Product.objects.create(name=f"Product {i}", price=Decimal('20.00')) for i in range(3)]
+
+    def create_rule(self, name, rule_type, condition_type, condition_value, discount_value, priority=0):
+        return PricingRule.objects.create(
+            name=name, rule_type=rule_type, condition_type=condition_type,
+            condition_value=condition_value, discount_value=discount_value, priority=priority,
+        )
+
+    def live_rule_names(self):
+        return [rule.name for rule in get_active_rule_set().rules]
+
+    def test_clean_validates_values_against_rule_type_schema(self):
+        rule = PricingRule(
+            name="Broken bundle", rule_type='bundle_discount', condition_type='min_total',
+            condition_value={'products': [], 'min_amount': 'ten'}, discount_value={'type': 'half'},
+        )
+        with self.assertRaises(DjangoValidationError) as ctx:
+            rule.full_clean()
+
+        errors = ctx.exception.message_dict
+        self.assertIn("'products' must be a non-empty list of product ids", errors['condition_value'])
+        self.assertIn("'min_amount' must be a number", errors['condition_value'])
+        self.assertIn("'value' is required", errors['discount_value'])
+
+        PricingRule(
+            name="Valid", rule_type='buy_x_get_y', condition_type='product_based',
+            condition_value={'product_id': 1, 'buy_quantity': 2, 'get_free_quantity': 1}, discount_value={},
+        ).full_clean()
+
+    def test_unreachable_rules_are_left_out_of_the_live_set(self):
+        self.create_rule("Missing product", 'buy_x_get_y', 'product_based',
+                         {'product_id': 999999, 'buy_quantity': 1, 'get_free_quantity': 1}, {})
+        self.create_rule("Half missing bundle", 'bundle_discount', 'min_total',
+                         {'products': [self.products[0].id, 999999]}, {'type': 'fixed', 'value': 5})
+        self.create_rule("Nothing off", 'fixed_discount', 'min_total', {'min_amount': 0}, {'amount': 0})
+        self.create_rule("Huge order", 'percentage_discount', 'min_total', {'min_amount': 50000}, {'percentage': 5})
+        self.create_rule("Bundle", 'bundle_discount', 'min_total',
+                         {'products': [self.products[0].id, self.products[1].id]}, {'type': 'fixed', 'value': 5})
+
+        self.assertEqual(self.live_rule_names(), ["Huge order", "Bundle"])
+        with override_settings(PRICING_MAX_CART_TOTAL='10000'):
+            cache.clear()
+            self.assertEqual(self.live_rule_names(), ["Bundle"])
+
+    def test_creating_or_deleting_a_product_rebuilds_the_rule_set(self):
+        product = self.products[2]
+        product_id = product.id
+        self.create_rule("Buy 1 get 1", 'buy_x_get_y', 'product_based',
+                         {'product_id': product_id, 'buy_quantity': 1, 'get_free_quantity': 1}, {})
+        self.assertEqual(self.live_rule_names(), ["Buy 1 get 1"])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        self.assertEqual(self.live_rule_names(), [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(id=product_id, name="Restocked", price=Decimal('5.00'))
+        self.assertEqual(self.live_rule_names(), ["Buy 1 get 1"])
+
+    def test_rules_after_a_zero_total_are_skipped_only_when_bounded(self):
+        self.create_rule("All off", 'fixed_discount', 'min_total', {'min_amount': 0}, {'amount': 1000}, 9)
+        self.create_rule("Free gift", 'buy_x_get_y', 'product_based',
+                         {'product_id': self.products[0].id, 'buy_quantity': 1, 'get_free_quantity': 1}, {}, 5)
+        self.create_rule("10% off", 'percentage_discount', 'min_total', {'min_amount': 0}, {'percentage': 10}, 1)
+
+        self.assertEqual([rule.stops_at_zero for rule in get_active_rule_set().rules], [False, True, True])
+        # The gift still applies after the total reaches zero; nothing after it can
+        result = PricingService.calculate_cart_total([{'product_id': self.products[0].id, 'quantity': 1}])
+        self.assertEqual(result['final_total'], -20.0)
+        self.assertEqual([rule['rule_name'] for rule in result['applied_rules']], ["All off", "Free gift"])
+
+    def test_report_lists_dropped_rules_with_reasons(self):
+        missing = self.create_rule("Missing product", 'percentage_discount', 'product_based',
+                                   {'product_id': 999999}, {'percentage': 150})
+        self.create_rule("5 off", 'fixed_discount', 'min_total', {'min_amount': 10}, {'amount': 5})
+
+        response = self.client.get(reverse('pricing-rule-report'))
+
+        self.assertEqual(response.status_code, 200)
+        report = response.json()
+        self.assertEqual((report['active'], report['live'], report['dropped'], report['invalid']), (2, 1, 1, 1))
+        entry = next(rule for rule in report['rules'] if rule['id'] == missing.id)
+        self.assertFalse(entry['live'])
+        self.assertEqual(entry['unreachable'], ["condition product 999999 does not exist"])
+        self.assertEqual(entry['schema_errors'], {'discount_value': ["'percentage' must be at most 100"]})
+
+    def test_rules_saved_without_validation_are_dropped(self):
+        product = self.products[0]
+        broken = self.create_rule("Buy 0 get 1", 'buy_x_get_y', 'product_based',
+                                  {'product_id': product.id, 'buy_quantity': 0, 'get_free_quantity': 1}, {})
+        self.create_rule("5 off", 'fixed_discount', 'min_total', {'min_amount': 0}, {'amount': 5})
+
+        self.assertEqual(self.live_rule_names(), ["5 off"])
+        result = PricingService.calculate_cart_total([{'product_id': product.id, 'quantity': 2}])
+        self.assertEqual(result['final_total'], 35.0)
+
+        report = self.client.get(reverse('pricing-rule-report')).json()
+        entry = next(rule for rule in report['rules'] if rule['id'] == broken.id)
+        self.assertFalse(entry['live'])
+        self.assertEqual(entry['schema_errors'], {'condition_value': ["'buy_quantity' must be at least 1"]})
+        self.assertEqual(report['dropped'], 1)
+
+
+class RuleIndexTests(SimpleTestCase):
+    def setUp(self):
+        rules = [
+            PricingRule(id=1, name="global", rule_type='percentage_discount', condition_type='min_total',
+                        condition_value={'min_amount': 0}, discount_value={'percentage': 5}),
+            PricingRule(id=2, name="product 7", rule_type='fixed_discount', condition_type='product_based',
+                        condition_value={'product_id': 7}, discount_value={'amount': 1}),
+            PricingRule(id=3, name="b2g1 8", rule_type='buy_x_get_y', condition_type='min_quantity',
+                        condition_value={'product_id': 8, 'buy_quantity': 2}, discount_value={}),
+            PricingRule(id=4, name="bundle 8+9", rule_type='bundle_discount', condition_type='min_total',
+                        condition_value={'products': [8, 9]}, discount_value={'value': 10}),
+            PricingRule(id=5, name="empty bundle", rule_type='bundle_discount', condition_type='min_total',
+                        condition_value={'products': []}, discount_value={'value': 10}),
+            PricingRule(id=6, name="unknown", rule_type='mystery', condition_type='min_total',
+                        condition_value={}, discount_value={}),
+        ]
+        self.rule_set = CompiledRuleSet.compile(rules)
+
+    def candidate_ids(self, *product_ids):
+        cart = CartIndex([LineItem(product_id, "Product", 1, Decimal('1'), Decimal('1')) for product_id in product_ids])
+        return [rule.id for rule in self.rule_set.candidates(cart)]
+
+    def test_only_global_rules_for_unrelated_products(self):
+        self.assertEqual(len(self.rule_set), 5)
+        self.assertEqual(self.candidate_ids(), [1])
+        self.assertEqual(self.candidate_ids(99), [1])
+
+    def test_product_rules_are_merged_in_evaluation_order(self):
+        self.assertEqual(self.candidate_ids(8, 7), [1, 2, 3, 4])
+        self.assertEqual(self.candidate_ids(9), [1])
+
+    def test_duplicate_lines_match_first_line_and_best_quantity(self):
+        cart = CartIndex([
+            LineItem(7, "Product", 1, Decimal('1'), Decimal('1')),
+            LineItem(7, "Product", 3, Decimal('1'), Decimal('3')),
+        ])
+
+        self.assertIs(cart.lines[7], cart.items[0])
+        self.assertEqual(cart.max_quantity[7], 3)
+        self.assertEqual(cart.total_quantity, 4)
+
+
+class OfflineEngineTests(SimpleTestCase):
+    def setUp(self):
+        self.products = {
+            1: ProductRecord(1, "Widget", Decimal('10.00')),
+            2: ProductRecord(2, "Gadget", Decimal('24.99')),
+        }
+        self.rule_set = CompiledRuleSet.compile([
+            RuleRecord(1, "Buy 2 get 1", 'buy_x_get_y', 'product_based',
+                       {'product_id': 1, 'buy_quantity': 2, 'get_free_quantity': 1}, {}),
+            RuleRecord(2, "7% over 40", 'percentage_discount', 'min_total', {'min_amount': 40}, {'percentage': 7}),
+        ])
+        self.carts = [
+            [CartLine(1, quantity), CartLine(2, quantity % 3 + 1)] for quantity in range(1, 40)
+        ]
+
+    def test_engine_does_not_import_django(self):
+        code = "import sys, cart.engine; sys.exit(any(name.startswith('django') for name in sys.modules))"
+        completed = subprocess.run([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(__file__)))
+        self.assertEqual(completed.returncode, 0)
+
+    def test_prices_plain_records(self):
+        result = price_cart([CartLine(1, 4), CartLine(3, 1)], self.products, self.rule_set)
+
+        self.assertEqual(result['base_total'], Decimal('40.00'))
+        self.assertEqual([rule.rule_name for rule in result['applied_rules']], ["Buy 2 get 1"])
+        self.assertEqual(result['final_total'], Decimal('20.00'))
+
+    def test_line_items_are_compact_records(self):
+        result = price_cart([CartLine(1, 4), CartLine(2, 1)], self.products, self.rule_set)
+
+        item = result['items'][0]
+        self.assertIsInstance(item, LineItem)
+        self.assertFalse(hasattr(item, '__dict__'))
+        self.assertEqual(result['applied_rules'][0], AppliedRule("Buy 2 get 1", 'buy_x_get_y', Decimal('20.00')))
+        self.assertEqual(pickle.loads(pickle.dumps(result))['items'], result['items'])
+        self.assertEqual(format_amounts(result)['items'][0], {
+            'product_id': 1, 'product_name': "Widget", 'quantity': 4, 'unit_price': 10.0, 'total_price': 40.0,
+        })
+
+        # Records loaded separately share one string per product name
+        name = "".join(["Wid", "get"])
+        self.assertIs(ProductRecord(1, name, Decimal('10.00')).name, self.products[1].name)
+
+    def test_parallel_pricing_matches_serial(self):
+        expected = [price_cart(lines, self.products, self.rule_set) for lines in self.carts]
+
+        self.assertEqual(price_carts_parallel(self.carts, self.products, self.rule_set, 2, chunksize=8), expected)
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_backend_falls_back_for_unsupported_prices(self):
+        from .vectorized import price_carts_vectorized, supports
+
+        products = {**self.products, 3: ProductRecord(3, "Gram", Decimal('0.125'))}
+        carts = self.carts + [[CartLine(3, 8), CartLine(1, 3)]]
+
+        self.assertTrue(supports(self.rule_set, self.products))
+        self.assertFalse(supports(self.rule_set, products))
+        self.assertEqual(
+            price_carts_vectorized(carts, products, self.rule_set),
+            [price_cart(lines, products, self.rule_set) for lines in carts],
+        )
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_backend_without_items(self):
+        from .vectorized import price_carts_vectorized
+
+        results = price_carts_vectorized(self.carts, self.products, self.rule_set, include_items=False)
+
+        for result, lines in zip(results, self.carts):
+            expected = price_cart(lines, self.products, self.rule_set)
+            del expected['items']
+            self.assertEqual(result, expected)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            price_carts(self.carts, self.products, self.rule_set, backend='gpu')
+
+
+class CalculateCartBatchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [
+            Product.objects.create(name=f"Product {i}", price=Decimal('4.99') * (i + 1))
+            for i in range(5)
+        ]
+        PricingRule.objects.create(
+            name="Bundle 0+1",
+            rule_type='bundle_discount',
+            condition_type='min_total',
+            condition_value={'products': [cls.products[0].id, cls.products[1].id]},
+            discount_value={'type': 'percentage', 'value': 15},
+            priority=3,
+        )
+        PricingRule.objects.create(
+            name="3 for 2",
+            rule_type='buy_x_get_y',
+            condition_type='product_based',
+            condition_value={'product_id': cls.products[2].id, 'buy_quantity': 3, 'get_free_quantity': 1},
+            discount_value={},
+            priority=2,
+        )
+        PricingRule.objects.create(
+            name="Bulk order",
+            rule_type='percentage_discount',
+            condition_type='min_quantity',
+            condition_value={'min_quantity': 5},
+            discount_value={'percentage': 12.5},
+            priority=1,
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_batch_matches_single_calculations(self):
+        carts = [
+            [{'product_id': self.products[0].id, 'quantity': 1}, {'product_id': self.products[1].id, 'quantity': 2}],
+            [{'product_id': self.products[2].id, 'quantity': 7}],
+            [{'product_id': product.id, 'quantity': 2} for product in self.products],
+            [],
+        ]
+
+        response = self.client.post(reverse('calculate-cart-batch'), carts, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        for cart_data, result in zip(carts, response.json()):
+            single = self.client.post(reverse('calculate-cart'), cart_data, format='json')
+            self.assertEqual(result, single.json())
+
+    def test_parallel_calculation_matches_batch(self):
+        carts = [
+            [{'product_id': product.id, 'quantity': quantity} for product in self.products]
+            for quantity in range(1, 12)
+        ]
+
+        self.assertEqual(
+            PricingService.calculate_many_parallel(carts, amount_format='string', max_workers=2),
+            PricingService.calculate_many(carts, 'string'),
+        )
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_backend_matches_batch(self):
+        carts = [
+            [{'product_id': product.id, 'quantity': quantity} for product in self.products]
+            for quantity in range(1, 12)
+        ]
+
+        self.assertEqual(
+            PricingService.calculate_many(carts, 'string', backend='numpy'),
+            PricingService.calculate_many(carts, 'string'),
+        )
+
+    def test_invalid_carts_report_errors_in_place(self):
+        carts = [
+            [{'product_id': self.products[0].id, 'quantity': 1}],
+            [{'product_id': self.products[0].id, 'quantity': 0}],
+            [{'product_id': self.products[1].id, 'quantity': 1}],
+        ]
+
+        response = self.client.post(reverse('calculate-cart-batch'), carts, format='json')
+
+        results = response.json()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(results[0]['base_total'], 4.99)
+        single = self.client.post(reverse('calculate-cart'), carts[1], format='json')
+        self.assertEqual(results[1], {'errors': single.json()})
+        self.assertEqual(results[2]['base_total'], 9.98)
+
+    def test_string_amounts_are_exact(self):
+        cart_data = [{'product_id': self.products[0].id, 'quantity': 3}]
+
+        response = self.client.post(reverse('calculate-cart') + '?amounts=string', cart_data, format='json')
+        self.assertEqual(response.json()['base_total'], '14.97')
+        self.assertEqual(response.json()['items'][0]['unit_price'], '4.99')
+
+        response = self.client.post(reverse('calculate-cart') + '?amounts=cents', cart_data, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_products_and_rules_are_loaded_once(self):
+        carts = [[{'product_id': product.id, 'quantity': 1}] for product in self.products] * 20
+        get_active_rule_set()
+
+        with self.assertNumQueries(1):
+            results = PricingService.calculate_many(carts)
+
+        self.assertEqual(len(results), 100)
+
+
+def reference_calculate(cart_data, products, rules):
+    """Straightforward linear-scan pricing used as the oracle for the engine"""
+    base_total = Decimal('0')
+    items = []
+    for item in cart_data:
+        product = products.get(item['product_id'])
+        if product is None:
+            continue
+        item_total = product.price * item['quantity']
+        base_total += item_total
+        items.append({'product_id': product.id, 'quantity': item['quantity'], 'total_price': item_total})
+
+    final_total = base_total
+    applied = []
+    for rule in rules:
+        discount = reference_discount(rule, items, final_total, products)
+        if discount > 0:
+            final_total -= discount
+            applied.append((rule.name, discount))
+    return base_total, final_total, applied
+
+
+def reference_discount(rule, items, current_total, products):
+    condition = rule.condition_value
+    discount = rule.discount_value
+
+    if rule.condition_type == 'min_total':
+        matched = current_total >= Decimal(str(condition.get('min_amount', 0)))
+    elif rule.condition_type == 'min_quantity':
+        matched = sum(item['quantity'] for item in items) >= condition.get('min_quantity', 0)
+    else:
+        matched = any(
+            item['product_id'] == condition.get('product_id') and item['quantity'] >= condition.get('min_quantity', 1)
+            for item in items
+        )
+    if not matched:
+        return Decimal('0')
+
+    if rule.rule_type == 'percentage_discount':
+        return current_total * (Decimal(str(discount.get('percentage', 0))) / 100)
+    if rule.rule_type == 'fixed_discount':
+        return min(Decimal(str(discount.get('amount', 0))), current_total)
+    if rule.rule_type == 'buy_x_get_y':
+        for item in items:
+            if item['product_id'] == condition.get('product_id'):
+                free_units = (item['quantity'] // condition.get('buy_quantity', 1)) * condition.get('get_free_quantity', 1)
+                return free_units * products[item['product_id']].price
+        return Decimal('0')
+
+    bundle_items = []
+    for product_id in condition.get('products', []):
+        matches = [item for item in items if item['product_id'] == product_id and item['quantity'] >= 1]
+        if not matches:
+            return Decimal('0')
+        bundle_items.append(matches[0])
+    if not bundle_items:
+        return Decimal('0')
+    value = Decimal(str(discount.get('value', 0)))
+    if discount.get('type', 'percentage') == 'percentage':
+        return sum(item['total_price'] for item in bundle_items) * (value / 100)
+    return value
+
+
+class PricingPropertyTests(TestCase):
+    """Random catalogs, rule sets and carts priced by the engine and by the reference"""
+    iterations = 300
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(5)
+        for i in range(12):
+            Product.objects.create(name=f"Product {i}", price=Decimal(rng.randint(1, 99999)) / 100)
+
+    def setUp(self):
+        self.products = Product.objects.in_bulk()
+        self.product_ids = list(self.products) + [999999]
+
+    def random_rule(self, rng, rule_id):
+        product_id = rng.choice(self.product_ids)
+        return PricingRule(
+            id=rule_id,
+            name=f"Rule {rule_id}",
+            rule_type=rng.choice([choice for choice, _ in PricingRule.RULE_TYPES]),
+            condition_type=rng.choice([choice for choice, _ in PricingRule.CONDITION_TYPES]),
+            condition_value={
+                'min_amount': rng.choice([0, rng.randint(1, 800), round(rng.uniform(1, 800), 2)]),
+                'min_quantity': rng.randint(1, 12),
+                'product_id': product_id,
+                'buy_quantity': rng.randint(1, 4),
+                'get_free_quantity': rng.randint(1, 2),
+                'products': rng.sample(self.product_ids, rng.randint(0, 3)),
+            },
+            discount_value={
+                'percentage': rng.choice([rng.randint(1, 60), round(rng.uniform(0.1, 60), 1)]),
+                'amount': round(rng.uniform(0.01, 80), 2),
+                'type': rng.choice(['percentage', 'fixed']),
+                'value': rng.choice([rng.randint(1, 40), round(rng.uniform(0.1, 40), 2)]),
+            },
+            priority=rng.randint(0, 3),
+        )
+
+    def test_engine_matches_reference(self):
+        rng = random.Random(2024)
+        for iteration in range(self.iterations):
+            rules = sorted(
+                (self.random_rule(rng, rule_id) for rule_id in range(1, rng.randint(1, 9))),
+                key=lambda rule: (-rule.priority, rule.id),
+            )
+            rule_set = CompiledRuleSet.compile(rules)
+            cart_data = [
+                {'product_id': rng.choice(self.product_ids), 'quantity': rng.randint(1, 10)}
+                for _ in range(rng.randint(0, 8))
+            ]
+
+            with self.subTest(iteration=iteration):
+                base_total, final_total, applied = reference_calculate(cart_data, self.products, rules)
+                result = format_amounts(PricingService._price_cart(cart_data, self.products, rule_set), 'string')
+
+                self.assertEqual(Decimal(result['base_total']), base_total)
+                self.assertEqual(Decimal(result['final_total']), final_total)
+                self.assertEqual(Decimal(result['total_discount']), base_total - final_total)
+                self.assertEqual(
+                    [(rule['rule_name'], Decimal(rule['discount_amount'])) for rule in result['applied_rules']],
+                    applied,
+                )
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_numpy_backend_matches_engine(self):
+        rng = random.Random(2025)
+        for iteration in range(self.iterations // 10):
+            rules = sorted(
+                (self.random_rule(rng, rule_id) for rule_id in range(1, rng.randint(1, 9))),
+                key=lambda rule: (-rule.priority, rule.id),
+            )
+            rule_set = CompiledRuleSet.compile(rules)
+            # Carts include repeated products, missing products and zero quantities
+            carts = [
+                [CartLine(rng.choice(self.product_ids), rng.randint(0, 10)) for _ in range(rng.randint(0, 8))]
+                for _ in range(40)
+            ]
+
+            with self.subTest(iteration=iteration):
+                self.assertEqual(
+                    price_carts(carts, self.products, rule_set, backend='numpy'),
+                    [price_cart(lines, self.products, rule_set) for lines in carts],
+                )
+
+    def test_float_amounts_are_converted_once_from_exact_values(self):
+        product = next(iter(self.products.values()))
+        cart_data = [{'product_id': product.id, 'quantity': 3}]
+        rule_set = CompiledRuleSet.compile([])
+
+        exact = PricingService._price_cart(cart_data, self.products, rule_set)
+        self.assertEqual(exact['base_total'], product.price * 3)
+
+        result = format_amounts(PricingService._price_cart(cart_data, self.products, rule_set))
+        self.assertEqual(result['base_total'], float(product.price * 3))
+        self.assertEqual(result['items'][0]['unit_price'], float(product.price))
+
+
+class ParseCartItemsTests(SimpleTestCase):
+    def assertMatchesSerializer(self, data):
+        serializer = CartItemInputSerializer(data=data, many=True)
+        if serializer.is_valid():
+            self.assertEqual(parse_cart_items(data), serializer.validated_data)
+        else:
+            with self.assertRaises(ValidationError) as caught:
+                parse_cart_items(data)
+            self.assertEqual(caught.exception.detail, serializer.errors)
+
+    def test_matches_cart_item_input_serializer(self):
+        payloads = [
+            [],
+            [{'product_id': 1, 'quantity': 2}, {'product_id': 2, 'quantity': 1}],
+            [{'product_id': '3', 'quantity': ' 4 '}, {'product_id': 5.0, 'quantity': '2.00'}],
+            [{'product_id': 1, 'quantity': 0}, {'product_id': 'x', 'quantity': 1.5}],
+            [{'product_id': True, 'quantity': None}],
+            [{'product_id': 1}, 7, 'item'],
+            {'product_id': 1, 'quantity': 1},
+            'not a list',
+        ]
+        for payload in payloads:
+            with self.subTest(payload=payload):
+                self.assertMatchesSerializer(payload)
+
+    def test_duplicate_products_are_rejected(self):
+        with self.assertRaises(ValidationError) as caught:
+            parse_cart_items([{'product_id': 1, 'quantity': 1}, {'product_id': 1, 'quantity': 2}])
+
+        self.assertEqual(list(caught.exception.detail), [1])
+
+    def test_duplicate_products_can_be_merged(self):
+        items = parse_cart_items(
+            [{'product_id': 1, 'quantity': 1}, {'product_id': 2, 'quantity': 5}, {'product_id': 1, 'quantity': 2}],
+            merge_duplicates=True,
+        )
+
+        self.assertEqual(items, [{'product_id': 1, 'quantity': 3}, {'product_id': 2, 'quantity': 5}])
+
+
+class CartQueryCountTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = [Product.objects.create(name=f"Product {i}", price=Decimal('2.50')) for i in range(50)]
+
+    def fill_cart(self, cart, size):
+        CartItem.objects.bulk_create(
+            CartItem(cart=cart, product=product, quantity=2) for product in self.products[:size]
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_cart_detail_query_count_is_fixed(self):
+        get_active_rule_set()
+        for size in (1, 50):
+            cart = Cart.objects.create()
+            self.fill_cart(cart, size)
+
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('cart-detail', args=[cart.id]))
+
+            data = response.json()
+            self.assertEqual(data['items_count'], size)
+            self.assertEqual(Decimal(str(data['total_price'])), Decimal('5.00') * size)
+            self.assertEqual(data['items'][0]['product_name'], "Product 0")
+
+            # Subsequent reads are served from the cached snapshot
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(reverse('cart-detail', args=[cart.id])).json(), data)
+
+    def test_session_cart_query_count_is_fixed(self):
+        self.client.post(reverse('cart-items'), {'product': self.products[0].id}, format='json')
+        cart_id = self.client.get(reverse('cart-management')).json()['id']
+        with self.captureOnCommitCallbacks(execute=True):
+            for product in self.products[1:]:
+                CartItem.objects.create(cart_id=cart_id, product=product, quantity=2)
+        self.client.get(reverse('cart-management'))
+
+        # The session and its cart id come from the cache, the cart from its snapshot
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('cart-management'))
+
+        self.assertEqual(response.json()['items_count'], 50)
+
+    def test_session_key_is_unique_except_when_blank(self):
+        Cart.objects.create()
+        Cart.objects.create()
+        Cart.objects.create(session_key='abc')
+
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Cart.objects.create(session_key='abc')
+        self.assertEqual(Cart.objects.get_or_create(session_key='abc')[1], False)
+
+    def test_cart_items_query_count_is_fixed(self):
+        for size in (1, 50):
+            cart = Cart.objects.create()
+            self.fill_cart(cart, size)
+
+            with self.assertNumQueries(2):
+                response = self.client.get(reverse('cart-items'), {'cart_id': cart.id})
+
+            self.assertEqual(len(response.json()), size)
+
+
+class ProductCatalogTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        Product.objects.bulk_create(
+            Product(name=f"Product {i}", price=Decimal('1.50'), description="x" * 500) for i in range(25)
+        )
+        self.url = reverse('product-list')
+
+    def test_cursor_pages_cover_the_catalog_once(self):
+        ids = []
+        url = self.url + '?page_size=10'
+        while url:
+            data = self.client.get(url).json()
+            ids.extend(product['id'] for product in data['results'])
+            url = data['next']
+        self.assertEqual(ids, list(Product.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_sparse_fields_are_selected_in_sql(self):
+        with self.assertNumQueries(2) as ctx:  # catalog stamp, page
+            data = self.client.get(self.url, {'fields': 'id,name,price'}).json()
+        self.assertEqual(set(data['results'][0]), {'id', 'name', 'price'})
+        self.assertNotIn('description', ctx.captured_queries[-1]['sql'])
+
+        response = self.client.get(self.url, {'fields': 'id,cost'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_unchanged_pages_are_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertTrue(response.has_header('Last-Modified'))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        other_page = self.client.get(self.url, {'fields': 'id'})
+        self.assertNotEqual(other_page['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.first().delete()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class CatalogImportExportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.existing = Product.objects.create(sku="SKU-1", name="Old name", price=Decimal('9.99'))
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write_file(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w', encoding='utf-8') as stream:
+            stream.write(content)
+        return path
+
+    def test_import_upserts_by_sku_and_bumps_version_once(self):
+        path = self.write_file('products.ndjson', "\n".join([
+            '{"sku": "SKU-1", "name": "New name", "price": "12.50"}',
+            '{"sku": "SKU-2", "name": "Second", "price": 3, "description": "first"}',
+            '{"sku": "SKU-2", "name": "Second", "price": 4, "description": "last wins"}',
+            '{"sku": "SKU-3", "name": "Third", "price": "0"}',
+            'not json',
+            '{"sku": "SKU-4", "name": "Fourth", "price": "1.00"}',
+        ]))
+        version = get_catalog_version()
+        stdout, stderr = StringIO(), StringIO()
+
+        call_command('import_products', path, batch_size=2, stdout=stdout, stderr=stderr)
+
+        self.assertEqual(get_catalog_version(), version + 1)
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, self.existing.price), ("New name", Decimal('12.50')))
+        self.assertEqual(
+            dict(Product.objects.filter(sku__in=['SKU-2', 'SKU-4']).values_list('sku', 'description')),
+            {'SKU-2': 'last wins', 'SKU-4': ''},
+        )
+        self.assertFalse(Product.objects.filter(sku='SKU-3').exists())
+        self.assertIn("line 4:", stderr.getvalue())
+        self.assertIn("line 5: invalid JSON", stderr.getvalue())
+        self.assertIn("2 invalid", stdout.getvalue())
+
+    def test_csv_export_round_trips(self):
+        Product.objects.create(sku="SKU-2", name="Ünïcode, \"quoted\"", price=Decimal('1.05'), description="a\nb")
+        path = os.path.join(self.tmpdir.name, 'products.csv')
+        call_command('export_products', path, stderr=StringIO())
+        before = list(Product.objects.order_by('id').values_list('sku', 'name', 'price', 'description'))
+
+        Product.objects.all().delete()
+        call_command('import_products', path, stdout=StringIO())
+
+        after = list(Product.objects.order_by('id').values_list('sku', 'name', 'price', 'description'))
+        self.assertEqual(after, before)
+
+    def test_export_endpoint_streams_ndjson(self):
+        response = self.client.get(reverse('product-export'))
+
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(
+            [json.loads(line) for line in lines],
+            [{'sku': 'SKU-1', 'name': 'Old name', 'price': '9.99', 'description': ''}],
+        )
+
+
+class QuoteCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        quote_cache.clear()
+        quote_cache.reset_stats()
+        self.widget = Product.objects.create(name="Widget", price=Decimal('10.00'))
+        self.gadget = Product.objects.create(name="Gadget", price=Decimal('25.00'))
+        self.rule = PricingRule.objects.create(
+            name="10% over 50",
+            rule_type='percentage_discount',
+            condition_type='min_total',
+            condition_value={'min_amount': 50},
+            discount_value={'percentage': 10},
+        )
+        self.cart = [{'product_id': self.widget.id, 'quantity': 3}, {'product_id': self.gadget.id, 'quantity': 1}]
+
+    def test_repeated_quotes_are_served_without_queries(self):
+        first = PricingService.calculate_cart_total(self.cart)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(PricingService.calculate_cart_total(self.cart), first)
+            reordered = PricingService.calculate_cart_total(self.cart[::-1])
+        self.assertEqual([item['product_id'] for item in reordered['items']], [self.gadget.id, self.widget.id])
+        self.assertEqual(reordered['final_total'], first['final_total'])
+
+        # Another worker finds the quote in the shared cache
+        quote_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(PricingService.calculate_cart_total(self.cart, 'string')['final_total'], '49.500')
+
+        stats = quote_cache.stats()
+        self.assertEqual((stats['miss'], stats['local'], stats['shared']), (1, 2, 1))
+        self.assertEqual(stats['hit_rate'], 0.75)
+
+    def test_stale_quotes_are_never_served_after_an_update(self):
+        self.assertEqual(PricingService.calculate_cart_total(self.cart)['final_total'], 49.5)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gadget.price = Decimal('30.00')
+            self.gadget.save()
+        self.assertEqual(PricingService.calculate_cart_total(self.cart)['final_total'], 54.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rule.discount_value = {'percentage': 20}
+            self.rule.save()
+        self.assertEqual(PricingService.calculate_cart_total(self.cart)['final_total'], 48.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.widget.delete()
+        result = PricingService.calculate_cart_total(self.cart)
+        self.assertEqual([item['product_id'] for item in result['items']], [self.gadget.id])
+        self.assertEqual(result['final_total'], 30.0)
+
+    def test_only_small_carts_without_duplicates_are_memoized(self):
+        PricingService.calculate_cart_total(self.cart + [{'product_id': self.widget.id, 'quantity': 1}])
+        PricingService.calculate_cart_total([{'product_id': 999999 - i, 'quantity': 1} for i in range(4)])
+
+        self.assertEqual(quote_cache.stats()['skipped'], 2)
+        self.assertEqual(len(quote_cache.local), 0)
+
+    def test_local_entries_are_evicted_by_size_and_age(self):
+        lru = LocalLRU(max_size=2, ttl=60)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+
+        expired = LocalLRU(max_size=2, ttl=-1)
+        expired.set('a', 1)
+        self.assertIsNone(expired.get('a'))
+
+    def test_async_quotes_share_the_cache(self):
+        expected = PricingService.calculate_cart_total(self.cart)
+
+        result = async_to_sync(PricingService.acalculate_cart_total)(self.cart)
+
+        self.assertEqual(result, expected)
+        self.assertEqual(quote_cache.stats()['local'], 1)
+
+
+class PromotionTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        clear_local_promotions()
+        self.widget = Product.objects.create(name="Widget", price=Decimal('10.00'))
+        self.gadget = Product.objects.create(name="Gadget", price=Decimal('20.00'))
+        self.cable = Product.objects.create(name="Cable", price=Decimal('5.00'))
+        self.plain = Product.objects.create(name="Plain", price=Decimal('7.00'))
+        self.widget_rule = PricingRule.objects.create(
+            name="Widget 10% off",
+            rule_type='percentage_discount',
+            condition_type='product_based',
+            condition_value={'product_id': self.widget.id},
+            discount_value={'percentage': 10},
+            priority=3,
+        )
+        PricingRule.objects.create(
+            name="Gadget buy 2 get 1",
+            rule_type='buy_x_get_y',
+            condition_type='product_based',
+            condition_value={'product_id': self.gadget.id, 'buy_quantity': 2, 'get_free_quantity': 1},
+            discount_value={},
+            priority=2,
+        )
+        PricingRule.objects.create(
+            name="Widget and cable bundle",
+            rule_type='bundle_discount',
+            condition_type='min_quantity',
+            condition_value={'products': [self.widget.id, self.cable.id]},
+            discount_value={'type': 'fixed', 'value': 3},
+            priority=1,
+        )
+        PricingRule.objects.create(
+            name="1 off everything",
+            rule_type='fixed_discount',
+            condition_type='min_total',
+            condition_value={'min_amount': 0},
+            discount_value={'amount': 1},
+        )
+
+    def promotions(self, *product_ids, **params):
+        params['ids'] = ','.join(str(product_id) for product_id in product_ids)
+        return self.client.get(reverse('product-promotions'), params)
+
+    def test_entries_match_single_unit_quotes(self):
+        response = self.promotions(self.cable.id, self.widget.id, 999999, self.plain.id, self.gadget.id)
+
+        self.assertEqual(response.status_code, 200)
+        entries = response.json()['products']
+        self.assertEqual(
+            [entry['product_id'] for entry in entries],
+            [self.cable.id, self.widget.id, self.plain.id, self.gadget.id]
+        )
+        for entry in entries:
+            quote = PricingService.calculate_cart_total([{'product_id': entry['product_id'], 'quantity': 1}])
+            self.assertEqual(entry['unit_price'], quote['final_total'])
+
+        by_id = {entry['product_id']: entry for entry in entries}
+        widget = by_id[self.widget.id]
+        self.assertEqual((widget['price'], widget['unit_price']), (10.0, 8.0))
+        self.assertEqual(
+            [(promotion['rule_name'], promotion['applies_to_single_unit']) for promotion in widget['promotions']],
+            [("Widget 10% off", True), ("Widget and cable bundle", False)]
+        )
+        self.assertEqual(widget['promotions'][1]['bundle_products'], [self.widget.id, self.cable.id])
+        self.assertEqual(by_id[self.gadget.id]['promotions'][0]['get_free_quantity'], 1)
+        self.assertEqual(by_id[self.plain.id]['promotions'], [])
+        self.assertEqual(by_id[self.plain.id]['unit_price'], 6.0)
+
+        strings = self.promotions(self.widget.id, amounts='string').json()['products']
+        quote = PricingService.calculate_cart_total([{'product_id': self.widget.id, 'quantity': 1}], 'string')
+        self.assertEqual((strings[0]['price'], strings[0]['unit_price']), ('10.00', quote['final_total']))
+
+    def test_rules_sharing_a_name_are_tagged_separately(self):
+        PricingRule.objects.create(
+            name="Widget 10% off",
+            rule_type='fixed_discount',
+            condition_type='product_based',
+            condition_value={'product_id': self.widget.id, 'min_quantity': 2},
+            discount_value={'amount': 1},
+        )
+
+        promotions = self.promotions(self.widget.id).json()['products'][0]['promotions']
+
+        self.assertEqual(
+            [(promotion['rule_type'], promotion['applies_to_single_unit']) for promotion in promotions],
+            [('percentage_discount', True), ('bundle_discount', False), ('fixed_discount', False)]
+        )
+
+    def test_requests_are_answered_from_memory(self):
+        self.promotions(self.widget.id, self.gadget.id, 999999)
+
+        with self.assertNumQueries(0):
+            response = self.promotions(self.gadget.id, 999999, self.widget.id)
+        self.assertEqual(
+            [entry['product_id'] for entry in response.json()['products']], [self.gadget.id, self.widget.id]
+        )
+
+        # Only the products not seen yet are read
+        with self.assertNumQueries(1):
+            self.promotions(self.widget.id, self.cable.id)
+
+    def test_entries_are_invalidated_per_product(self):
+        ids = (self.widget.id, self.gadget.id, self.cable.id, self.plain.id)
+        self.promotions(*ids)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gadget.price = Decimal('30.00')
+            self.gadget.save()
+        with self.assertNumQueries(0):
+            self.promotions(self.widget.id, self.cable.id)
+        self.assertEqual(self.promotions(self.gadget.id).json()['products'][0]['unit_price'], 29.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.widget_rule.discount_value = {'percentage': 50}
+            self.widget_rule.save()
+            self.plain.delete()
+        by_id = {entry['product_id']: entry for entry in self.promotions(*ids).json()['products']}
+        self.assertEqual(by_id[self.widget.id]['unit_price'], 4.0)
+        self.assertNotIn(self.plain.id, by_id)
+
+        # A change to a rule that applies to every cart reprices every product
+        with self.captureOnCommitCallbacks(execute=True):
+            PricingRule.objects.filter(rule_type='fixed_discount').update(discount_value={'amount': 2})
+            PricingRule.objects.get(rule_type='fixed_discount').save()
+        self.assertEqual(self.promotions(self.cable.id).json()['products'][0]['unit_price'], 3.0)
+
+    def test_refresh_command_builds_every_entry(self):
+        stdout = StringIO()
+        call_command('refresh_promotions', chunk_size=3, stdout=stdout)
+        clear_local_promotions()
+
+        self.assertIn("Refreshed promotions for 4 products", stdout.getvalue())
+        with self.assertNumQueries(0):
+            response = self.promotions(self.widget.id, self.gadget.id, self.cable.id, self.plain.id)
+        self.assertEqual(response.json()['products'][0]['unit_price'], 8.0)
+
+    def test_invalid_ids_are_rejected(self):
+        self.assertEqual(self.promotions('x').status_code, 400)
+        with override_settings(PRICING_PROMOTIONS_MAX_IDS=2):
+            self.assertEqual(self.promotions(1, 2, 3).status_code, 400)
+
+
+class RuleSimulationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.widget = Product.objects.create(name="Widget", price=Decimal('10.00'))
+        self.gadget = Product.objects.create(name="Gadget", price=Decimal('20.00'))
+        self.active = PricingRule.objects.create(
+            name="Widget 10% off",
+            rule_type='percentage_discount',
+            condition_type='product_based',
+            condition_value={'product_id': self.widget.id},
+            discount_value={'percentage': 10},
+            priority=3,
+        )
+        self.inactive = PricingRule.objects.create(
+            name="5 off over 25",
+            rule_type='fixed_discount',
+            condition_type='min_total',
+            condition_value={'min_amount': 25},
+            discount_value={'amount': 5},
+            priority=2,
+            is_active=False,
+        )
+        self.draft = {
+            'name': "1 off everything",
+            'rule_type': 'fixed_discount',
+            'condition_type': 'min_total',
+            'condition_value': {'min_amount': 0},
+            'discount_value': {'amount': 1},
+            'priority': 1,
+        }
+        for contents in ([(self.widget, 2)], [(self.gadget, 1)], [(self.widget, 1), (self.gadget, 1)], []):
+            cart = Cart.objects.create()
+            for product, quantity in contents:
+                CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+
+    def simulate(self, **data):
+        return self.client.post(reverse('pricing-rule-simulate'), data, format='json')
+
+    def read_stream(self, response):
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+
+    def test_replays_stored_carts_through_candidate_rules(self):
+        response = self.simulate(rules=[self.inactive.id], drafts=[self.draft], chunk_size=1)
+
+        self.assertEqual(response.status_code, 200)
+        lines = self.read_stream(response)
+        # One progress line per chunk with items; the empty cart is skipped
+        self.assertEqual([line['progress']['carts'] for line in lines[:-1]], [1, 2, 3])
+        report = lines[-1]['report']
+        self.assertEqual(
+            (report['carts'], report['lines'], Decimal(report['base_total']), Decimal(report['total_discount'])),
+            (3, 4, Decimal('70'), Decimal('13')),
+        )
+        rules = {rule['name']: rule for rule in report['rules']}
+        self.assertEqual(list(rules), ["Widget 10% off", "5 off over 25", "1 off everything"])
+        # The product rule is only evaluated for carts holding the widget
+        self.assertEqual(
+            {name: (rule['evaluations'], rule['hits'], Decimal(rule['total_discount'])) for name, rule in rules.items()},
+            {
+                "Widget 10% off": (2, 2, Decimal('5')),
+                "5 off over 25": (3, 1, Decimal('5')),
+                "1 off everything": (3, 3, Decimal('3')),
+            },
+        )
+        self.assertAlmostEqual(rules["Widget 10% off"]['hit_rate'], 2 / 3)
+        self.assertEqual([rule['draft'] for rule in rules.values()], [False, False, True])
+        self.assertTrue(all(rule['avg_evaluation_us'] > 0 for rule in rules.values()))
+
+    def test_simulation_does_not_change_rules_or_carts(self):
+        self.read_stream(self.simulate(rules=[self.inactive.id], drafts=[self.draft]))
+
+        self.inactive.refresh_from_db()
+        self.assertFalse(self.inactive.is_active)
+        self.assertFalse(PricingRule.objects.filter(name=self.draft['name']).exists())
+        self.assertEqual(get_active_rule_set().rules[0].name, "Widget 10% off")
+        self.assertEqual(len(get_active_rule_set().rules), 1)
+
+    def test_invalid_candidates_are_rejected(self):
+        broken = dict(self.draft, discount_value={})
+
+        self.assertEqual(self.simulate(drafts=[broken]).status_code, 400)
+        self.assertEqual(self.simulate(rules=[999999]).status_code, 400)
+        with override_settings(PRICING_SIMULATION_MAX_CARTS=2):
+            self.assertEqual(self.simulate(limit=3).status_code, 400)
+            self.assertEqual(self.simulate(limit=2).status_code, 200)
+
+    def test_command_reports_json_within_limit(self):
+        path = os.path.join(tempfile.mkdtemp(), 'drafts.json')
+        self.addCleanup(os.remove, path)
+        with open(path, 'w', encoding='utf-8') as stream:
+            json.dump([self.draft], stream)
+        stdout = StringIO()
+
+        call_command(
+            'simulate_pricing_rules', '--no-active', '--rule', str(self.inactive.id), '--drafts', path,
+            '--limit', '2', '--json', stdout=stdout, stderr=StringIO(),
+        )
+
+        report = json.loads(stdout.getvalue())
+        self.assertEqual((report['carts'], Decimal(report['total_discount'])), (2, Decimal('2')))
+        self.assertEqual([rule['name'] for rule in report['rules']], ["5 off over 25", "1 off everything"])
+
+
+class InstrumentationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.product = Product.objects.create(name="Widget", price=Decimal('10.00'))
+        self.rule = PricingRule.objects.create(
+            name="Buy 2 get 1",
+            rule_type='buy_x_get_y',
+            condition_type='product_based',
+            condition_value={'product_id': self.product.id, 'buy_quantity': 2, 'get_free_quantity': 1},
+            discount_value={},
+        )
+
+    def calculate(self, quantity=4):
+        return self.client.post(
+            reverse('calculate-cart'), [{'product_id': self.product.id, 'quantity': quantity}], format='json'
+        )
+
+    def test_request_metrics_are_reported(self):
+        self.calculate()
+        # A different cart, so the quote is computed rather than memoized
+        response = self.calculate(5)
+
+        timing = response['Server-Timing']
+        self.assertIn('db;dur=', timing)
+        self.assertIn('desc="1 queries"', timing)  # products; the rule set is cached
+        self.assertIn('desc="1 evaluations"', timing)
+        self.assertIn('serialize;dur=', timing)
+
+        metrics = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('pricing_requests_total 2', metrics)
+        self.assertIn(
+            f'pricing_rule_evaluations_total{{rule_id="{self.rule.id}",rule_type="buy_x_get_y"}} 2', metrics
+        )
+        self.assertIn('pricing_cache_requests_total{cache="rule_set",result="miss"} 1', metrics)
+        self.assertIn('pricing_cache_requests_total{cache="rule_set",result="local"} 1', metrics)
+        self.assertIn('pricing_request_seconds_count 2', metrics)
+
+    @override_settings(PRICING_METRICS_SAMPLE_RATE=0)
+    def test_unsampled_requests_are_not_recorded(self):
+        response = self.calculate()
+
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(registry.requests, 0)
+
+
+class CartSnapshotTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.widget = Product.objects.create(name="Widget", price=Decimal('10.00'))
+        self.gadget = Product.objects.create(name="Gadget", price=Decimal('25.00'))
+        self.rule = PricingRule.objects.create(
+            name="10% over 50",
+            rule_type='percentage_discount',
+            condition_type='min_total',
+            condition_value={'min_amount': 50},
+            discount_value={'percentage': 10},
+        )
+        self.cart = Cart.objects.create()
+        self.url = reverse('cart-detail', args=[self.cart.id])
+
+    def add_item(self, product, quantity):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('cart-items'),
+                {'cart': self.cart.id, 'product': product.id, 'quantity': quantity},
+                format='json',
+            )
+        return response.json()['id']
+
+    def test_item_changes_patch_the_snapshot(self):
+        self.assertEqual(self.client.get(self.url).json()['pricing']['final_total'], 0.0)
+
+        widget_line = self.add_item(self.widget, 2)
+        self.add_item(self.gadget, 2)
+        with self.assertNumQueries(0):
+            data = self.client.get(self.url).json()
+        self.assertEqual(data['items_count'], 2)
+        self.assertEqual(data['pricing']['base_total'], 70.0)
+        self.assertEqual(data['pricing']['final_total'], 63.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.put(reverse('cart-item-detail', args=[widget_line]), {'quantity': 1}, format='json')
+        with self.assertNumQueries(0):
+            data = self.client.get(self.url).json()
+        self.assertEqual(data['pricing']['final_total'], 54.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('cart-item-detail', args=[widget_line]))
+        data = self.client.get(self.url).json()
+        self.assertEqual([item['product'] for item in data['items']], [self.gadget.id])
+        self.assertEqual(data['pricing']['final_total'], 50.0 * 0.9)
+
+    def test_rebuild_racing_a_write_is_not_served(self):
+        self.add_item(self.widget, 2)
+        # A reader takes the versions and loads the cart with the old quantity...
+        versions = snapshots._current_versions(self.cart.id)
+        cart = Cart.objects.with_items().get(id=self.cart.id)
+        # ...a write commits while there is no snapshot to patch...
+        with self.captureOnCommitCallbacks(execute=True):
+            CartService.add_item(self.cart.id, self.widget.id, 3)
+        # ...and only then does the reader store what it loaded
+        snapshots.build_cart_snapshot(cart, versions)
+
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['items'][0]['quantity'], 5)
+        self.assertEqual(data['pricing']['base_total'], 50.0)
+
+    def test_patches_run_out_of_commit_order_keep_the_latest_line(self):
+        line = CartItem.objects.get(id=self.add_item(self.widget, 1))
+        self.client.get(self.url)
+
+        with self.captureOnCommitCallbacks() as first:
+            line.quantity = 2
+            line.save()
+        with self.captureOnCommitCallbacks() as second:
+            line.quantity = 6
+            line.save()
+        for callback in second + first:
+            callback()
+
+        with self.assertNumQueries(0):
+            data = self.client.get(self.url).json()
+        self.assertEqual(data['items'][0]['quantity'], 6)
+        self.assertEqual(data['pricing']['final_total'], 54.0)
+
+    def test_rule_and_price_changes_discard_the_snapshot(self):
+        self.add_item(self.gadget, 2)
+        self.assertEqual(self.client.get(self.url).json()['pricing']['final_total'], 45.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.rule.discount_value = {'percentage': 20}
+            self.rule.save()
+        self.assertEqual(self.client.get(self.url).json()['pricing']['final_total'], 40.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gadget.price = Decimal('20.00')
+            self.gadget.save()
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['items'][0]['product_price'], '20.00')
+        self.assertEqual(data['pricing']['applied_rules'], [])
+        self.assertEqual(data['pricing']['final_total'], 40.0)
+
+
+class LazyCartTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name="Widget", price=Decimal('10.00'))
+
+    def add(self, client, quantity=1):
+        return client.post(reverse('cart-items'), {'product': self.product.id, 'quantity': quantity}, format='json')
+
+    def test_anonymous_visitors_get_an_empty_cart_without_writes(self):
+        get_active_rule_set()
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('cart-management'))
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertIsNone(data['id'])
+        self.assertEqual((data['items'], data['items_count']), ([], 0))
+        self.assertEqual(data['pricing']['final_total'], 0.0)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertFalse(Cart.objects.exists())
+
+    def test_first_add_creates_the_session_cart(self):
+        self.assertEqual(self.add(self.client).status_code, 201)
+        self.assertEqual(self.add(self.client, 2).status_code, 201)
+
+        cart = Cart.objects.get()
+        self.assertEqual(cart.session_key, self.client.session.session_key)
+        data = self.client.get(reverse('cart-management')).json()
+        self.assertEqual(data['id'], cart.id)
+        self.assertEqual(data['items'][0]['quantity'], 3)
+
+        other = self.client_class()
+        self.add(other)
+        self.assertEqual(Cart.objects.count(), 2)
+
+    def test_deleted_session_cart_is_served_as_empty(self):
+        self.add(self.client)
+        with self.captureOnCommitCallbacks(execute=True):
+            Cart.objects.all().delete()
+
+        data = self.client.get(reverse('cart-management')).json()
+
+        self.assertIsNone(data['id'])
+        self.assertEqual(data['items'], [])
+
+    def test_purge_removes_only_expired_empty_carts(self):
+        expired = [Cart.objects.create() for _ in range(3)]
+        recent = Cart.objects.create()
+        filled = Cart.objects.create()
+        CartItem.objects.create(cart=filled, product=self.product)
+        old = timezone.now() - timedelta(days=30)
+        Cart.objects.exclude(id=recent.id).update(updated_at=old)
+
+        out = StringIO()
+        call_command('purge_empty_carts', '--older-than', '24', '--dry-run', stdout=out)
+        self.assertIn("3 empty carts", out.getvalue())
+        self.assertEqual(Cart.objects.count(), 5)
+
+        out = StringIO()
+        call_command('purge_empty_carts', '--older-than', '24', '--batch-size', '2', stdout=out)
+
+        self.assertIn("Deleted 3 empty carts", out.getvalue())
+        self.assertEqual(set(Cart.objects.values_list('id', flat=True)), {recent.id, filled.id})
+        self.assertFalse(Cart.objects.filter(id__in=[cart.id for cart in expired]).exists())
+
+
+class CartServiceTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.cart = Cart.objects.create()
+        self.products = [Product.objects.create(name=f"Product {i}", price=Decimal('3.00')) for i in range(3)]
+
+    def test_adding_the_same_product_increments_quantity(self):
+        for quantity in (1, 2):
+            response = self.client.post(
+                reverse('cart-items'),
+                {'cart': self.cart.id, 'product': self.products[0].id, 'quantity': quantity},
+                format='json',
+            )
+            self.assertEqual(response.status_code, 201)
+
+        item = CartItem.objects.get(cart=self.cart)
+        self.assertEqual(item.quantity, 3)
+        self.assertEqual(response.json()['id'], item.id)
+        self.assertEqual(response.json()['quantity'], 3)
+
+    def test_set_items_upserts_every_line_in_one_statement(self):
+        CartService.add_item(self.cart.id, self.products[0].id, 5)
+
+        quantities = {product.id: index + 1 for index, product in enumerate(self.products)}
+        with self.assertNumQueries(4):  # savepoint, upsert, reload, release
+            items = CartService.set_items(self.cart.id, quantities)
+
+        self.assertEqual({item.product_id: item.quantity for item in items}, quantities)
+        self.assertEqual(CartItem.objects.filter(cart=self.cart).count(), 3)
+
+    def test_set_items_endpoint_validates_products(self):
+        response = self.client.put(
+            reverse('cart-items'),
+            {'cart': self.cart.id, 'items': [
+                {'product': self.products[0].id, 'quantity': 2},
+                {'product': 999999, 'quantity': 1},
+            ]},
+            format='json',
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(CartItem.objects.exists())
+
+
+class AsyncViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.factory = AsyncRequestFactory()
+        self.widget = Product.objects.create(name="Widget", price=Decimal('10.00'))
+        self.gadget = Product.objects.create(name="Gadget", price=Decimal('25.00'))
+        PricingRule.objects.create(
+            name="10% over 50",
+            rule_type='percentage_discount',
+            condition_type='min_total',
+            condition_value={'min_amount': 50},
+            discount_value={'percentage': 10},
+        )
+        PricingRule.objects.create(
+            name="Buy 2 get 1 widget",
+            rule_type='buy_x_get_y',
+            condition_type='product_based',
+            condition_value={'product_id': self.widget.id, 'buy_quantity': 2, 'get_free_quantity': 1},
+            discount_value={},
+            priority=1,
+        )
+        self.cart = Cart.objects.create()
+
+    async def post(self, view, data, query=''):
+        request = self.factory.post(f'/{query}', data, content_type='application/json')
+        return await view.as_view()(request)
+
+    async def test_calculate_cart_matches_sync_view(self):
+        cart_data = [
+            {'product_id': self.widget.id, 'quantity': 4},
+            {'product_id': self.gadget.id, 'quantity': 1},
+        ]
+        for query in ('', '?amounts=string'):
+            response = await self.post(async_views.CalculateCartView, cart_data, query)
+            expected = await sync_to_async(self.client.post)(
+                reverse('calculate-cart') + query, cart_data, format='json'
+            )
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(json.loads(response.content), expected.json())
+
+        invalid = [{'product_id': self.widget.id}]
+        response = await self.post(async_views.CalculateCartView, invalid)
+        expected = await sync_to_async(self.client.post)(reverse('calculate-cart'), invalid, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), expected.json())
+
+    async def test_cart_views_match_sync_views(self):
+        response = await self.post(
+            async_views.CartItemView,
+            {'cart': self.cart.id, 'product': self.gadget.id, 'quantity': 2},
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)['quantity'], 2)
+
+        request = self.factory.get('/', {'cart_id': self.cart.id})
+        response = await async_views.CartItemView.as_view()(request)
+        expected = await sync_to_async(self.client.get)(reverse('cart-items'), {'cart_id': self.cart.id})
+        self.assertEqual(json.loads(response.content), expected.json())
+
+        response = await async_views.CartView.as_view()(self.factory.get('/'), cart_id=self.cart.id)
+        expected = await sync_to_async(self.client.get)(reverse('cart-detail', args=[self.cart.id]))
+        self.assertEqual(json.loads(response.content), expected.json())
+        self.assertEqual(json.loads(response.content)['pricing']['final_total'], 45.0)
+
+        response = await async_views.CartView.as_view()(self.factory.get('/'), cart_id=999999)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_set_items_matches_sync_view(self):
+        data = {'cart': self.cart.id, 'items': [
+            {'product': self.widget.id, 'quantity': 3},
+            {'product': self.gadget.id, 'quantity': 1},
+        ]}
+        request = self.factory.put('/', data, content_type='application/json')
+        response = await async_views.CartItemView.as_view()(request)
+        # Setting the same quantities again returns the same rows
+        expected = await sync_to_async(self.client.put)(reverse('cart-items'), data, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(json.loads(response.content), expected.json())
+        self.assertEqual(
+            {item['product']: item['quantity'] for item in expected.json()}, {self.widget.id: 3, self.gadget.id: 1}
+        )
+
+        invalid = {'cart': self.cart.id, 'items': [{'product': 999999, 'quantity': 1}]}
+        request = self.factory.put('/', invalid, content_type='application/json')
+        response = await async_views.CartItemView.as_view()(request)
+        expected = await sync_to_async(self.client.put)(reverse('cart-items'), invalid, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content), expected.json())
+
+
+    async def test_form_bodies_and_unsupported_media_types_match_sync_views(self):
+        data = {'cart': self.cart.id, 'product': self.widget.id, 'quantity': 2}
+        response = await async_views.CartItemView.as_view()(self.factory.post('/', data))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)['quantity'], 2)
+
+        for view, name in ((async_views.CartItemView, 'cart-items'), (async_views.CalculateCartView, 'calculate-cart')):
+            request = self.factory.post('/', 'quantity=2', content_type='text/plain')
+            response = await view.as_view()(request)
+            expected = await sync_to_async(self.client.post)(reverse(name), 'quantity=2', content_type='text/plain')
+            self.assertEqual(response.status_code, 415)
+            self.assertEqual(json.loads(response.content), expected.json())
+
+class ConcurrentAddToCartTests(TransactionTestCase):
+    threads = 8
+    adds_per_thread = 25
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("shared-cache in-memory SQLite raises 'table is locked' instead of waiting")
+
+    def test_concurrent_adds_never_lose_quantity(self):
+        cart = Cart.objects.create()
+        product = Product.objects.create(name="Flash sale", price=Decimal('1.00'))
+
+        def add_many():
+            try:
+                for _ in range(self.adds_per_thread):
+                    CartService.add_item(cart.id, product.id, 1)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.threads) as pool:
+            for future in [pool.submit(add_many) for _ in range(self.threads)]:
+                future.result()
+
+        item = CartItem.objects.get(cart=cart, product=product)
+        self.assertEqual(item.quantity, self.threads * self.adds_per_thread)
+
+
+class ReplicaRoutingTests(TransactionTestCase):
+    """A second SQLite database stands in for a replica that lags behind the primary"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        # Registered after the test runner has set up its databases, so it
+        # is not created as a test database or mirrored onto the primary
+        cls.databases = cls.databases | {'replica'}
+        cls.replica_dir = tempfile.TemporaryDirectory()
+        replica = {'ENGINE': 'django.db.backends.sqlite3', 'NAME': os.path.join(cls.replica_dir.name, 'replica.sqlite3')}
+        connections.settings['replica'] = connections.configure_settings(
+            {DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS], 'replica': replica}
+        )['replica']
+        with override_settings(DATABASE_REPLICAS=[]):
+            call_command('migrate', database='replica', verbosity=0)
+        cls.enterClassContext(override_settings(DATABASE_REPLICAS=['replica']))
+
+    @classmethod
+    def tearDownClass(cls):
+        connections['replica'].close()
+        del connections['replica']
+        del connections.settings['replica']
+        cls.replica_dir.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.product = Product.objects.create(name="Widget", price=Decimal('10.00'))
+        # The replica has not seen the latest price yet
+        Product.objects.using('replica').create(id=self.product.id, name="Widget", price=Decimal('9.00'))
+        cache.delete(CATALOG_PIN_KEY)
+
+    def tearDown(self):
+        Product.objects.using('replica').all().delete()
+
+    def price_seen_by(self, client):
+        return Decimal(client.get(reverse('product-detail', args=[self.product.id])).json()['price'])
+
+    def test_reads_stick_to_the_primary_after_a_write_in_the_session(self):
+        other = self.client_class()
+        self.assertEqual(self.price_seen_by(self.client), Decimal('9.00'))
+
+        response = self.client.post(reverse('cart-items'), {'product': self.product.id, 'quantity': 1}, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertIn(PIN_COOKIE, response.cookies)
+        self.assertEqual(self.price_seen_by(self.client), Decimal('10.00'))
+        self.assertEqual(self.price_seen_by(other), Decimal('9.00'))
+        self.assertNotIn(PIN_COOKIE, other.get(reverse('product-list')).cookies)
+
+    def test_read_only_pricing_posts_use_the_replica(self):
+        cart = [{'product_id': self.product.id, 'quantity': 1}]
+
+        response = self.client.post(reverse('calculate-cart'), json.dumps(cart), content_type='application/json')
+        batch = self.client.post(reverse('calculate-cart-batch'), json.dumps([cart]), content_type='application/json')
+
+        self.assertEqual(response.json()['final_total'], 9.0)
+        self.assertEqual(batch.json()[0]['final_total'], 9.0)
+        self.assertNotIn(PIN_COOKIE, response.cookies)
+        self.assertNotIn(PIN_COOKIE, batch.cookies)
+
+    def test_catalog_changes_pin_every_client_until_replicas_catch_up(self):
+        self.product.price = Decimal('12.00')
+        self.product.save()
+
+        self.assertEqual(self.price_seen_by(self.client), Decimal('12.00'))
+        cache.delete(CATALOG_PIN_KEY)
+        self.assertEqual(self.price_seen_by(self.client), Decimal('9.00'))
+
+    def test_imports_pin_the_catalog_before_each_batch_is_visible(self):
+        records = [(line, {'sku': f"SKU-{line}", 'name': "Imported", 'price': '3.00'}) for line in range(4)]
+        pinned = []
+
+        import_products(records, batch_size=2, on_batch=lambda stats: pinned.append(cache.get(CATALOG_PIN_KEY)))
+
+        self.assertEqual(pinned, [1, 1])
+
+    def test_carts_are_always_read_from_the_primary(self):
+        cart = Cart.objects.create()
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+
+        data = self.client_class().get(reverse('cart-detail', args=[cart.id])).json()
+
+        self.assertEqual(data['items'][0]['quantity'], 2)
+        self.assertEqual(data['pricing']['final_total'], 20.0)
+
+    def test_transactions_and_other_models_use_the_primary(self):
+        self.assertEqual(router.db_for_read(Product), 'replica')
+        self.assertEqual(router.db_for_read(Cart), DEFAULT_DB_ALIAS)
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(PricingRule), DEFAULT_DB_ALIAS)
+        self.assertFalse(router.allow_migrate_model('replica', Product))
+        with override_settings(DATABASE_REPLICAS=[]):
+            self.assertEqual(router.db_for_read(Product), DEFAULT_DB_ALIAS)
+
+
+class WorkerStartupTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        quote_cache.clear()
+        quote_cache.reset_stats()
+        self.addCleanup(quote_cache.clear)
+        self.products = [Product.objects.create(name=f"Product {index}", price=Decimal('10.00')) for index in range(4)]
+        PricingRule.objects.create(
+            name="10% off",
+            rule_type='percentage_discount',
+            condition_type='min_total',
+            condition_value={'min_amount': 0},
+            discount_value={'percentage': 10},
+        )
+        for indexes in ([0, 1], [1], [1, 2]):
+            cart = Cart.objects.create()
+            for index in indexes:
+                CartItem.objects.create(cart=cart, product=self.products[index], quantity=1)
+
+    def test_hot_products_are_ranked_by_recent_cart_lines(self):
+        first, second, third, fourth = (product.id for product in self.products)
+
+        self.assertEqual(hot_product_ids(2), [second, first])
+        # Lines outside the window no longer count; the newest products fill in
+        CartItem.objects.update(added_at=timezone.now() - timedelta(days=30))
+        self.assertEqual(hot_product_ids(2), [fourth, third])
+
+        # A line added now to a cart that was created long ago counts
+        cart = Cart.objects.first()
+        Cart.objects.filter(id=cart.id).update(updated_at=timezone.now() - timedelta(days=30))
+        CartService.add_item(cart.id, third)
+        self.assertEqual(hot_product_ids(1), [third])
+
+    def test_primed_quotes_are_served_without_queries(self):
+        report = warm_up(2)
+
+        self.assertEqual((report['rules'], report['products'], report['quotes']), (1, 2, 2))
+        with self.assertNumQueries(0):
+            result = PricingService.calculate_cart_total([{'product_id': self.products[1].id, 'quantity': 1}])
+        self.assertEqual(result['final_total'], 9.0)
+        self.assertEqual(quote_cache.stats()['local'], 1)
+        # Quotes already in the process are not priced again
+        self.assertEqual(warm_up(2)['quotes'], 0)
+
+    def test_ready_warms_up_in_the_background_when_enabled(self):
+        with override_settings(PRICING_WARM_UP=True):
+            apps.get_app_config('cart').ready()
+
+        self.assertTrue(warmup.finished.wait(10))
+        self.assertEqual(quote_cache.stats()['size'], 4)
+
+    def test_command_reports_each_step(self):
+        stdout = StringIO()
+
+        call_command('warm_up_pricing', '--products', '3', stdout=stdout)
+
+        self.assertIn("hot_products", stdout.getvalue())
+        self.assertIn("Warmed 1 rules and 3 quotes for 3 products", stdout.getvalue())
+
+    def test_api_profile_drops_admin_and_browsable_api(self):
+        code = (
+            "import sys, django; django.setup();"
+            "from django.apps import apps; from django.conf import settings; from django.urls import reverse;"
+            "assert reverse('calculate-cart') == '/api/calculate-cart/';"
+            "assert settings.REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'] == ['cart.instrumentation.TimedJSONRenderer'];"
+            "assert not any(apps.is_installed(app) for app in ('django.contrib.admin', 'django.contrib.messages'));"
+            "sys.exit('django.contrib.staticfiles' in sys.modules)"
+        )
+        env = {
+            **os.environ,
+            'DJANGO_SETTINGS_MODULE': 'backend.settings_api',
+            'DB_ENGINE': 'sqlite',
+            'PRICING_WARM_UP': '0',
+            'SECRET_KEY': 'test',
+        }
+        completed = subprocess.run(
+            [sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(__file__)), env=env,
+        )
+        self.assertEqual(completed.returncode, 0)
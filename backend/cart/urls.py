@@ -1,7 +1,14 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from . import views
 
+# Under ASGI the hot cart endpoints are served by their async versions
+if settings.ASYNC_VIEWS:
+    from . import async_views as cart_views
+else:
+    cart_views = views
+
 # Create a router for ViewSets (if you want to use them later)
 router = DefaultRouter()
 # router.register('products', views.ProductViewSet)
@@ -10,16 +17,23 @@ router = DefaultRouter()
 urlpatterns = [
     # API endpoints
     path('products/', views.ProductListView.as_view(), name='product-list'),
+    path('products/export/', views.ProductExportView.as_view(), name='product-export'),
+    path('products/promotions/', views.ProductPromotionsView.as_view(), name='product-promotions'),
     path('products/<int:pk>/', views.ProductDetailView.as_view(), name='product-detail'),
     path('pricing-rules/', views.PricingRuleListView.as_view(), name='pricing-rule-list'),
+    path('pricing-rules/report/', views.PricingRuleReportView.as_view(), name='pricing-rule-report'),
+    path('pricing-rules/simulate/', views.SimulatePricingRulesView.as_view(), name='pricing-rule-simulate'),
     path('pricing-rules/<int:pk>/', views.PricingRuleDetailView.as_view(), name='pricing-rule-detail'),
-    path('calculate-cart/', views.CalculateCartView.as_view(), name='calculate-cart'),
-    path('cart/', views.CartView.as_view(), name='cart-management'),
-    path('cart/items/', views.CartItemView.as_view(), name='cart-items'),
+    path('calculate-cart/', cart_views.CalculateCartView.as_view(), name='calculate-cart'),
+    path('calculate-cart/batch/', views.CalculateCartBatchView.as_view(), name='calculate-cart-batch'),
+    path('cart/', cart_views.CartView.as_view(), name='cart-management'),
+    path('cart/<int:cart_id>/', cart_views.CartView.as_view(), name='cart-detail'),
+    path('cart/items/', cart_views.CartItemView.as_view(), name='cart-items'),
     path('cart/items/<int:pk>/', views.CartItemDetailView.as_view(), name='cart-item-detail'),
     
-    # Health check endpoint
+    # Health check and monitoring endpoints
     path('health/', views.HealthCheckView.as_view(), name='health-check'),
+    path('metrics/', views.MetricsView.as_view(), name='metrics'),
     
     # Include router URLs (for future ViewSet expansion)
     # path('', include(router.urls)),
@@ -27,6 +41,6 @@ urlpatterns = [
 
 # Alternative with router (more organized for larger APIs)
 # urlpatterns = router.urls + [
-#     path('calculate-cart/', views.CalculateCartView.as_view(), name='calculate-cart'),
+#     path('calculate-cart/', cart_views.CalculateCartView.as_view(), name='calculate-cart'),
 #     path('health/', views.HealthCheckView.as_view(), name='health-check'),
 # ]
\ No newline at end of file
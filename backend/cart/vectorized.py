@@ -0,0 +1,298 @@
+"""
+قیمت‌گذاری برداری دسته‌ای از سبدها با NumPy
+
+یک دسته سبد به صورت آرایه‌های ستونی نگهداری می‌شود: شماره سبد، شناسه
+محصول، تعداد و قیمت واحد به سنت برای هر ردیف. جمع‌ها و شرط‌ها با
+عملیات آرایه‌ای روی همه سبدها محاسبه می‌شوند و قوانین به ترتیب ارزیابی،
+هر کدام یک بار برای کل دسته، اعمال می‌شوند.
+
+مبالغ ردیف‌ها با سنت صحیح دقیق هستند. جمع جاری هر سبد پس از تخفیف‌های
+درصدی می‌تواند اعشار بیشتری داشته باشد، پس در آرایه object از Decimal
+و در PRICING_CONTEXT نگهداری می‌شود تا خروجی دقیقاً با price_cart برابر
+باشد. NumPy وابستگی اختیاری است؛ این ماژول فقط با انتخاب backend='numpy'
+بارگذاری می‌شود.
+"""
+from decimal import Decimal, localcontext
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+from .engine import (
+    PRICING_CONTEXT, ZERO, AppliedRule, BundleDiscount, BuyXGetYDiscount, CartLine, CompiledRule, CompiledRuleSet,
+    FixedDiscount, LineItem, MinQuantityCondition, MinTotalCondition, PercentageDiscount, ProductCondition,
+    price_cart, trigger_product_id,
+)
+
+CENTS_EXPONENT = -2
+
+
+def _is_int(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value: Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _rule_is_vectorizable(rule: CompiledRule) -> bool:
+    condition, discount = rule.condition, rule.discount
+    if isinstance(condition, MinQuantityCondition) and not _is_number(condition.min_quantity):
+        return False
+    if isinstance(condition, ProductCondition) and not (
+        _is_int(condition.product_id) and _is_number(condition.min_quantity)
+    ):
+        return False
+    if isinstance(discount, BuyXGetYDiscount) and not (
+        _is_int(discount.product_id) and _is_int(discount.buy_quantity) and discount.buy_quantity != 0
+        and _is_int(discount.get_free_quantity)
+    ):
+        return False
+    if isinstance(discount, BundleDiscount) and not all(_is_int(product_id) for product_id in discount.products):
+        return False
+    return True
+
+
+def supports(rule_set: CompiledRuleSet, products: Dict) -> bool:
+    """
+    آیا این دسته را می‌توان برداری و با خروجی یکسان محاسبه کرد
+
+    شناسه‌ها باید عدد صحیح و قیمت‌ها دقیقاً دو رقم اعشار داشته باشند
+    (مانند مقادیر DecimalField). پارامترهای غیرعادی قوانین، که در موتور
+    عادی خطای زمان اجرا می‌دهند، نیز پشتیبانی نمی‌شوند.
+    """
+    for product_id, product in products.items():
+        price = product.price
+        if not _is_int(product_id) or not isinstance(price, Decimal) or price.as_tuple().exponent != CENTS_EXPONENT:
+            return False
+    return all(_rule_is_vectorizable(rule) for rule in rule_set.rules)
+
+
+class CartBatch:
+    """
+    ردیف‌های یک دسته سبد به صورت آرایه‌های ستونی
+
+    ردیف‌ها به ترتیب سبد و سپس ترتیب ورودی هستند تا «اولین ردیف هر
+    محصول» همان معنای CartIndex را داشته باشد. ردیف‌های محصولات ناموجود
+    حذف می‌شوند.
+    """
+    __slots__ = (
+        'size', 'line_cart', 'line_product', 'quantity', 'line_cents',
+        'base_cents', 'line_count', 'total_quantity', '_first', '_first_positive', '_max_quantity',
+    )
+
+    def __init__(self, size: int, line_cart, line_product, quantity, unit_cents):
+        self.size = size
+        self.line_cart = line_cart
+        self.line_product = line_product
+        self.quantity = quantity
+        self.line_cents = unit_cents * quantity
+
+        self.base_cents = np.zeros(size, dtype=np.int64)
+        np.add.at(self.base_cents, line_cart, self.line_cents)
+        self.line_count = np.bincount(line_cart, minlength=size)
+        self.total_quantity = np.zeros(size, dtype=np.int64)
+        np.add.at(self.total_quantity, line_cart, quantity)
+
+        self._first = {}
+        self._first_positive = {}
+        self._max_quantity = {}
+
+    @classmethod
+    def from_carts(cls, carts: Sequence[Sequence[CartLine]], products: Dict) -> 'CartBatch':
+        line_cart, line_product, quantity = [], [], []
+        for index, lines in enumerate(carts):
+            for line in lines:
+                line_cart.append(index)
+                line_product.append(line.product_id)
+                quantity.append(line.quantity)
+        return cls.from_arrays(len(carts), line_cart, line_product, quantity, products)
+
+    @classmethod
+    def from_arrays(cls, size: int, line_cart, line_product, quantity, products: Dict) -> 'CartBatch':
+        """ساخت دسته از ستون‌های آماده، مثلاً خوانده‌شده با values_list"""
+        line_cart = np.asarray(line_cart, dtype=np.int64)
+        line_product = np.asarray(line_product, dtype=np.int64)
+        quantity = np.asarray(quantity, dtype=np.int64)
+
+        product_ids = np.array(sorted(products), dtype=np.int64)
+        cents = np.array(
+            [int(products[product_id].price.scaleb(-CENTS_EXPONENT)) for product_id in product_ids.tolist()],
+            dtype=np.int64,
+        )
+        if len(product_ids):
+            position = np.minimum(np.searchsorted(product_ids, line_product), len(product_ids) - 1)
+            found = product_ids[position] == line_product
+        else:
+            position = np.zeros(len(line_product), dtype=np.int64)
+            found = np.zeros(len(line_product), dtype=bool)
+
+        return cls(
+            size, line_cart[found], line_product[found], quantity[found],
+            cents[position[found]] if len(product_ids) else np.zeros(0, dtype=np.int64),
+        )
+
+    def _first_lines(self, cache: Dict, product_id: int, positive_only: bool):
+        """(present, index) اولین ردیف محصول در هر سبد"""
+        result = cache.get(product_id)
+        if result is None:
+            mask = self.line_product == product_id
+            if positive_only:
+                mask &= self.quantity >= 1
+            indexes = np.nonzero(mask)[0]
+            carts, first = np.unique(self.line_cart[indexes], return_index=True)
+            present = np.zeros(self.size, dtype=bool)
+            present[carts] = True
+            line_index = np.zeros(self.size, dtype=np.int64)
+            line_index[carts] = indexes[first]
+            result = cache[product_id] = (present, line_index)
+        return result
+
+    def first_line(self, product_id: int):
+        return self._first_lines(self._first, product_id, False)
+
+    def first_positive_line(self, product_id: int):
+        return self._first_lines(self._first_positive, product_id, True)
+
+    def max_quantity(self, product_id: int):
+        """(present, بیشترین تعداد محصول در هر سبد)"""
+        result = self._max_quantity.get(product_id)
+        if result is None:
+            indexes = np.nonzero(self.line_product == product_id)[0]
+            maximum = np.full(self.size, -1, dtype=np.int64)
+            np.maximum.at(maximum, self.line_cart[indexes], self.quantity[indexes])
+            present = np.zeros(self.size, dtype=bool)
+            present[self.line_cart[indexes]] = True
+            result = self._max_quantity[product_id] = (present, maximum)
+        return result
+
+
+def _decimal_cents(cents) -> np.ndarray:
+    return np.array([Decimal(value).scaleb(CENTS_EXPONENT) for value in cents.tolist()], dtype=object)
+
+
+def _condition_mask(rule: CompiledRule, batch: CartBatch, current: np.ndarray) -> np.ndarray:
+    condition = rule.condition
+    if isinstance(condition, MinTotalCondition):
+        return np.asarray(current >= condition.min_amount, dtype=bool)
+    if isinstance(condition, MinQuantityCondition):
+        return batch.total_quantity >= condition.min_quantity
+    if isinstance(condition, ProductCondition):
+        present, maximum = batch.max_quantity(condition.product_id)
+        return present & (maximum >= condition.min_quantity)
+    raise TypeError(f"Unsupported condition {type(condition).__name__}")
+
+
+def _discounts(rule: CompiledRule, batch: CartBatch, carts: np.ndarray, current: np.ndarray,
+               products: Dict) -> np.ndarray:
+    """تخفیف قانون برای سبدهای carts که شرط آن‌ها برقرار است"""
+    discount = rule.discount
+    if isinstance(discount, PercentageDiscount):
+        return current[carts] * discount.rate
+    if isinstance(discount, FixedDiscount):
+        totals = current[carts]
+        # همان نتیجه min(amount, total)، از جمله نمایش Decimal در حالت برابری
+        return np.where(totals < discount.amount, totals, discount.amount)
+    if isinstance(discount, BuyXGetYDiscount):
+        present, line_index = batch.first_line(discount.product_id)
+        quantity = np.where(present[carts], batch.quantity[line_index[carts]], 0)
+        free_units = (quantity // discount.buy_quantity) * discount.get_free_quantity
+        amounts = free_units.astype(object) * products[discount.product_id].price
+        amounts[~present[carts]] = ZERO
+        return amounts
+    if isinstance(discount, BundleDiscount):
+        if not discount.products:
+            return np.full(len(carts), ZERO, dtype=object)
+        complete = np.ones(len(carts), dtype=bool)
+        bundle_cents = np.zeros(len(carts), dtype=np.int64)
+        for product_id in discount.products:
+            present, line_index = batch.first_positive_line(product_id)
+            complete &= present[carts]
+            bundle_cents += np.where(present[carts], batch.line_cents[line_index[carts]], 0)
+
+        amounts = np.full(len(carts), ZERO, dtype=object)
+        if discount.discount_type == 'percentage':
+            amounts[complete] = _decimal_cents(bundle_cents[complete]) * discount.rate
+        elif discount.discount_type == 'fixed':
+            amounts[complete] = discount.value
+        return amounts
+    raise TypeError(f"Unsupported discount {type(discount).__name__}")
+
+
+def _rule_scope(rule: CompiledRule, batch: CartBatch):
+    """سبدهایی که قانون برای آن‌ها کاندید است، مانند CompiledRuleSet.candidates"""
+    product_scoped, product_id = trigger_product_id(rule)
+    if not product_scoped:
+        return np.ones(batch.size, dtype=bool)
+    if product_id is None:
+        return None
+    present, _ = batch.first_line(product_id)
+    return present
+
+
+def price_carts_vectorized(carts: Sequence[Sequence[CartLine]], products: Dict, rule_set: CompiledRuleSet,
+                           include_items: bool = True) -> List[Dict[str, Any]]:
+    """
+    محاسبه قیمت یک دسته سبد با عملیات آرایه‌ای
+
+    خروجی هر سبد برابر با price_cart است. اگر supports برای این محصولات
+    و قوانین False باشد، دسته با موتور عادی محاسبه می‌شود.
+
+    Args:
+        carts: سبدها؛ هر سبد دنباله‌ای از CartLine
+        products: نگاشت شناسه محصول به رکوردی با id، name و price
+        rule_set: مجموعه قوانین کامپایل‌شده
+        include_items: ساخت فهرست items برای هر سبد؛ در شبیه‌سازی‌هایی که
+            فقط جمع‌ها لازم‌اند، False هزینه ساخت LineItem هر ردیف را حذف می‌کند
+
+    Returns:
+        نتایج با مبالغ Decimal به همان ترتیب ورودی
+    """
+    if not supports(rule_set, products):
+        results = [price_cart(lines, products, rule_set) for lines in carts]
+        if not include_items:
+            for result in results:
+                del result['items']
+        return results
+
+    batch = CartBatch.from_carts(carts, products)
+    applied = [[] for _ in range(batch.size)]
+
+    with localcontext(PRICING_CONTEXT):
+        base = np.full(batch.size, ZERO, dtype=object)
+        has_lines = batch.line_count > 0
+        base[has_lines] = _decimal_cents(batch.base_cents[has_lines])
+        current = base.copy()
+
+        for rule in rule_set.rules:
+            scope = _rule_scope(rule, batch)
+            if scope is None:
+                continue
+            mask = scope & _condition_mask(rule, batch, current)
+            carts_hit = np.nonzero(mask)[0]
+            if not len(carts_hit):
+                continue
+
+            amounts = _discounts(rule, batch, carts_hit, current, products)
+            positive = np.asarray(amounts > 0, dtype=bool)
+            carts_hit, amounts = carts_hit[positive], amounts[positive]
+            current[carts_hit] = current[carts_hit] - amounts
+            for cart_index, amount in zip(carts_hit.tolist(), amounts.tolist()):
+                applied[cart_index].append(AppliedRule(rule.name, rule.rule_type, amount))
+
+        results = []
+        for index in range(batch.size):
+            result = {
+                'base_total': base[index],
+                'final_total': current[index],
+                'total_discount': base[index] - current[index],
+            }
+            if include_items:
+                result['items'] = [
+                    LineItem(product.id, product.name, line.quantity, product.price, product.price * line.quantity)
+                    for line in carts[index]
+                    for product in (products.get(line.product_id),)
+                    if product is not None
+                ]
+            result['applied_rules'] = applied[index]
+            results.append(result)
+        return results
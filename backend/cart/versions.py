@@ -0,0 +1,98 @@
+"""
+کلیدهای نسخه در کش برای باطل‌سازی داده‌های مشتق‌شده
+
+هر کلید یک عدد صحیح است که با هر تغییر مرتبط افزایش می‌یابد. داده‌های
+کش‌شده نسخه‌ای را که با آن ساخته شده‌اند نگه می‌دارند و در صورت تفاوت
+با نسخه فعلی دوباره ساخته می‌شوند.
+"""
+import time
+
+from django.core.cache import cache
+
+# تغییر هر PricingRule
+RULES_VERSION_KEY = 'pricing:rules:version'
+# تغییر هر Product (قیمت، نام یا حذف)
+CATALOG_VERSION_KEY = 'pricing:catalog:version'
+# ایجاد، تغییر یا حذف یک Product مشخص
+PRODUCT_VERSION_KEY = 'pricing:product:{product_id}:version'
+
+
+def _initial_version() -> int:
+    # نسخه اولیه غیرتکراری است تا پس از پاک شدن کش، نسخه قدیمی
+    # نگهداری‌شده در حافظه workerها دوباره معتبر به نظر نرسد
+    return time.time_ns()
+
+
+def get_version(key: str) -> int:
+    """نسخه فعلی یک کلید؛ در صورت نبود، مقداردهی اولیه می‌شود"""
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def get_versions(*keys: str) -> dict:
+    """چند نسخه با یک رفت و برگشت به کش"""
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = get_version(key)
+    return versions
+
+
+async def aget_version(key: str) -> int:
+    """نسخه async از get_version"""
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, _initial_version(), timeout=None)
+        version = await cache.aget(key)
+    return version
+
+
+async def aget_versions(*keys: str) -> dict:
+    """نسخه async از get_versions"""
+    versions = await cache.aget_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = await aget_version(key)
+    return versions
+
+
+def bump_version(key: str) -> None:
+    """باطل کردن همه داده‌های ساخته‌شده با نسخه فعلی"""
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), timeout=None)
+
+
+def get_rules_version() -> int:
+    return get_version(RULES_VERSION_KEY)
+
+
+def bump_rules_version() -> None:
+    bump_version(RULES_VERSION_KEY)
+
+
+def get_catalog_version() -> int:
+    return get_version(CATALOG_VERSION_KEY)
+
+
+def bump_catalog_version() -> None:
+    bump_version(CATALOG_VERSION_KEY)
+
+
+def product_version_key(product_id) -> str:
+    return PRODUCT_VERSION_KEY.format(product_id=product_id)
+
+
+def bump_product_versions(product_ids) -> None:
+    """
+    باطل کردن داده‌های ساخته‌شده با نسخه فعلی چند محصول با یک رفت و برگشت
+
+    به جای incr جداگانه برای هر کلید، مقدار غیرتکراری تازه نوشته می‌شود؛
+    فقط متفاوت بودن نسخه اهمیت دارد.
+    """
+    version = _initial_version()
+    cache.set_many({product_version_key(product_id): version for product_id in product_ids}, timeout=None)
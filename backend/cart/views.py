@@ -1,17 +1,41 @@
+import hashlib
+
 from rest_framework import status, generics
+from rest_framework.filters import OrderingFilter
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.exceptions import ValidationError
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from .models import Product, PricingRule, Cart, CartItem
+from .catalog_io import CONTENT_TYPES, FORMATS, export_lines
+from .instrumentation import record_cache, registry
+from .pagination import ProductCursorPagination
+from .promotions import format_entry, get_promotions
+from .quote_cache import quote_cache
+from .rule_analysis import analyze_active_rules, max_cart_total
+from .rule_cache import get_active_rule_set
 from .serializers import (
     ProductSerializer, 
     PricingRuleSerializer,
-    CartItemInputSerializer,
-    CartCalculationSerializer,
-    CartSerializer,
-    CartItemSerializer
+    CartItemSerializer,
+    CartItemAddSerializer,
+    CartItemsSetSerializer,
+    RuleSimulationSerializer,
+    parse_cart_items
 )
-from .services import PricingService
+from .services import AMOUNT_FORMATS, CartService, PricingService
+from .simulation import RuleSimulator, build_candidate_rule_set, stored_cart_chunks, stream_simulation
+from .snapshots import build_cart_snapshot, empty_cart_snapshot, get_cart_snapshot, invalidate_cart_snapshot
+from .versions import CATALOG_VERSION_KEY, RULES_VERSION_KEY, get_catalog_version
+
+CATALOG_STAMP_KEY = 'catalog:stamp:{version}'
+CATALOG_STAMP_TIMEOUT = 24 * 60 * 60
 
 class HealthCheckView(APIView):
     """Health check endpoint for monitoring"""
@@ -22,10 +46,119 @@ class HealthCheckView(APIView):
             "version": "1.0.0"
         })
 
+def catalog_stamp(request):
+    """
+    Latest updated_at and product count for the current catalog version.
+
+    Cached per catalog version, so checking a client's validators costs
+    two cache reads and no queries until a product changes.
+    """
+    stamp = getattr(request, '_catalog_stamp', None)
+    if stamp is None:
+        key = CATALOG_STAMP_KEY.format(version=get_catalog_version())
+        stamp = cache.get(key)
+        record_cache('catalog_stamp', 'miss' if stamp is None else 'hit')
+        if stamp is None:
+            stamp = Product.objects.aggregate(last_modified=Max('updated_at'), count=Count('id'))
+            cache.set(key, stamp, CATALOG_STAMP_TIMEOUT)
+        request._catalog_stamp = stamp
+    return stamp
+
+def product_list_etag(request, *args, **kwargs):
+    # The count catches deletes, which leave max(updated_at) unchanged;
+    # the path and Accept header tell pages, field sets and formats apart
+    stamp = catalog_stamp(request)
+    key = f"{stamp['last_modified']}|{stamp['count']}|{request.get_full_path()}|{request.META.get('HTTP_ACCEPT', '')}"
+    return hashlib.md5(key.encode()).hexdigest()
+
+def product_list_last_modified(request, *args, **kwargs):
+    return catalog_stamp(request)['last_modified']
+
+@method_decorator(
+    condition(etag_func=product_list_etag, last_modified_func=product_list_last_modified),
+    name='get'
+)
 class ProductListView(generics.ListAPIView):
-    """List all products"""
+    """List products a page at a time, with optional ?fields= selection"""
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['id', 'updated_at']
+    
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.requested_fields = self.parse_requested_fields(request)
+    
+    def parse_requested_fields(self, request):
+        """Validate ?fields=id,name,price against the serializer's fields"""
+        value = request.query_params.get('fields', '')
+        fields = [name.strip() for name in value.split(',') if name.strip()]
+        unknown = [name for name in fields if name not in ProductSerializer.Meta.fields]
+        if unknown:
+            raise ValidationError({
+                "fields": [f"Unknown field(s): {', '.join(unknown)}. "
+                           f"Choose from: {', '.join(ProductSerializer.Meta.fields)}"]
+            })
+        return fields or None
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.requested_fields:
+            # The pagination cursor reads id or updated_at from the last row
+            queryset = queryset.only('id', 'updated_at', *self.requested_fields)
+        return queryset
+    
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.requested_fields)
+        return super().get_serializer(*args, **kwargs)
+
+class ProductExportView(APIView):
+    """Stream the whole catalog as NDJSON or CSV (?output=ndjson|csv)"""
+    
+    def get(self, request):
+        file_format = request.query_params.get('output', 'ndjson')
+        if file_format not in FORMATS:
+            return Response(
+                {"error": f"output must be one of: {', '.join(FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        response = StreamingHttpResponse(export_lines(file_format), content_type=CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+        return response
+
+class ProductPromotionsView(APIView):
+    """Promotions and single-unit price for many products (?ids=1,2,3), served from per-product cache entries"""
+
+    def get(self, request):
+        amount_format = request.query_params.get('amounts', 'float')
+        error_response = invalid_amount_format_response(amount_format)
+        if error_response:
+            return error_response
+
+        raw_ids = [value for value in request.query_params.get('ids', '').split(',') if value.strip()]
+        try:
+            product_ids = [int(value) for value in raw_ids]
+        except ValueError:
+            return Response(
+                {"error": "ids must be a comma-separated list of product ids"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        max_ids = settings.PRICING_PROMOTIONS_MAX_IDS
+        if len(product_ids) > max_ids:
+            return Response(
+                {"error": f"At most {max_ids} products can be requested at once"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        versions, entries = get_promotions(product_ids)
+        return Response({
+            "rules_version": versions[RULES_VERSION_KEY],
+            "catalog_version": versions[CATALOG_VERSION_KEY],
+            "products": [format_entry(entry, amount_format) for entry in entries],
+        })
 
 class ProductDetailView(generics.RetrieveAPIView):
     """Retrieve a specific product"""
@@ -42,51 +175,158 @@ class PricingRuleDetailView(generics.RetrieveAPIView):
     queryset = PricingRule.objects.all()
     serializer_class = PricingRuleSerializer
 
+class PricingRuleReportView(APIView):
+    """Analysis of the active pricing rules: schema errors, unreachable rules and short-circuits"""
+
+    def get(self, request):
+        analysis = analyze_active_rules()
+        live_rule_set = get_active_rule_set()
+        stops_at_zero = {rule.id: rule.stops_at_zero for rule in live_rule_set.rules}
+        max_total = max_cart_total()
+
+        rules = []
+        for report in analysis.reports:
+            rule = report.rule
+            rules.append({
+                "id": rule.id,
+                "name": rule.name,
+                "rule_type": rule.rule_type,
+                "condition_type": rule.condition_type,
+                "priority": rule.priority,
+                "live": rule.id in stops_at_zero,
+                "compiled": report.compiled is not None,
+                "schema_errors": report.errors,
+                "unreachable": report.unreachable,
+                "stops_at_zero": stops_at_zero.get(rule.id, False),
+            })
+        return Response({
+            "rules_version": live_rule_set.version,
+            "max_cart_total": None if max_total is None else str(max_total),
+            "active": len(rules),
+            "live": len(live_rule_set),
+            "dropped": sum(1 for rule in rules if not rule["live"]),
+            "invalid": sum(1 for rule in rules if rule["schema_errors"]),
+            "rules": rules,
+        })
+
+class SimulatePricingRulesView(APIView):
+    """
+    Replay stored carts through a candidate rule set (active, selected and draft rules)
+    and stream NDJSON progress per chunk followed by per-rule hit rate, discount and cost
+    """
+
+    def post(self, request):
+        serializer = RuleSimulationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        options = serializer.validated_data
+
+        rule_set, skipped = build_candidate_rule_set(options['rules'], options['drafts'], options['include_active'])
+        chunks = stored_cart_chunks(
+            options['chunk_size'],
+            options.get('limit', settings.PRICING_SIMULATION_MAX_CARTS),
+            options['sample_rate'],
+            options['seed'],
+        )
+        return StreamingHttpResponse(
+            stream_simulation(RuleSimulator(rule_set, skipped), chunks),
+            content_type=CONTENT_TYPES['ndjson'],
+        )
+
+def invalid_amount_format_response(amount_format):
+    """Return a 400 response for an unsupported ?amounts= value, else None"""
+    if amount_format in AMOUNT_FORMATS:
+        return None
+    return Response(
+        {"error": f"amounts must be one of: {', '.join(AMOUNT_FORMATS)}"},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+def merge_duplicates_requested(request):
+    return request.query_params.get('merge', '').lower() in ('1', 'true', 'yes')
+
 class CalculateCartView(APIView):
     """Calculate cart total with pricing rules applied"""
     
     def post(self, request):
-        input_serializer = CartItemInputSerializer(data=request.data, many=True)
+        amount_format = request.query_params.get('amounts', 'float')
+        error_response = invalid_amount_format_response(amount_format)
+        if error_response:
+            return error_response
+        
+        try:
+            cart_data = parse_cart_items(request.data, merge_duplicates_requested(request))
+        except ValidationError as exc:
+            return Response(exc.detail, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Amounts are already converted to their output type by the service,
+        # so the result is written out as-is instead of being re-validated
+        result = PricingService.calculate_cart_total(cart_data, amount_format)
+        return Response(result)
+
+class CalculateCartBatchView(APIView):
+    """Calculate totals for many carts against a single rule snapshot"""
+    
+    def post(self, request):
+        amount_format = request.query_params.get('amounts', 'float')
+        error_response = invalid_amount_format_response(amount_format)
+        if error_response:
+            return error_response
+        
+        carts = request.data
+        if not isinstance(carts, list):
+            return Response(
+                {"error": "Expected a list of carts"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        max_carts = settings.PRICING_BATCH_MAX_CARTS
+        if len(carts) > max_carts:
+            return Response(
+                {"error": f"At most {max_carts} carts can be priced per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        if input_serializer.is_valid():
-            cart_data = input_serializer.validated_data
-            result = PricingService.calculate_cart_total(cart_data)
-            
-            output_serializer = CartCalculationSerializer(data=result)
-            if output_serializer.is_valid():
-                return Response(output_serializer.validated_data)
+        # Invalid carts get their own errors without failing the batch
+        merge_duplicates = merge_duplicates_requested(request)
+        results = [None] * len(carts)
+        valid_indexes = []
+        valid_carts = []
+        for index, cart_data in enumerate(carts):
+            try:
+                valid_carts.append(parse_cart_items(cart_data, merge_duplicates))
+            except ValidationError as exc:
+                results[index] = {"errors": exc.detail}
             else:
-                return Response(
-                    output_serializer.errors, 
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
+                valid_indexes.append(index)
         
-        return Response(input_serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        for index, result in zip(valid_indexes, PricingService.calculate_many(valid_carts, amount_format)):
+            results[index] = result
+        
+        return Response(results)
 
 class CartView(APIView):
     """Cart management - create and retrieve carts"""
     
     def get(self, request, cart_id=None):
-        """Get or create a cart"""
+        """Get a cart, or the session's cart, served from its priced snapshot"""
         if cart_id:
-            cart = get_object_or_404(Cart, id=cart_id)
-        else:
-            # Create a new cart or get existing from session
-            session_key = request.session.session_key
-            if session_key:
-                cart, created = Cart.objects.get_or_create(session_key=session_key)
-            else:
-                request.session.create()
-                cart = Cart.objects.create(session_key=request.session.session_key)
+            return Response(get_cart_snapshot(cart_id))
         
-        serializer = CartSerializer(cart)
-        return Response(serializer.data)
+        # The session's cart; visitors who have not added anything get an
+        # empty cart without a session or cart row being written
+        cart_id = CartService.session_cart_id(request.session)
+        if cart_id is not None:
+            try:
+                return Response(get_cart_snapshot(cart_id))
+            except Http404:
+                CartService.forget_session_cart(request.session)
+        return Response(empty_cart_snapshot(request.session.session_key))
     
     def post(self, request):
         """Create a new cart"""
         cart = Cart.objects.create()
-        serializer = CartSerializer(cart)
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        return Response(build_cart_snapshot(cart), status=status.HTTP_201_CREATED)
 
 class CartItemView(APIView):
     """Manage cart items"""
@@ -101,16 +341,37 @@ class CartItemView(APIView):
             )
         
         cart = get_object_or_404(Cart, id=cart_id)
-        items = cart.items.all()
+        items = cart.items.select_related('product')
         serializer = CartItemSerializer(items, many=True)
         return Response(serializer.data)
     
     def post(self, request):
-        """Add item to cart"""
-        serializer = CartItemSerializer(data=request.data)
+        """
+        Add item to cart, or increase its quantity if already present.
+
+        Without a cart id the item goes to the session's cart, which is
+        created here on the first add.
+        """
+        serializer = CartItemAddSerializer(data=request.data)
+        if serializer.is_valid():
+            cart = serializer.validated_data.get('cart')
+            item = CartService.add_item(
+                cart.id if cart else CartService.get_or_create_session_cart(request.session),
+                serializer.validated_data['product'].id,
+                serializer.validated_data['quantity']
+            )
+            return Response(CartItemSerializer(item).data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    def put(self, request):
+        """Set the quantity of many cart lines at once"""
+        serializer = CartItemsSetSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save()
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
+            items = CartService.set_items(
+                serializer.validated_data['cart'].id,
+                serializer.validated_data['items']
+            )
+            return Response(CartItemSerializer(items, many=True).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 class CartItemDetailView(APIView):
@@ -118,16 +379,20 @@ class CartItemDetailView(APIView):
     
     def get(self, request, pk):
         """Get specific cart item"""
-        item = get_object_or_404(CartItem, pk=pk)
+        item = get_object_or_404(CartItem.objects.select_related('product'), pk=pk)
         serializer = CartItemSerializer(item)
         return Response(serializer.data)
     
     def put(self, request, pk):
         """Update cart item quantity"""
-        item = get_object_or_404(CartItem, pk=pk)
+        item = get_object_or_404(CartItem.objects.select_related('product'), pk=pk)
+        old_cart_id = item.cart_id
         serializer = CartItemSerializer(item, data=request.data, partial=True)
         if serializer.is_valid():
-            serializer.save()
+            item = serializer.save()
+            # The new cart's snapshot is patched by the post_save signal
+            if item.cart_id != old_cart_id:
+                invalidate_cart_snapshot(old_cart_id)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     
@@ -137,6 +402,31 @@ class CartItemDetailView(APIView):
         item.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+def render_quote_cache_metrics(stats):
+    """Quote memoization counters for every request, sampled or not"""
+    lines = [
+        '# HELP pricing_quote_cache_lookups_total Quote cache lookups by result.',
+        '# TYPE pricing_quote_cache_lookups_total counter',
+    ]
+    for result in ('local', 'shared', 'miss', 'skipped'):
+        lines.append(f'pricing_quote_cache_lookups_total{{result="{result}"}} {stats[result]}')
+    lines += [
+        '# HELP pricing_quote_cache_hit_ratio Share of cacheable quotes served from memory or the shared cache.',
+        '# TYPE pricing_quote_cache_hit_ratio gauge',
+        f'pricing_quote_cache_hit_ratio {stats["hit_rate"]}',
+        '# HELP pricing_quote_cache_entries Quotes held in this process.',
+        '# TYPE pricing_quote_cache_entries gauge',
+        f'pricing_quote_cache_entries {stats["size"]}',
+    ]
+    return '\n'.join(lines) + '\n'
+
+class MetricsView(APIView):
+    """Pricing metrics of this process in Prometheus text format"""
+    
+    def get(self, request):
+        body = registry.render() + render_quote_cache_metrics(quote_cache.stats())
+        return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
+
 # ViewSet alternative for more complex APIs
 # class ProductViewSet(viewsets.ModelViewSet):
 #     queryset = Product.objects.all()
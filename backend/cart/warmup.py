@@ -0,0 +1,182 @@
+"""
+گرم کردن پروسس پیش از رسیدن ترافیک
+
+اولین درخواست‌های هر worker تازه هزینه کامپایل قوانین، خواندن محصولات و
+ساخت URL resolver، تنظیمات DRF و serializerها را می‌پردازند و پس از هر
+استقرار یا افزایش workerها p99 را بالا می‌برند. warm_up همین کارها را یک
+بار از پیش انجام می‌دهد:
+
+- مجموعه قوانین فعال کامپایل‌شده در حافظه پروسس و کش مشترک؛
+- نتیجه سبد یک‌عددی پرتکرارترین محصولات در quote_cache؛
+- URLها و viewها، کلاس‌های پیش‌فرض DRF و فیلدهای serializerها.
+
+با PRICING_WARM_UP، CartConfig.ready آن را در یک thread پس‌زمینه اجرا
+می‌کند. فرمان warm_up_pricing همان مراحل را پیش از ورود ترافیک اجرا می‌کند
+و کش مشترک (قوانین و نتایج) را برای همه workerها گرم می‌کند.
+"""
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.db.models import Count
+from django.urls import resolve, reverse
+from django.utils import timezone
+from rest_framework.settings import api_settings
+
+from .engine import CartLine, price_cart
+from .models import CartItem, Product
+from .quote_cache import QuoteCache, quote_cache
+from .rule_cache import get_active_rule_set
+from .serializers import (
+    CartItemAddSerializer, CartItemInputSerializer, CartItemSerializer, CartItemsSetSerializer, CartSerializer,
+    PricingRuleSerializer, ProductSerializer,
+)
+from .services import PricingService
+from .versions import RULES_VERSION_KEY, get_versions
+
+logger = logging.getLogger(__name__)
+
+# ردیف‌هایی که در این بازه به سبدها اضافه شده‌اند مبنای محصولات پرتکرارند
+HOT_PRODUCTS_WINDOW = timedelta(days=7)
+WARM_URLS = ('calculate-cart', 'cart-management', 'cart-items', 'product-list', 'product-promotions')
+WARM_SERIALIZERS = (
+    CartItemInputSerializer, CartItemSerializer, CartItemAddSerializer, CartItemsSetSerializer, CartSerializer,
+    ProductSerializer, PricingRuleSerializer,
+)
+DRF_DEFAULTS = (
+    'DEFAULT_RENDERER_CLASSES', 'DEFAULT_PARSER_CLASSES', 'DEFAULT_AUTHENTICATION_CLASSES',
+    'DEFAULT_PERMISSION_CLASSES', 'DEFAULT_CONTENT_NEGOTIATION_CLASS', 'EXCEPTION_HANDLER',
+)
+
+# پس از پایان warm_up پس‌زمینه (موفق یا ناموفق) set می‌شود
+finished = threading.Event()
+
+
+def hot_product_ids(limit: int) -> List[int]:
+    """
+    پرتکرارترین محصولات ردیف‌های اخیر سبدها؛ اگر کمتر از limit باشند با
+    جدیدترین محصولات تکمیل می‌شوند تا کاتالوگ تازه هم گرم شود
+
+    upsert افزودن کالا Cart.updated_at را تغییر نمی‌دهد، پس بازه بر اساس
+    added_at ردیف‌هاست.
+    """
+    if limit <= 0:
+        return []
+    product_ids = list(
+        CartItem.objects.filter(added_at__gte=timezone.now() - HOT_PRODUCTS_WINDOW)
+        .values('product_id')
+        .annotate(lines=Count('id'))
+        .order_by('-lines', 'product_id')
+        .values_list('product_id', flat=True)[:limit]
+    )
+    if len(product_ids) < limit:
+        product_ids += Product.objects.exclude(id__in=product_ids).order_by('-id').values_list(
+            'id', flat=True
+        )[:limit - len(product_ids)]
+    return product_ids
+
+
+def prime_quotes(product_ids: List[int]) -> int:
+    """
+    محاسبه نتیجه سبد یک‌عددی هر محصول و نگهداری آن در quote_cache
+
+    نسخه‌ها مانند calculate_cart_total پیش از خواندن محصولات گرفته می‌شوند،
+    برای همه محصولات با یک رفت و برگشت به کش.
+
+    Returns:
+        تعداد نتایجی که تازه محاسبه شدند؛ نتایج موجود در LRU دوباره محاسبه نمی‌شوند
+    """
+    if not quote_cache.enabled or not product_ids:
+        return 0
+    versions = get_versions(*QuoteCache.version_keys(tuple((product_id, 1) for product_id in product_ids)))
+    pending = []
+    for product_id in product_ids:
+        key = quote_cache.key_for(((product_id, 1),), versions)
+        if quote_cache.local.get(key) is None:
+            pending.append((product_id, key))
+
+    products = PricingService.load_product_records(product_id for product_id, _ in pending)
+    rule_set = get_active_rule_set(versions[RULES_VERSION_KEY])
+    primed = 0
+    for product_id, key in pending:
+        if product_id in products:
+            quote_cache.set(key, price_cart([CartLine(product_id, 1)], products, rule_set))
+            primed += 1
+    return primed
+
+
+def prime_urls() -> int:
+    """ساخت URL resolver و import همه viewها"""
+    for name in WARM_URLS:
+        resolve(reverse(name))
+    return len(WARM_URLS)
+
+
+def prime_serializers() -> int:
+    """بارگذاری کلاس‌های پیش‌فرض DRF و ساخت فیلدهای serializerهای پرکاربرد"""
+    for name in DRF_DEFAULTS:
+        getattr(api_settings, name)
+    for serializer_class in WARM_SERIALIZERS:
+        serializer_class().fields
+    return len(WARM_SERIALIZERS)
+
+
+def _step(report: Dict[str, Any], name: str, func: Callable, *args) -> Any:
+    started = time.perf_counter()
+    result = func(*args)
+    report['seconds'][name] = time.perf_counter() - started
+    return result
+
+
+def warm_up(hot_products: Optional[int] = None) -> Dict[str, Any]:
+    """
+    اجرای همه مراحل گرم کردن
+
+    Args:
+        hot_products: تعداد محصولات پرتکرار؛ None یعنی PRICING_WARM_UP_PRODUCTS
+
+    Returns:
+        تعداد قوانین، محصولات و serializerهای گرم‌شده و زمان هر مرحله به ثانیه
+    """
+    if hot_products is None:
+        hot_products = settings.PRICING_WARM_UP_PRODUCTS
+    report = {'seconds': {}}
+    report['urls'] = _step(report, 'urls', prime_urls)
+    report['serializers'] = _step(report, 'serializers', prime_serializers)
+    report['rules'] = len(_step(report, 'rules', get_active_rule_set).rules)
+    product_ids = _step(report, 'hot_products', hot_product_ids, hot_products)
+    report['quotes'] = _step(report, 'quotes', prime_quotes, product_ids)
+    report['products'] = len(product_ids)
+    return report
+
+
+def _warm_up_in_background() -> None:
+    # پرس‌وجو در حین AppConfig.ready هشدار Django را به دنبال دارد؛ تا
+    # پایان بارگذاری همه اپ‌ها صبر می‌شود
+    apps.ready_event.wait()
+    try:
+        report = warm_up()
+        logger.info(
+            "Pricing warm-up: %d rules, %d quotes primed in %.3fs",
+            report['rules'], report['quotes'], sum(report['seconds'].values()),
+        )
+    except DatabaseError as exc:
+        # مثلاً هنگام migrate روی پایگاه داده خالی؛ درخواست‌ها به روال عادی گرم می‌شوند
+        logger.warning("Pricing warm-up skipped: %s", exc)
+    finally:
+        # اتصال‌های پایگاه داده برای هر thread جداست و این thread درخواستی پاسخ نمی‌دهد
+        connections.close_all()
+        finished.set()
+
+
+def start_warm_up() -> threading.Thread:
+    """اجرای warm_up در thread پس‌زمینه؛ برای CartConfig.ready"""
+    finished.clear()
+    thread = threading.Thread(target=_warm_up_in_background, name='pricing-warm-up', daemon=True)
+    thread.start()
+    return thread